@@ -1,10 +1,8 @@
-import threading
-
 from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
 
 from authentication.models import User
-from authentication.utils import send_bulk_email
+from base.jobs import enqueue
 
 
 def is_sha256_hash(text):
@@ -63,6 +61,6 @@ class UserAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
     def set_password(self, request, queryset):
-        threading.Thread(target=send_bulk_email, args=(queryset,)).start()
+        job = enqueue('authentication.send_bulk_email', queryset.values_list('id', flat=True))
 
-        self.message_user(request, 'Emails with password will be sent to the selected users.')
+        self.message_user(request, f'Emails with password will be sent to the selected users (job #{job.pk}).')
@@ -0,0 +1,138 @@
+import secrets
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+# Crockford's base32: uppercase letters and digits without I, L, O and U, which are easily misread
+CROCKFORD_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+
+class IdAllocator:
+    """
+    Random string primary keys drawn from the OS CSPRNG, without reading the table first.
+
+    Uniqueness is enforced by the primary key constraint instead of an exists() query, so two concurrent signups
+    can never both be handed the same id. A collision is an IntegrityError on insert that the caller retries with
+    a new id, see save_with_new_id and bulk_create_with_ids. With an id space of N = len(alphabet) ** length,
+    collision_probability gives the bound that keeps such retries rare.
+    """
+
+    def __init__(self, length, alphabet=CROCKFORD_ALPHABET):
+        """
+        :param length: Characters per id
+        :param alphabet: Characters ids are drawn from, without repeats
+        """
+        if length < 1:
+            raise ValueError("The id length must be positive")
+        if len(alphabet) < 2 or len(set(alphabet)) != len(alphabet):
+            raise ValueError("The id alphabet needs at least two distinct characters")
+        self.length = length
+        self.alphabet = alphabet
+
+    @property
+    def space(self):
+        """
+        Number of distinct ids.
+        """
+        return len(self.alphabet) ** self.length
+
+    def collision_probability(self, existing, new=1):
+        """
+        Upper bound (union bound) on the probability that any of `new` ids collides with one of `existing` ids
+        or with another new id: new * (existing + (new - 1) / 2) / space.
+
+        :param existing: Number of ids already in the table
+        :param new: Number of ids allocated
+        """
+        return min(1.0, new * (existing + (new - 1) / 2) / self.space)
+
+    def allocate(self):
+        return ''.join(secrets.choice(self.alphabet) for _ in range(self.length))
+
+    def allocate_batch(self, count):
+        """
+        Allocate `count` ids that are distinct from each other, duplicates within the batch are redrawn in memory.
+        """
+        ids = set()
+        while len(ids) < count:
+            ids.update(self.allocate() for _ in range(count - len(ids)))
+        return list(ids)
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_user_id_allocator():
+    """
+    Return the process wide allocator of User ids, configured by USER_ID_LENGTH and USER_ID_ALPHABET.
+    """
+    global _allocator
+    with _allocator_lock:
+        if _allocator is None:
+            _allocator = IdAllocator(settings.USER_ID_LENGTH, settings.USER_ID_ALPHABET or CROCKFORD_ALPHABET)
+        return _allocator
+
+
+def _taken_ids(model, ids):
+    return set(model._base_manager.filter(pk__in=list(ids)).values_list('pk', flat=True))
+
+
+def save_with_new_id(instance, save, allocator, max_attempts=None):
+    """
+    Insert a new instance, drawing a new id when the insert fails on a taken primary key.
+
+    The existing table is only read after an insert failed, to tell a taken id from another unique violation.
+
+    :param instance: Unsaved model instance with an allocated primary key
+    :param save: Callable performing the insert
+    :param allocator: IdAllocator the primary key came from
+    :param max_attempts: Inserts before giving up, defaults to settings.USER_ID_MAX_ATTEMPTS
+    """
+    max_attempts = max_attempts or settings.USER_ID_MAX_ATTEMPTS
+    for attempt in range(max_attempts):
+        try:
+            # A savepoint keeps a surrounding transaction usable after the violation
+            with transaction.atomic():
+                return save()
+        except IntegrityError:
+            if attempt == max_attempts - 1 or not _taken_ids(type(instance), [instance.pk]):
+                raise
+            instance.pk = allocator.allocate()
+
+
+def bulk_create_with_ids(model, objs, allocator, batch_size=None, max_attempts=None):
+    """
+    bulk_create new instances under allocated primary keys, redrawing only the ids that turned out to be taken
+    when the insert fails on a unique violation. Relations to the instances must be assigned after this returns.
+
+    :param model: Model class
+    :param objs: Unsaved instances, ids already drawn by the field default are kept unless taken or repeated
+    :param allocator: IdAllocator for the primary keys
+    :param batch_size: Rows per INSERT
+    :param max_attempts: Inserts before giving up, defaults to settings.USER_ID_MAX_ATTEMPTS
+    :return: The created instances
+    """
+    objs = list(objs)
+    in_use = set()
+    for obj in objs:
+        while not obj.pk or obj.pk in in_use:
+            obj.pk = allocator.allocate()
+        in_use.add(obj.pk)
+    max_attempts = max_attempts or settings.USER_ID_MAX_ATTEMPTS
+    for attempt in range(max_attempts):
+        try:
+            with transaction.atomic():
+                return model.objects.bulk_create(objs, batch_size=batch_size)
+        except IntegrityError:
+            taken = _taken_ids(model, (obj.pk for obj in objs))
+            if attempt == max_attempts - 1 or not taken:
+                raise
+            in_use |= taken
+            for obj in objs:
+                if obj.pk in taken:
+                    obj.pk = allocator.allocate()
+                    while obj.pk in in_use:
+                        obj.pk = allocator.allocate()
+                    in_use.add(obj.pk)
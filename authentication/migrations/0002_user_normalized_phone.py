@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 07:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='normalized_phone',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=15, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from base.utils import normalize_phone
+
+
+def backfill_normalized_phone(apps, schema_editor):
+    User = apps.get_model('authentication', 'User')
+    users = []
+    for pk, mobile_number in User.objects.values_list('pk', 'mobile_number').iterator(chunk_size=2000):
+        users.append(User(pk=pk, normalized_phone=normalize_phone(mobile_number)))
+    User.objects.bulk_update(users, ['normalized_phone'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_user_normalized_phone'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_normalized_phone, migrations.RunPython.noop),
+    ]
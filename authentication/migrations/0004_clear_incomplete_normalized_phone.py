@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from base.utils import normalize_phone
+
+
+def clear_incomplete_normalized_phone(apps, schema_editor):
+    # The first backfill stored a bare '+91' (or a few digits after it) for incomplete mobile numbers
+    User = apps.get_model('authentication', 'User')
+    users = []
+    for pk, mobile_number, normalized in User.objects.filter(normalized_phone__isnull=False).values_list(
+            'pk', 'mobile_number', 'normalized_phone').iterator(chunk_size=2000):
+        if normalize_phone(mobile_number) != normalized:
+            users.append(User(pk=pk, normalized_phone=normalize_phone(mobile_number)))
+    User.objects.bulk_update(users, ['normalized_phone'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_backfill_user_normalized_phone'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_incomplete_normalized_phone, migrations.RunPython.noop),
+    ]
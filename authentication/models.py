@@ -1,5 +1,3 @@
-import uuid
-
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
 from django.core import mail
@@ -7,20 +5,16 @@ from django.db import models
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from authentication.ids import get_user_id_allocator, save_with_new_id
+from base.utils import normalize_phone
+
 
 def generate_unique_code():
     """
-    generate unique code for user
+    generate unique code for user, drawn by the user id allocator without querying the table.
+    A taken code fails the insert and is drawn again in User.save, see authentication.ids
     """
-    model = User
-    while True:
-        code = str(uuid.uuid4()).replace("-", "").upper()[:6]
-        try:
-            if not model.objects.filter(pk=code).exists():
-                break
-        except Exception as e:
-            return code
-    return code
+    return get_user_id_allocator().allocate()
 
 
 class CustomUserManager(BaseUserManager):
@@ -118,3 +112,14 @@ class User(BaseUser):
     """
 
     mobile_number = models.CharField(max_length=20, blank=True, null=True)
+    normalized_phone = models.CharField(max_length=15, blank=True, null=True, editable=False,
+                                        db_index=True)  # Canonical mobile number, used for exact lookups
+
+    def save(self, *args, **kwargs):
+        self.normalized_phone = normalize_phone(self.mobile_number)
+        if kwargs.get('update_fields') is not None and 'mobile_number' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'normalized_phone'}
+        if self._state.adding:
+            save_with_new_id(self, lambda: super(User, self).save(*args, **kwargs), get_user_id_allocator())
+        else:
+            super().save(*args, **kwargs)
@@ -0,0 +1,8 @@
+from authentication.models import User
+from authentication.utils import send_bulk_email
+from base.jobs import current_job, register_task
+
+
+@register_task('authentication.send_bulk_email', batch_size=500)
+def send_bulk_email_task(user_ids):
+    return send_bulk_email(User.objects.filter(id__in=user_ids), batch=f"job{current_job().pk}")
@@ -0,0 +1,56 @@
+import re
+from unittest import mock
+
+from django.core import mail
+from django.test import TestCase
+
+import authentication.tasks  # noqa: F401, registers the tasks
+from authentication.models import User
+from authentication.utils import hash_passwords, send_bulk_email
+from base.jobs import claim_job, enqueue, run_job
+from base.models import EmailOutbox, Job
+
+
+@mock.patch('base.mailer._mailer', None)
+class SendBulkEmailTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(email=f"user{i}@example.com", full_name=f"User {i}") for i in range(3)]
+
+    def test_hashes_match_their_passwords(self):
+        passwords = ['first', 'second']
+        for password, hashed in zip(passwords, hash_passwords(passwords)):
+            self.assertTrue(User(password=hashed).check_password(password))
+
+    def test_passwords_are_reset_and_queued_once_per_batch(self):
+        self.assertEqual(send_bulk_email(User.objects.all(), batch='batch1'), 0)
+        hashes = dict(User.objects.values_list('id', 'password'))
+        self.assertTrue(all(hashes.values()))
+        # The passwords are only in the sent emails, the outbox records them without their bodies
+        for message in mail.outbox:
+            html = message.message().get_payload()[-1].get_payload(decode=True).decode()
+            password = re.search(r'Password: <strong>(\w+)</strong>', html).group(1)
+            self.assertTrue(User.objects.get(email=message.to[0]).check_password(password))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(set(EmailOutbox.objects.values_list('sensitive', 'status', 'html_body', 'text_body')),
+                         {(True, EmailOutbox.SENT, '', '')})
+
+        # A replayed batch neither resets the passwords nor queues the emails again
+        self.assertEqual(send_bulk_email(User.objects.all(), batch='batch1'), 0)
+        self.assertEqual(dict(User.objects.values_list('id', 'password')), hashes)
+        self.assertEqual((EmailOutbox.objects.count(), len(mail.outbox)), (3, 3))
+
+    def test_the_job_keys_the_emails_by_job_and_user(self):
+        User.objects.create(email='', full_name='No email')
+        enqueue('authentication.send_bulk_email', User.objects.values_list('id', flat=True))
+        job = claim_job('worker-1')
+        run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.failed_items), (Job.COMPLETED, 1))
+        self.assertEqual(set(EmailOutbox.objects.values_list('key', flat=True)),
+                         {f"dashboard-login:{user.pk}:job{job.pk}" for user in self.users})
+
+    def test_unsent_emails_are_counted_as_failed(self):
+        with mock.patch('base.mailer.BackendMailer.send_raw', side_effect=ConnectionError('refused')):
+            self.assertEqual(send_bulk_email(User.objects.all(), batch='batch1'), 3)
+        self.assertEqual(set(EmailOutbox.objects.values_list('status', flat=True)), {EmailOutbox.FAILED})
@@ -1,82 +1,103 @@
 import logging
-import random
-import smtplib
-import ssl
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from time import sleep
-
-import certifi
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import Group
-from django.template.loader import render_to_string
 from django.utils.crypto import get_random_string
-from django.utils.html import strip_tags
+
+from authentication.models import User
+from base.models import EmailOutbox
+from base.outbox import send_sensitive_emails
 
 logger = logging.getLogger('home')
 from config import settings
 
+DASHBOARD_LOGIN_SUBJECT = "Dashboard for Make-A-Ton 7.0"
+
+
+def dashboard_login_key(user, batch):
+    return f"dashboard-login:{user.pk}:{batch}"
+
+
+def dashboard_login_email(user, random_pass, batch):
+    """
+    Outbox entry of the dashboard credentials email, keyed by user and reset batch.
+    """
+    return (dashboard_login_key(user, batch), user.email, DASHBOARD_LOGIN_SUBJECT,
+            'emails/team_dashboard_login.html', {
+                'full_name': user.full_name,
+                'email': user.email,
+                'password': random_pass,
+            })
+
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+
+def get_hash_pool():
+    """
+    Return the process wide pool hashing passwords, created on first use.
+
+    The pool spawns fresh interpreters instead of forking, the job worker that creates it runs several threads
+    and holds database connections a forked child would inherit.
+    """
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ProcessPoolExecutor(max_workers=hash_workers(),
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return _hash_pool
+
+
+def hash_workers():
+    return settings.PASSWORD_HASH_WORKERS or os.cpu_count()
+
+
+def hash_passwords(passwords):
+    """
+    Hash passwords in parallel.
+
+    PBKDF2 costs hundreds of milliseconds per password, so the hashes are computed across processes
+    instead of serially under the GIL.
+
+    :param passwords: List of plaintext passwords
+    :return: List of hashes in the order of `passwords`
+    """
+    if not passwords:
+        return []
+    chunksize = max(len(passwords) // (hash_workers() * 4), 1)
+    return list(get_hash_pool().map(make_password, passwords, chunksize=chunksize))
+
+
+def send_bulk_email(queryset, batch):
+    """
+    Reset the password of every user and email them the new credentials.
+
+    The plaintext passwords only live in memory: the new hashes are committed together with outbox rows that
+    record the emails without their bodies, then the emails are rendered and sent from memory. Users that
+    already have an email of this batch in the outbox are skipped, so a replayed batch neither resets their
+    password again nor leaves them with a password they were never sent.
+
+    :param queryset: Users
+    :param batch: Identifier of the reset, part of the outbox keys
+    :return: Number of users without an email or whose email could not be sent
+    """
+    users = list(queryset)
+    keys = {dashboard_login_key(user, batch) for user in users}
+    queued = set(EmailOutbox.objects.filter(key__in=keys).values_list('key', flat=True))
+    without_email = sum(1 for user in users if not user.email)
+    users = [user for user in users if user.email and dashboard_login_key(user, batch) not in queued]
 
-def send_email(receiver_email, user, random_pass):
-    sender_email = settings.EMAIL_HOST_USER
-    password = settings.EMAIL_HOST_PASSWORD
-    # receiver_email = "contact.makeaton@gmail.com"
-
-    message = MIMEMultipart("alternative")
-    message["Subject"] = "Dashboard for Make-A-Ton 7.0"
-    message["From"] = sender_email
-    message["To"] = receiver_email
-
-    # Render the email content using the HTML template
-    email_content = render_to_string('emails/team_dashboard_login.html', {
-        'full_name': user.full_name,
-        'email': user.email,
-        'password': random_pass,
-    })
-
-    # Strip HTML tags for the plain text alternative
-    plain_message = strip_tags(email_content)
-
-    part1 = MIMEText(plain_message, "plain")
-    part2 = MIMEText(email_content, "html")
-
-    # Add HTML/plain-text parts to MIMEMultipart message
-    # The email client will try to render the last part first
-    message.attach(part1)
-    message.attach(part2)
-
-    # Create secure connection with server and send email
-    context = ssl.create_default_context(cafile=certifi.where())
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-        server.login(sender_email, password)
-        server.sendmail(
-            sender_email, receiver_email, message.as_string()
-        )
-
-
-def send_bulk_email(queryset):
-    i = 0
-    for user in queryset:
-        # check user exists in a group
-        # if us
-        # if not Group.objects.get(name='Team Leader').user_set.filter(id=user.id).exists():
-        #     logger.info(f'{user.email} is not a team leader so skipping')
-        #     continue
-        try:
-            random_password = get_random_string(length=5)
-            user.set_password(random_password)
-            user.save()
-            logger.info(f'Password reset for {user.email}')
-
-            i += 1
-            if i % 50 == 0:
-                sleep(random.randint(200, 210))
-            else:
-                sleep(random.randint(4, 10))
-
-            send_email(user.email, user, random_password)
-
-            i += 1
-        except Exception as e:
-            user.password = 'makeaton@123'
-            user.save()
-            logger.error(f"Error in sending email to {user.email}: {e}")
+    passwords = [get_random_string(length=5) for _ in users]
+    for user, hashed in zip(users, hash_passwords(passwords)):
+        user.password = hashed
+    failed = send_sensitive_emails(
+        [dashboard_login_email(user, password, batch) for user, password in zip(users, passwords)],
+        save=lambda: User.objects.bulk_update(users, ['password'], batch_size=500))
+    logger.info(f'Password reset for {len(users)} users, {failed} emails failed, {len(queued)} already in the outbox, '
+                f'{without_email} without an email')
+    return without_email + failed
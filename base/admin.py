@@ -0,0 +1,104 @@
+from django.contrib import admin
+
+from .models import EmailOutbox, Job, JobCheckpoint
+from .outbox import dispatch_pending_emails
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 1:
+        return f"{seconds * 1000:.0f} ms"
+    if seconds < 120:
+        return f"{seconds:.1f} s"
+    return f"{seconds / 60:.1f} min"
+
+
+class JobCheckpointInline(admin.TabularInline):
+    model = JobCheckpoint
+    fields = ('created_at', 'items', 'failed_items', 'seconds')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """
+    Live view of the background jobs, the changelist reloads itself so throughput can be watched while tuning
+    the worker concurrency.
+    """
+    change_list_template = 'admin/job_changelist.html'
+    list_display = ('id', 'name', 'status', 'progress', 'throughput_display', 'eta', 'error_rate_display',
+                    'p50_latency', 'p95_latency', 'worker', 'started_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('name', 'status', 'batch_size', 'progress', 'failed_items', 'throughput_display', 'eta',
+                       'error_rate_display', 'p50_latency', 'p95_latency', 'attempts', 'worker',
+                       'started_at', 'heartbeat_at', 'finished_at', 'error')
+    fields = readonly_fields
+    inlines = [JobCheckpointInline]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('checkpoints')
+
+    def has_add_permission(self, request):
+        return False
+
+    def progress(self, obj):
+        percent = obj.cursor * 100 / obj.total_items if obj.total_items else 100
+        return f"{obj.cursor}/{obj.total_items} ({percent:.0f}%)"
+
+    def throughput_display(self, obj):
+        return f"{obj.throughput:.2f} items/s"
+
+    def eta(self, obj):
+        return format_seconds(obj.eta_seconds)
+
+    def error_rate_display(self, obj):
+        return f"{obj.error_rate:.1%} ({obj.failed_items})"
+
+    def p50_latency(self, obj):
+        return format_seconds(obj.item_latency_percentile(50))
+
+    def p95_latency(self, obj):
+        return format_seconds(obj.item_latency_percentile(95))
+
+    throughput_display.short_description = 'Throughput'
+    error_rate_display.short_description = 'Error rate'
+    p50_latency.short_description = 'p50 / item'
+    p95_latency.short_description = 'p95 / item'
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('to_email', 'subject', 'status', 'attempts', 'sent_at', 'created_at')
+    list_filter = ('status', 'template')
+    search_fields = ('to_email', 'key')
+    readonly_fields = ('key', 'template', 'to_email', 'subject', 'status', 'attempts', 'error', 'sent_at', 'text_body')
+    fields = readonly_fields
+    actions = ['retry_emails']
+
+    def get_fields(self, request, obj=None):
+        # Credential emails have no stored bodies, rows queued before they were sent from memory may still hold some
+        if obj is not None and obj.sensitive:
+            return [field for field in self.fields if field != 'text_body']
+        return self.fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def retry_emails(self, request, queryset):
+        # Rows failed as interrupted may or may not have been delivered, they are only resent from here
+        unsent = queryset.exclude(status=EmailOutbox.SENT)
+        skipped = unsent.filter(sensitive=True).count()
+        count = unsent.filter(sensitive=False).update(status=EmailOutbox.RETRY)
+        job = dispatch_pending_emails()
+        message = f'{count} emails queued for retry' + (f' (job #{job.pk}).' if job else '.')
+        if skipped:
+            message += f' {skipped} unsent credential emails cannot be resent, reset those passwords again.'
+        self.message_user(request, message)
+
+    retry_emails.short_description = 'Retry selected emails'
@@ -0,0 +1,259 @@
+import logging
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from base.models import Job, JobCheckpoint
+
+logger = logging.getLogger('home')
+
+TASKS = {}
+WORKER_STARTUP = []
+
+_running = threading.local()
+
+
+class JobLost(Exception):
+    """
+    The job was claimed by another worker after its heartbeat went stale, this worker must stop running it.
+    """
+
+
+def register_task(name, batch_size=1):
+    """
+    Register a function as a background task.
+
+    The function receives a list of up to `batch_size` items and may return the number of items that failed.
+    Functions handling their items one by one time them with `item_timer`, for the latency percentiles.
+    Tasks live in a `tasks.py` module of their app, the worker imports those modules on start.
+
+    :param name: Unique task name used when enqueuing
+    :param batch_size: Default number of items per call, None to hand all items over in one call
+    """
+
+    def decorator(func):
+        TASKS[name] = (func, batch_size)
+        return func
+
+    return decorator
+
+
+def on_worker_start(func):
+    """
+    Register a function every worker thread calls before claiming jobs, e.g. to warm per-thread caches.
+    Like tasks, these live in a `tasks.py` module of their app.
+    """
+    WORKER_STARTUP.append(func)
+    return func
+
+
+def current_job():
+    """
+    Return the job the calling worker thread is running, None outside of a job. Tasks use it to derive keys that
+    stay the same when a batch is replayed after a crash.
+    """
+    return getattr(_running, 'job', None)
+
+
+class ItemTimer:
+    """
+    Wall times of the items of a batch, recorded by tasks that handle their items one by one.
+    """
+
+    def __init__(self):
+        self.seconds = []
+
+    @contextmanager
+    def time(self):
+        """
+        Time the item handled inside the block. Safe to use from several threads at once.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.seconds.append(time.monotonic() - started)
+
+
+def item_timer():
+    """
+    Return the ItemTimer of the batch the calling worker thread runs, a detached one outside of a job. Tasks that
+    hand their items to other threads get it first and time the items with it there.
+    """
+    return getattr(_running, 'timer', None) or ItemTimer()
+
+
+def sample_timings(seconds, limit=JobCheckpoint.MAX_ITEM_TIMINGS):
+    """
+    Sort item timings and bound them to `limit` evenly spaced quantiles, which keep the percentiles they give.
+    """
+    seconds = sorted(seconds)
+    if len(seconds) <= limit:
+        return seconds
+    step = (len(seconds) - 1) / (limit - 1)
+    return [seconds[round(i * step)] for i in range(limit)]
+
+
+def enqueue(name, items, batch_size=None):
+    """
+    Queue a job for the worker.
+
+    The job row is written in the caller's transaction, so it is only picked up once that transaction commits.
+
+    :param name: Name of a registered task
+    :param items: List of JSON serializable items (usually primary keys)
+    :param batch_size: Items per task call, defaults to the task's registered batch size
+    :return: The created Job
+    """
+    items = list(items)
+    if batch_size is None:
+        _, batch_size = TASKS.get(name, (None, 1))
+    return Job.objects.create(name=name, items=items, batch_size=batch_size or max(len(items), 1))
+
+
+def claim_job(worker):
+    """
+    Claim the oldest pending job, or a running job whose worker stopped sending heartbeats.
+
+    :param worker: Name of the claiming worker
+    :return: The claimed Job or None
+    """
+    stale = timezone.now() - timedelta(seconds=settings.JOB_STALE_AFTER)
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            Q(status=Job.PENDING) | Q(status=Job.RUNNING, heartbeat_at__lt=stale)
+        ).order_by('created_at').first()
+        if job is None:
+            return None
+        if job.status == Job.RUNNING:
+            logger.info(f"Resuming {job} from item {job.cursor}, last seen on {job.worker}")
+        job.status = Job.RUNNING
+        job.worker = worker
+        job.attempts += 1
+        job.heartbeat_at = timezone.now()
+        job.started_at = job.started_at or job.heartbeat_at
+        job.save(update_fields=['status', 'worker', 'attempts', 'heartbeat_at', 'started_at', 'updated_at'])
+    return job
+
+
+class JobHeartbeat:
+    """
+    Thread refreshing the heartbeat of a running job every JOB_HEARTBEAT_INTERVAL seconds, so a batch running
+    longer than JOB_STALE_AFTER is not taken for a dead worker and claimed again.
+    """
+
+    def __init__(self, job, interval=None):
+        """
+        :param job: Job claimed by `claim_job`
+        :param interval: Seconds between heartbeats, defaults to settings.JOB_HEARTBEAT_INTERVAL
+        """
+        self.job = job
+        self.interval = interval or settings.JOB_HEARTBEAT_INTERVAL
+        self.lost = threading.Event()  # Set once another worker holds the job
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"heartbeat-{job.pk}", daemon=True)
+
+    def beat(self):
+        updated = Job.objects.filter(id=self.job.id, worker=self.job.worker, status=Job.RUNNING).update(
+            heartbeat_at=timezone.now())
+        if not updated:
+            self.lost.set()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval) and not self.lost.is_set():
+                try:
+                    self.beat()
+                except Exception as e:
+                    logger.error(f"Could not send the heartbeat of {self.job}: {e}")
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+def save_progress(job, items, failed, seconds, item_seconds=()):
+    """
+    Record a finished batch and move the cursor past it in one transaction, as long as this worker still holds
+    the job.
+
+    :param item_seconds: Wall times of the batch's items, see sample_timings
+    :raises JobLost: When another worker claimed the job meanwhile, nothing is written then
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        JobCheckpoint.objects.create(job=job, items=items, failed_items=failed, seconds=seconds,
+                                     item_seconds=sample_timings(item_seconds))
+        updated = Job.objects.filter(id=job.id, worker=job.worker).update(
+            cursor=job.cursor + items, failed_items=job.failed_items + failed, heartbeat_at=now, updated_at=now)
+        if not updated:
+            raise JobLost(f"{job} is no longer held by {job.worker}")
+    job.cursor += items
+    job.failed_items += failed
+    job.heartbeat_at = now
+
+
+def run_job(job):
+    """
+    Run a claimed job from its checkpoint, saving the cursor after every batch.
+
+    A heartbeat thread keeps the job claimed while a batch runs. If another worker claims it anyway, this worker
+    stops at the end of the batch without writing its progress.
+
+    :param job: Job claimed by `claim_job`
+    """
+    if job.name not in TASKS:
+        return finish_job(job, Job.FAILED, f"Unknown task {job.name}")
+    if job.attempts > settings.JOB_MAX_ATTEMPTS:
+        return finish_job(job, Job.FAILED, f"Gave up after {job.attempts - 1} attempts")
+    func, _ = TASKS[job.name]
+    _running.job = job
+    try:
+        with JobHeartbeat(job) as heartbeat:
+            while job.cursor < job.total_items:
+                if heartbeat.lost.is_set():
+                    raise JobLost(f"{job} is no longer held by {job.worker}")
+                batch = job.items[job.cursor:job.cursor + job.batch_size]
+                timer = _running.timer = ItemTimer()
+                started = time.monotonic()
+                failed = func(batch) or 0
+                seconds = time.monotonic() - started
+                # A single item batch is timed as a whole when its task does not time it
+                item_seconds = timer.seconds or ([seconds] if len(batch) == 1 else [])
+                save_progress(job, len(batch), failed, seconds, item_seconds)
+    except JobLost as e:
+        logger.warning(f"Stopped at item {job.cursor}: {e}")
+        return
+    except Exception as e:
+        logger.error(f"Job {job} failed at item {job.cursor}: {e}")
+        return finish_job(job, Job.FAILED, traceback.format_exc())
+    finally:
+        _running.job = _running.timer = None
+    finish_job(job, Job.COMPLETED)
+
+
+def finish_job(job, status, error=None):
+    job.status = status
+    job.error = error
+    job.finished_at = timezone.now()
+    # Only the worker holding the job may finish it
+    updated = Job.objects.filter(id=job.id, worker=job.worker).update(
+        status=status, error=error, finished_at=job.finished_at, updated_at=job.finished_at)
+    if not updated:
+        logger.warning(f"Job {job} is no longer held by {job.worker}, not marking it {status}")
+        return
+    logger.info(f"Job {job} finished: {job.cursor}/{job.total_items} items, {job.failed_items} failed, "
+                f"{job.throughput:.2f} items/s")
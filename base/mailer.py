@@ -0,0 +1,191 @@
+import logging
+import smtplib
+import ssl
+import threading
+import time
+from email import message_from_bytes
+
+import certifi
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+logger = logging.getLogger('home')
+
+# Errors after which the connection is dropped and the message is sent again over a new one
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+SMTP_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+
+
+class SMTPMailer:
+    """
+    SMTP sender reusing one authenticated connection for many messages.
+
+    The connection is opened lazily, recycled after `max_messages_per_connection` messages and
+    reopened when the server drops it. Sends are serialised and spaced to stay under `rate_limit`.
+    """
+
+    def __init__(self, host=None, port=None, username=None, password=None, use_ssl=None,
+                 max_messages_per_connection=None, rate_limit=None, max_retries=2, timeout=30):
+        """
+        :param host: SMTP host, defaults to settings.EMAIL_HOST
+        :param port: SMTP port, defaults to settings.EMAIL_PORT
+        :param username: Login user, defaults to settings.EMAIL_HOST_USER
+        :param password: Login password, defaults to settings.EMAIL_HOST_PASSWORD
+        :param use_ssl: Connect over implicit TLS, defaults to settings.EMAIL_USE_SSL
+        :param max_messages_per_connection: Messages sent before reconnecting, defaults to
+            settings.EMAIL_MAX_MESSAGES_PER_CONNECTION
+        :param rate_limit: Maximum messages per minute, 0 for no limit, defaults to settings.EMAIL_RATE_LIMIT
+        :param max_retries: Reconnect attempts per message
+        :param timeout: Socket timeout in seconds
+        """
+        self.host = host or settings.EMAIL_HOST
+        self.port = port or settings.EMAIL_PORT
+        self.username = settings.EMAIL_HOST_USER if username is None else username
+        self.password = settings.EMAIL_HOST_PASSWORD if password is None else password
+        self.use_ssl = settings.EMAIL_USE_SSL if use_ssl is None else use_ssl
+        self.max_messages_per_connection = (max_messages_per_connection
+                                            or settings.EMAIL_MAX_MESSAGES_PER_CONNECTION)
+        rate_limit = settings.EMAIL_RATE_LIMIT if rate_limit is None else rate_limit
+        self.interval = 60 / rate_limit if rate_limit else 0
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.connection = None
+        self.sent_on_connection = 0
+        self.next_send_at = 0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        context = ssl.create_default_context(cafile=certifi.where())
+        if self.use_ssl:
+            connection = smtplib.SMTP_SSL(self.host, self.port, context=context, timeout=self.timeout)
+        else:
+            connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.ehlo()
+            # Submission ports (587) upgrade with STARTTLS, local stand-ins such as aiosmtpd offer neither it nor AUTH
+            if not self.use_ssl and connection.has_extn('starttls'):
+                connection.starttls(context=context)
+                connection.ehlo()
+            if self.username and connection.has_extn('auth'):
+                connection.login(self.username, self.password)
+        except BaseException:
+            connection.close()
+            raise
+        self.connection = connection
+        self.sent_on_connection = 0
+
+    def _disconnect(self):
+        if self.connection is None:
+            return
+        try:
+            self.connection.quit()
+        except (smtplib.SMTPException, OSError):
+            # The server may already have closed the connection
+            self._drop()
+        self.connection = None
+
+    def _drop(self):
+        """
+        Close the socket of a broken connection without the QUIT exchange.
+        """
+        if self.connection is None:
+            return
+        try:
+            self.connection.close()
+        except OSError:
+            pass
+        self.connection = None
+
+    def _throttle(self):
+        if not self.interval:
+            return
+        wait = self.next_send_at - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.next_send_at = time.monotonic() + self.interval
+
+    def send(self, message):
+        """
+        Send a message, reconnecting if the connection was dropped.
+
+        :param message: email.message.Message with From and To headers
+        """
+        self._deliver(lambda connection: connection.send_message(message))
+
+    def send_raw(self, from_email, to_emails, message):
+        """
+        Send an already serialised message, see base.mailmerge.build_message.
+
+        :param from_email: Envelope sender
+        :param to_emails: List of envelope recipients
+        :param message: Message bytes with CRLF line endings
+        """
+        self._deliver(lambda connection: connection.sendmail(from_email, to_emails, message))
+
+    def _deliver(self, send):
+        with self.lock:
+            self._throttle()
+            for attempt in range(self.max_retries + 1):
+                try:
+                    if self.connection is None or self.sent_on_connection >= self.max_messages_per_connection:
+                        self._disconnect()
+                        self._connect()
+                    send(self.connection)
+                    self.sent_on_connection += 1
+                    return
+                except RECONNECT_ERRORS as e:
+                    self._drop()
+                    if attempt == self.max_retries:
+                        raise
+                    logger.info(f"SMTP connection lost ({e}), reconnecting")
+                    time.sleep(2 ** attempt)
+
+    def close(self):
+        with self.lock:
+            self._disconnect()
+
+
+class RawEmailMessage(EmailMessage):
+    """
+    Already serialised message handed to a Django email backend.
+    """
+
+    def __init__(self, from_email, to, raw):
+        super().__init__(from_email=from_email, to=to)
+        self.raw = raw
+
+    def message(self):
+        return message_from_bytes(self.raw)
+
+
+class BackendMailer:
+    """
+    Sender going through the configured Django email backend, used when EMAIL_BACKEND is not the SMTP backend,
+    e.g. the locmem backend of the test runner or the console backend in development.
+    """
+
+    def send(self, message):
+        self.send_raw(message['From'], message.get_all('To'), message.as_bytes())
+
+    def send_raw(self, from_email, to_emails, message):
+        get_connection().send_messages([RawEmailMessage(from_email, to_emails, message)])
+
+    def close(self):
+        pass
+
+
+_mailer = None
+_mailer_lock = threading.Lock()
+
+
+def get_mailer():
+    """
+    Return the process wide mailer so all senders share one connection and rate limit.
+    """
+    global _mailer
+    with _mailer_lock:
+        if _mailer is None:
+            _mailer = SMTPMailer() if settings.EMAIL_BACKEND == SMTP_BACKEND else BackendMailer()
+        return _mailer
@@ -0,0 +1,89 @@
+import base64
+import re
+import uuid
+from email.header import Header
+from functools import lru_cache
+
+from django.template.loader import get_template
+from django.utils.html import conditional_escape, strip_tags
+
+MERGE_FIELDS = ('full_name', 'team_name', 'conductor', 'email', 'password')
+
+# Private use characters survive autoescaping and strip_tags untouched
+PLACEHOLDER = '\ue000{}\ue001'
+PLACEHOLDER_RE = re.compile('\ue000(\\w+)\ue001')
+
+
+class MergeTemplate:
+    """
+    Email template rendered once with placeholders and split into literal parts and merge fields.
+
+    The plain text part is derived from the same render, so strip_tags runs once per template instead of once
+    per recipient. Only fits templates that print the merge fields without branching or filtering on them.
+    """
+
+    def __init__(self, template_name, fields=MERGE_FIELDS):
+        """
+        :param template_name: Name of the email template, e.g. "emails/rsvp.html"
+        :param fields: Context variables filled per recipient
+        """
+        self.fields = fields
+        html = get_template(template_name).render({field: PLACEHOLDER.format(field) for field in fields})
+        # Splitting on the capturing group alternates literal parts and field names
+        self.html_parts = PLACEHOLDER_RE.split(html)
+        self.text_parts = PLACEHOLDER_RE.split(strip_tags(html))
+
+    @staticmethod
+    def fill(parts, values):
+        parts = parts.copy()
+        for i in range(1, len(parts), 2):
+            parts[i] = values[parts[i]]
+        return ''.join(parts)
+
+    def render(self, context):
+        """
+        Fill the template for one recipient, with the same output as render_to_string and strip_tags.
+
+        :param context: Values of the merge fields, missing fields render empty
+        :return: (html, text) tuple
+        """
+        values = {field: conditional_escape(context.get(field, '')) for field in self.fields}
+        return self.fill(self.html_parts, values), self.fill(self.text_parts, values)
+
+
+@lru_cache(maxsize=None)
+def get_merge_template(template_name):
+    return MergeTemplate(template_name)
+
+
+@lru_cache(maxsize=64)
+def _headers(from_email, subject):
+    if not subject.isascii():
+        subject = Header(subject, 'utf-8').encode()
+    return (f"MIME-Version: 1.0\r\n"
+            f"Subject: {subject}\r\n"
+            f"From: {from_email}\r\n").encode()
+
+
+def _part(content_type, body):
+    return (f'\r\nContent-Type: {content_type}; charset="utf-8"\r\n'
+            f'Content-Transfer-Encoding: base64\r\n\r\n').encode() + \
+        base64.encodebytes(body.encode()).replace(b'\n', b'\r\n')
+
+
+def build_message(from_email, to_email, subject, text, html):
+    """
+    Build a multipart/alternative message as raw bytes ready for SMTP, without the email package's object tree.
+
+    :return: Message bytes with CRLF line endings
+    """
+    boundary = uuid.uuid4().hex
+    delimiter = f"--{boundary}".encode()
+    return b''.join((
+        _headers(from_email, subject),
+        f'To: {to_email}\r\nContent-Type: multipart/alternative; boundary="{boundary}"\r\n\r\n'.encode(),
+        # The email client will try to render the last part first
+        delimiter, _part('text/plain', text),
+        delimiter, _part('text/html', html),
+        delimiter, b'--\r\n',
+    ))
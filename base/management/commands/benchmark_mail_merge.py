@@ -0,0 +1,62 @@
+import time
+from email import message_from_bytes
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+
+from base.mailmerge import build_message, get_merge_template
+
+SENDER = 'noreply@makeaton.in'
+SUBJECT = 'Make-A-Ton 7.0'
+
+
+def contexts(count):
+    return [{'full_name': f'Participant <{i}>', 'team_name': f'Team & {i}', 'conductor': 'for conductor track',
+             'email': f'leader{i}@example.com', 'password': f'pw{i:05d}'} for i in range(count)]
+
+
+def render_template_path(template, context):
+    html = render_to_string(template, context)
+    message = MIMEMultipart("alternative")
+    message["Subject"] = SUBJECT
+    message["From"] = SENDER
+    message["To"] = context['email']
+    message.attach(MIMEText(strip_tags(html), "plain"))
+    message.attach(MIMEText(html, "html"))
+    return message.as_bytes()
+
+
+def mail_merge_path(template, context):
+    html, text = get_merge_template(template).render(context)
+    return build_message(SENDER, context['email'], SUBJECT, text, html)
+
+
+def parts(raw):
+    return [part.get_payload(decode=True) for part in message_from_bytes(raw).get_payload()]
+
+
+class Command(BaseCommand):
+    help = 'Compare render_to_string + strip_tags + MIMEMultipart against the mail merge renderer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=2000, help='Messages built per template and path')
+
+    def handle(self, *args, **options):
+        recipients = contexts(options['count'])
+        for template in ('emails/rsvp.html', 'emails/team_dashboard_login.html'):
+            # Both paths must produce the same plain text and HTML parts
+            if parts(render_template_path(template, recipients[0])) != parts(mail_merge_path(template, recipients[0])):
+                self.stderr.write(self.style.ERROR(f"{template}: mail merge output differs from render_to_string"))
+                return
+
+            timings = []
+            for build in (render_template_path, mail_merge_path):
+                start = time.perf_counter()
+                for context in recipients:
+                    build(template, context)
+                timings.append((time.perf_counter() - start) / len(recipients) * 1e6)
+            self.stdout.write(f"{template}: render_to_string {timings[0]:.0f} us/message, "
+                              f"mail merge {timings[1]:.0f} us/message ({timings[0] / timings[1]:.1f}x)")
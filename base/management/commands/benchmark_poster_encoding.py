@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from updates.services.face_with_target_size import FaceNotDetectedError
+from updates.services.poster import encode_image
+
+# (format, quality) pairs compared by default, quality is ignored for PNG
+ENCODING_OPTIONS = (('png', None), ('jpeg', 70), ('jpeg', 85), ('jpeg', 95), ('webp', 70), ('webp', 85),
+                    ('webp', 95))
+
+
+class Command(BaseCommand):
+    help = 'Compare encode time and file size of the poster formats, for the full poster and its thumbnail.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('photo', help='Profile photo to render the poster from')
+        parser.add_argument('--thumbnail-width', type=int, default=300)
+        parser.add_argument('--repeat', type=int, default=3, help='Encodes per option, the fastest one is reported')
+
+    def handle(self, *args, **options):
+        from updates.models import ImParticipating
+
+        try:
+            poster = ImParticipating.poster_template.place_head(options['photo'])
+        except FaceNotDetectedError as e:
+            raise CommandError(str(e))
+        width = options['thumbnail_width']
+        thumbnail = poster.resize((width, round(poster.height * width / poster.width)), Image.BILINEAR,
+                                  reducing_gap=2.0)
+
+        self.stdout.write(f"{'format':<12}{'poster ms':>10}{'poster KB':>11}{'thumb ms':>10}{'thumb KB':>10}")
+        for output_format, quality in ENCODING_OPTIONS:
+            results = []
+            for image in (poster, thumbnail):
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    content = encode_image(image, output_format, quality)
+                    timings.append(time.perf_counter() - start)
+                results.append((min(timings) * 1000, len(content) / 1024))
+            (poster_ms, poster_kb), (thumbnail_ms, thumbnail_kb) = results
+            label = f"{output_format} q{quality}" if quality else output_format
+            self.stdout.write(
+                f"{label:<12}{poster_ms:>10.0f}{poster_kb:>11.0f}{thumbnail_ms:>10.0f}{thumbnail_kb:>10.0f}")
@@ -0,0 +1,91 @@
+import multiprocessing
+import resource
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PHOTO_SUFFIXES = ('.jpg', '.jpeg', '.png')
+
+
+def render_photos(template_args, photos, detection_max_side, repeat):
+    """
+    Render every photo in a fresh process so the peak RSS belongs to one detection mode only.
+
+    :return: (latencies in seconds, RSS in KB after loading the template, peak RSS in KB, head crops)
+    """
+    from updates.services.face_with_target_size import FaceNotDetectedError, detect_head_and_crop_circle
+    from updates.services.poster import PosterTemplate
+
+    template = PosterTemplate(*template_args, detection_max_side=detection_max_side)
+    template.warm()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    latencies, crops = [], {}
+    for photo in photos:
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                template.place_head(photo)
+                latencies.append(time.perf_counter() - start)
+            crops[photo] = detect_head_and_crop_circle(photo, target_size=template.circle_diameter,
+                                                       detection_max_side=detection_max_side)
+        except FaceNotDetectedError:
+            crops[photo] = None
+    return latencies, baseline, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, crops
+
+
+class Command(BaseCommand):
+    help = 'Compare poster latency and peak memory of full resolution and downscaled face detection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('photos', nargs='?',
+                            help='Directory of profile photos to render, defaults to a fixed set of synthetic faces '
+                                 'so runs are comparable across machines')
+        parser.add_argument('--max-side', type=int, default=settings.POSTER_DETECTION_MAX_SIDE or 1024,
+                            help='Longest side of the downscaled detection copy')
+        parser.add_argument('--repeat', type=int, default=3, help='Renders per photo')
+
+    def handle(self, *args, **options):
+        if options['photos']:
+            return self.benchmark(options['photos'], options)
+        from updates.services.sample_photos import write_sample_photos
+
+        with tempfile.TemporaryDirectory() as directory:
+            write_sample_photos(directory)
+            self.stdout.write(f"Benchmarking the synthetic sample photos written to {directory}")
+            return self.benchmark(directory, options)
+
+    def benchmark(self, directory, options):
+        from updates.models import ImParticipating
+
+        photos = sorted(str(path) for path in Path(directory).iterdir() if path.suffix.lower() in PHOTO_SUFFIXES)
+        if not photos:
+            raise CommandError(f"No photos found in {directory}")
+        template = ImParticipating.poster_template
+        template_args = (template.base_image_path, template.circle_diameter, template.center_coordinates)
+
+        results = {}
+        context = multiprocessing.get_context('spawn')
+        modes = (('full resolution', None), (f"downscaled to {options['max_side']}px", options['max_side']))
+        for label, max_side in modes:
+            with context.Pool(1) as pool:
+                results[label] = pool.apply(render_photos, (template_args, photos, max_side, options['repeat']))
+            latencies, baseline, peak, crops = results[label]
+            if not latencies:
+                raise CommandError('No face detected in any photo')
+            self.stdout.write(
+                f"{label}: {len(photos)} photos, median {statistics.median(latencies) * 1000:.0f} ms, "
+                f"max {max(latencies) * 1000:.0f} ms, peak RSS {peak / 1024:.0f} MB "
+                f"(+{(peak - baseline) / 1024:.0f} MB over the loaded template), "
+                f"{sum(crop is None for crop in crops.values())} without a face")
+
+        # Both modes should crop the same region, only the face box is rounded differently
+        full, downscaled = (result[3] for result in results.values())
+        for photo in photos:
+            if full[photo] is None or downscaled[photo] is None:
+                continue
+            difference = abs(full[photo].astype(int) - downscaled[photo].astype(int)).mean()
+            self.stdout.write(f"{Path(photo).name}: mean pixel difference {difference:.2f}")
@@ -0,0 +1,90 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+
+from authentication import ids
+from authentication.ids import IdAllocator
+from authentication.models import User
+
+
+def legacy_signup(email, length):
+    """
+    The previous generate_unique_code: read until a free UUID prefix is found, then insert without retry.
+    """
+    while True:
+        code = str(uuid.uuid4()).replace("-", "").upper()[:length]
+        if not User.objects.filter(pk=code).exists():
+            break
+    User.objects.bulk_create([User(id=code, email=email, full_name='Benchmark')])
+
+
+def allocator_signup(email, length):
+    User.objects.create(email=email, full_name='Benchmark')
+
+
+class Command(BaseCommand):
+    help = ('Compare signup throughput of the previous exists() id loop and the id allocator under concurrent '
+            'signups. The benchmark users are deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent signup threads')
+        parser.add_argument('--users', type=int, default=200, help='Signups per thread')
+        parser.add_argument('--length', type=int, default=None,
+                            help='Id length for both generators, a short length forces collisions')
+
+    def run(self, signup, prefix, options):
+        errors, queries = [], []
+
+        def worker(thread):
+            try:
+                with CaptureQueriesContext(connection) as captured:
+                    for i in range(options['users']):
+                        try:
+                            signup(f"{prefix}-{thread}-{i}@benchmark.invalid", options['length'])
+                        except (IntegrityError, OperationalError) as e:
+                            errors.append(e)
+                queries.append(len(captured))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(thread,)) for thread in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, sum(queries), errors
+
+    def handle(self, *args, **options):
+        allocator = ids.get_user_id_allocator()
+        legacy_length = options['length'] or 6
+        if options['length']:
+            allocator = IdAllocator(options['length'], allocator.alphabet)
+        signups = options['threads'] * options['users']
+        existing = User.objects.count()
+        # The previous ids were uppercase hex digits, the same space as this allocator
+        for label, space in (('previous', IdAllocator(legacy_length, '0123456789ABCDEF')), ('allocator', allocator)):
+            self.stdout.write(
+                f"{label}: {len(space.alphabet)}^{space.length} = {space.space:.3g} ids, collision bound "
+                f"{space.collision_probability(existing):.2e} for the next signup and "
+                f"{space.collision_probability(existing, signups):.2e} for {signups} signups over {existing} users")
+
+        # The allocator under test replaces the process wide one, which User.save retries with
+        previous_allocator, ids._allocator = ids._allocator, allocator
+        prefix = f"user-id-benchmark-{uuid.uuid4().hex[:8]}"
+        try:
+            for label, signup in (('previous exists() loop', legacy_signup), ('allocator', allocator_signup)):
+                elapsed, queries, errors = self.run(signup, f"{prefix}-{len(label)}", options)
+                succeeded = signups - len(errors)
+                self.stdout.write(
+                    f"{label}: {succeeded / elapsed:.0f} signups/s with {options['threads']} threads, "
+                    f"{queries / signups:.2f} queries per signup, {len(errors)} failed signups")
+                for error in {str(error) for error in errors}:
+                    self.stdout.write(f"  {error}")
+        finally:
+            ids._allocator = previous_allocator
+            User.objects.filter(email__startswith=prefix).delete()
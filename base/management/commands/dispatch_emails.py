@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from base.outbox import dispatch_pending_emails
+
+
+class Command(BaseCommand):
+    help = 'Queue a dispatch job for the outbox emails that are pending or due for a retry.'
+
+    def handle(self, *args, **kwargs):
+        job = dispatch_pending_emails()
+        if job is None:
+            self.stdout.write("No emails waiting in the outbox")
+            return
+        self.stdout.write(self.style.SUCCESS(f"Queued {job.total_items} emails as job #{job.pk}"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from updates.models import ImParticipating, delete_unused_posters, unused_posters
+
+
+class Command(BaseCommand):
+    help = 'Delete generated poster and thumbnail files that no poster references anymore.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='List the files without deleting them')
+
+    def handle(self, *args, **options):
+        names = []
+        for field_name in ('poster', 'thumbnail'):
+            field = ImParticipating._meta.get_field(field_name)
+            directory = field.upload_to
+            if field.storage.exists(directory):
+                names += [f"{directory}/{file}" for file in field.storage.listdir(directory)[1]]
+        if options['dry_run']:
+            self.stdout.write(f"{len(unused_posters(names))} of {len(names)} poster files are unused")
+            return
+        deleted = delete_unused_posters(names)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {len(deleted)} of {len(names)} poster files"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from makeaton.models import LeaderboardEntry
+from makeaton.utils import refresh_leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the Campus Ambassador leaderboard snapshot from the current referrals.'
+
+    def handle(self, *args, **kwargs):
+        refresh_leaderboard()
+        self.stdout.write(self.style.SUCCESS(f"Leaderboard refreshed with {LeaderboardEntry.objects.count()} entries"))
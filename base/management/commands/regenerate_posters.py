@@ -0,0 +1,90 @@
+import multiprocessing
+import os
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from updates.models import ImParticipating, delete_unused_posters
+from updates.services.face_with_target_size import get_cascade
+
+
+def warm_worker():
+    get_cascade()
+    ImParticipating.poster_template.warm()
+
+
+def render(row):
+    poster_id, profile_photo_path = row
+    return (poster_id,) + ImParticipating.cached_poster(profile_photo_path)
+
+
+class Command(BaseCommand):
+    help = ("Re-render I'm Participating posters in a process pool, e.g. after the template or the face crop changed. "
+            "A poster is only reused when its photo, template and render code are all unchanged.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only-failed', action='store_true', help='Only posters that could not be rendered')
+        parser.add_argument('--since', help='Only posters changed since this date or datetime (ISO 8601)')
+        parser.add_argument('--dry-run', action='store_true', help='Count the posters without rendering them')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Posters read and updated at a time')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Render processes')
+
+    def handle(self, *args, **options):
+        queryset = ImParticipating.objects.exclude(Q(profile_photo='') | Q(profile_photo__isnull=True))
+        if options['only_failed']:
+            queryset = queryset.filter(is_generated=False, remarks__isnull=False)
+        if options['since']:
+            since = parse_datetime(options['since']) or parse_date(options['since'])
+            if since is None:
+                raise CommandError(f"Invalid --since value {options['since']}")
+            if not isinstance(since, datetime):
+                since = datetime.combine(since, time.min)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            queryset = queryset.filter(updated_at__gte=since)
+
+        total = queryset.count()
+        if options['dry_run']:
+            self.stdout.write(f"{total} posters would be regenerated")
+            return
+
+        storage = ImParticipating._meta.get_field('profile_photo').storage
+        rendered = failed = 0
+        # Forked render processes must not share the parent's database connection
+        connections.close_all()
+        with multiprocessing.Pool(options['processes'], initializer=warm_worker) as pool:
+            last_id = 0
+            while True:
+                # Keyset pagination streams the rows without holding the whole table in memory
+                rows = list(queryset.filter(id__gt=last_id).order_by('id')
+                            .values_list('id', 'profile_photo', 'poster', 'thumbnail')[:options['chunk_size']])
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                previous = {poster_id: {poster, thumbnail} for poster_id, _, poster, thumbnail in rows}
+
+                generated, not_generated = [], []
+                now = timezone.now()
+                for poster_id, name, thumbnail_name, remarks in pool.imap_unordered(
+                        render, [(poster_id, storage.path(photo)) for poster_id, photo, _, _ in rows]):
+                    poster = ImParticipating(id=poster_id, poster=name, thumbnail=thumbnail_name, remarks=remarks,
+                                             is_generated=name is not None, updated_at=now)
+                    if name:
+                        generated.append(poster)
+                    else:
+                        # The previous poster, if any, is kept like a failed render from the admin
+                        not_generated.append(poster)
+                ImParticipating.objects.bulk_update(generated, ['poster', 'thumbnail', 'remarks', 'is_generated',
+                                                                'updated_at'])
+                ImParticipating.objects.bulk_update(not_generated, ['remarks', 'is_generated', 'updated_at'])
+                delete_unused_posters(name for poster in generated
+                                      for name in previous[poster.id] - {poster.poster.name, poster.thumbnail.name})
+                rendered += len(generated)
+                failed += len(not_generated)
+                self.stdout.write(f"{rendered + failed}/{total} posters regenerated, {failed} failed")
+
+        self.stdout.write(self.style.SUCCESS(f"Regenerated {rendered} posters, {failed} could not be rendered"))
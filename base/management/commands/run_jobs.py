@@ -0,0 +1,59 @@
+import os
+import signal
+import socket
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils.module_loading import autodiscover_modules
+
+from base.jobs import WORKER_STARTUP, claim_job, run_job
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs queued by the admin actions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help='Number of jobs processed in parallel')
+        parser.add_argument('--poll-interval', type=float, default=2, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        autodiscover_modules('tasks')
+        self.stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: self.stop.set())
+        signal.signal(signal.SIGINT, lambda *_: self.stop.set())
+
+        name = f"{socket.gethostname()}-{os.getpid()}"
+        threads = [threading.Thread(target=self.work, args=(f"{name}-{i}", options), daemon=True)
+                   for i in range(options['concurrency'])]
+        self.stdout.write(self.style.NOTICE(f"Starting {len(threads)} job workers on {name}"))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+        self.stdout.write(self.style.SUCCESS('Job workers stopped'))
+
+    def work(self, worker, options):
+        for func in WORKER_STARTUP:
+            try:
+                func()
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"{worker} could not run {func.__name__}: {e}"))
+        while not self.stop.is_set():
+            close_old_connections()
+            try:
+                job = claim_job(worker)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"{worker} could not claim a job: {e}"))
+                self.stop.wait(options['poll_interval'])
+                continue
+            if job is None:
+                if options['once']:
+                    break
+                self.stop.wait(options['poll_interval'])
+                continue
+            self.stdout.write(f"{worker} running {job}")
+            run_job(job)
+        close_old_connections()
@@ -1,5 +1,6 @@
 import csv
 from django.core.management.base import BaseCommand
+from base.utils import normalize_phone
 from makeaton.models import Team
 
 
@@ -25,7 +26,7 @@ class Command(BaseCommand):
 
                     # Fetch the team member by email
                     try:
-                        team = Team.objects.get(leader_phone__contains=phone)
+                        team = Team.objects.get(normalized_phone=normalize_phone(phone))
                         team.level = classification  # Update the level of expertise
                         team.llm_score = score
                         team.llm_review = reason
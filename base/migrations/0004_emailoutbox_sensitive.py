@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0003_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailoutbox',
+            name='sensitive',
+            field=models.BooleanField(default=False),
+        ),
+    ]
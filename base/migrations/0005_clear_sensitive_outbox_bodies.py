@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+def clear_sensitive_outbox_bodies(apps, schema_editor):
+    # Credential emails used to be stored rendered until sent, the ones not sent yet cannot be sent anymore
+    EmailOutbox = apps.get_model('base', 'EmailOutbox')
+    EmailOutbox.objects.filter(sensitive=True).exclude(status='sent').update(
+        status='failed', error='Credentials cleared from the outbox before sending, reset the password again')
+    EmailOutbox.objects.filter(sensitive=True).update(html_body='', text_body='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0004_emailoutbox_sensitive'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_sensitive_outbox_bodies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_clear_sensitive_outbox_bodies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobcheckpoint',
+            name='item_seconds',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
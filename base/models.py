@@ -40,3 +40,139 @@ class Model(models.Model):
     def hard_delete(self, *args, **kwargs):
         super().delete(*args, **kwargs)
         return self
+
+
+class Job(Model):
+    """
+    Background job processed by the `run_jobs` worker instead of a thread inside the web process
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+    name = models.CharField(max_length=255)  # Name of the registered task, see base.jobs.register_task
+    items = models.JSONField(default=list)  # Ids or values handed to the task in batches
+    batch_size = models.IntegerField(default=1)  # Items per task call, progress is checkpointed after each call
+    status = models.CharField(max_length=20, default=PENDING, db_index=True, choices=(
+        (PENDING, 'Pending'), (RUNNING, 'Running'), (COMPLETED, 'Completed'), (FAILED, 'Failed')))
+    cursor = models.IntegerField(default=0)  # Index of the next item to process, a resumed job starts here
+    failed_items = models.IntegerField(default=0)  # Items the task reported as failed
+    attempts = models.IntegerField(default=0)  # Number of times a worker claimed the job
+    worker = models.CharField(max_length=255, blank=True, null=True)  # Worker that holds the job
+    heartbeat_at = models.DateTimeField(blank=True, null=True)  # Last sign of life of the running worker
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+
+    class Meta:
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+    @property
+    def total_items(self):
+        return len(self.items)
+
+    @property
+    def elapsed_seconds(self):
+        if not self.started_at:
+            return 0
+        end = self.finished_at or (timezone.now() if self.status == self.RUNNING else self.heartbeat_at)
+        return max((end - self.started_at).total_seconds(), 0)
+
+    @property
+    def throughput(self):
+        """Items processed per second since the job started"""
+        elapsed = self.elapsed_seconds
+        return self.cursor / elapsed if elapsed else 0
+
+    @property
+    def error_rate(self):
+        return self.failed_items / self.cursor if self.cursor else 0
+
+    @property
+    def eta_seconds(self):
+        throughput = self.throughput
+        if self.status != self.RUNNING or not throughput:
+            return None
+        return (self.total_items - self.cursor) / throughput
+
+    def item_latency_percentile(self, percentile):
+        """
+        Latency per item in seconds at the given percentile (0-100), over the item timings of the checkpoints.
+        A checkpoint sampled down to MAX_ITEM_TIMINGS quantiles weighs each of them by the items it stands for.
+        Batches whose task does not time its items are left out.
+        Uses `checkpoints.all()` so the changelist can prefetch them.
+        """
+        samples = []
+        for checkpoint in self.checkpoints.all():
+            timings = checkpoint.item_seconds
+            if not timings:
+                continue
+            sampled = len(timings) >= JobCheckpoint.MAX_ITEM_TIMINGS and checkpoint.items > len(timings)
+            weight = checkpoint.items / len(timings) if sampled else 1
+            samples += [(seconds, weight) for seconds in timings]
+        samples.sort()
+        total = sum(weight for _, weight in samples)
+        if not total:
+            return None
+        threshold = total * percentile / 100
+        seen = 0
+        for latency, weight in samples:
+            seen += weight
+            if seen >= threshold:
+                return latency
+        return samples[-1][0]
+
+
+class JobCheckpoint(models.Model):
+    """
+    Timing of one batch of a job, recorded when the job's cursor moves
+    """
+    MAX_ITEM_TIMINGS = 200  # Item timings kept per checkpoint
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name='checkpoints')
+    items = models.IntegerField()  # Items handled in the batch
+    failed_items = models.IntegerField(default=0)
+    seconds = models.FloatField()  # Wall time spent on the batch
+    # Sorted wall times of the batch's items, evenly spaced quantiles of them when there were more
+    item_seconds = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('created_at',)
+
+
+class EmailOutbox(Model):
+    """
+    Rendered email waiting to be sent, see base.outbox.
+
+    Rows are claimed with a conditional update before sending, so a restarted or second dispatcher
+    never sends a row twice.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    RETRY = 'retry'
+    FAILED = 'failed'
+
+    key = models.CharField(max_length=255, unique=True)  # Dedupe key, queuing the same key again is a no-op
+    template = models.CharField(max_length=255)
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    html_body = models.TextField()
+    text_body = models.TextField()
+    status = models.CharField(max_length=20, default=PENDING, db_index=True, choices=(
+        (PENDING, 'Pending'), (SENDING, 'Sending'), (SENT, 'Sent'), (RETRY, 'Retry'), (FAILED, 'Failed')))
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    sensitive = models.BooleanField(default=False)  # Credentials email sent from memory, its bodies are never stored
+
+    class Meta:
+        ordering = ('-created_at',)
+        verbose_name_plural = 'Email outbox'
+
+    def __str__(self):
+        return f"{self.subject} to {self.to_email} ({self.status})"
@@ -0,0 +1,176 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from base.jobs import enqueue, item_timer
+from base.mailer import get_mailer
+from base.mailmerge import build_message, get_merge_template
+from base.models import EmailOutbox
+from base.utils import chunks
+
+logger = logging.getLogger('home')
+
+INTERRUPTED = "Interrupted by a crash before the email was marked sent"
+
+
+def queue_emails(emails):
+    """
+    Render emails into the outbox with one bulk insert and queue a job to send them.
+
+    Emails carrying credentials must not be queued, their bodies would be stored. See send_sensitive_emails.
+
+    :param emails: Iterable of (key, to_email, subject, template, context) tuples. `key` identifies the email,
+        an email whose key is already in the outbox is not queued again
+    :return: Number of newly queued emails
+    """
+    emails = list(emails)
+    existing = set()
+    for keys in chunks([email[0] for email in emails], 500):
+        existing.update(EmailOutbox.objects.filter(key__in=keys).values_list('key', flat=True))
+
+    rows = []
+    for key, to_email, subject, template, context in emails:
+        if key in existing:
+            continue
+        existing.add(key)
+        html_body, text_body = get_merge_template(template).render(context)
+        rows.append(EmailOutbox(key=key, to_email=to_email, subject=subject, template=template,
+                                html_body=html_body, text_body=text_body))
+    if not rows:
+        return 0
+    # A concurrent queue may have inserted some keys meanwhile, those rows are skipped and fetched below
+    EmailOutbox.objects.bulk_create(rows, ignore_conflicts=True, batch_size=500)
+
+    ids = []
+    for keys in chunks([row.key for row in rows], 500):
+        ids += EmailOutbox.objects.filter(key__in=keys, status=EmailOutbox.PENDING).values_list('id', flat=True)
+    if ids:
+        enqueue('base.dispatch_emails', sorted(ids), batch_size=settings.EMAIL_DISPATCH_BATCH_SIZE)
+    logger.info(f"Queued {len(ids)} of {len(emails)} emails")
+    return len(ids)
+
+
+def claim_email(outbox):
+    """
+    Mark an outbox row as sending, unless another run changed its status since it was read.
+
+    :return: True if the row was claimed
+    """
+    return bool(EmailOutbox.objects.filter(id=outbox.id, status=outbox.status).update(
+        status=EmailOutbox.SENDING, attempts=F('attempts') + 1, updated_at=timezone.now()))
+
+
+def send_email(mailer, outbox, text_body, html_body):
+    """
+    Send a claimed outbox row and record the outcome. Failed sensitive rows are never retried, the bodies they
+    would need are not stored.
+
+    :return: True if the email was sent
+    """
+    try:
+        mailer.send_raw(settings.EMAIL_HOST_USER, [outbox.to_email], build_message(
+            settings.EMAIL_HOST_USER, outbox.to_email, outbox.subject, text_body, html_body))
+    except Exception as e:
+        attempts = outbox.attempts + 1
+        retry = not outbox.sensitive and attempts < settings.EMAIL_MAX_ATTEMPTS
+        EmailOutbox.objects.filter(id=outbox.id).update(
+            status=EmailOutbox.RETRY if retry else EmailOutbox.FAILED, error=str(e), updated_at=timezone.now())
+        logger.error(f"Error sending email to {outbox.to_email}: {e}")
+        return False
+    EmailOutbox.objects.filter(id=outbox.id).update(status=EmailOutbox.SENT, sent_at=timezone.now(), error=None,
+                                                    updated_at=timezone.now())
+    logger.info(f"Email sent to {outbox.to_email}")
+    return True
+
+
+def dispatch_emails(outbox_ids):
+    """
+    Send the given outbox rows over the shared SMTP connection.
+
+    Each row is claimed with a conditional update before it is sent and marked sent right after, so rows sent
+    by an earlier or concurrent run are skipped. A row left in `sending` by a crash is not sent again, see
+    reclaim_interrupted_emails. Sensitive rows have no stored bodies and are only sent by send_sensitive_emails.
+
+    :param outbox_ids: Ids of EmailOutbox rows
+    :return: Number of emails that failed
+    """
+    mailer = get_mailer()
+    timer = item_timer()
+    failed = 0
+    for outbox in EmailOutbox.objects.filter(id__in=outbox_ids, sensitive=False,
+                                             status__in=(EmailOutbox.PENDING, EmailOutbox.RETRY)):
+        with timer.time():
+            if claim_email(outbox) and not send_email(mailer, outbox, outbox.text_body, outbox.html_body):
+                failed += 1
+    return failed
+
+
+def send_sensitive_emails(emails, save=None):
+    """
+    Send emails carrying credentials straight from memory. The outbox records them, but never their bodies.
+
+    The rows are inserted in one transaction with `save`, which stores what the emails disclose, such as the new
+    password hashes. The bodies are then rendered and sent one by one, each row claimed before its send like in
+    dispatch_emails. A failed email, or one interrupted by a crash, is marked failed and its credentials have to
+    be reset again.
+
+    :param emails: List of (key, to_email, subject, template, context) tuples whose keys are not in the outbox
+    :param save: Optional callable run in the transaction inserting the rows
+    :return: Number of emails that failed
+    """
+    rows = [EmailOutbox(key=key, to_email=to_email, subject=subject, template=template, html_body='', text_body='',
+                        sensitive=True) for key, to_email, subject, template, _ in emails]
+    with transaction.atomic():
+        if save is not None:
+            save()
+        EmailOutbox.objects.bulk_create(rows, batch_size=500)
+    ids = {}
+    for keys in chunks([row.key for row in rows], 500):
+        ids.update(EmailOutbox.objects.filter(key__in=keys).values_list('key', 'id'))
+
+    mailer = get_mailer()
+    timer = item_timer()
+    failed = 0
+    for outbox, (_, _, _, template, context) in zip(rows, emails):
+        outbox.id = ids[outbox.key]
+        with timer.time():
+            if not claim_email(outbox):
+                continue
+            html_body, text_body = get_merge_template(template).render(context)
+            if not send_email(mailer, outbox, text_body, html_body):
+                failed += 1
+    return failed
+
+
+def reclaim_interrupted_emails():
+    """
+    Fail the outbox rows a crashed worker left behind: rows stuck in `sending` and credential emails that were
+    never sent, for longer than EMAIL_SENDING_TIMEOUT. Only the former may have been delivered.
+
+    :return: Number of failed rows
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.EMAIL_SENDING_TIMEOUT)
+    count = EmailOutbox.objects.filter(
+        Q(status=EmailOutbox.SENDING) | Q(sensitive=True, status=EmailOutbox.PENDING), updated_at__lt=cutoff,
+    ).update(status=EmailOutbox.FAILED, error=INTERRUPTED, updated_at=timezone.now())
+    if count:
+        logger.warning(f"Failed {count} outbox emails interrupted by a crash")
+    return count
+
+
+def dispatch_pending_emails():
+    """
+    Fail interrupted outbox rows, then queue a dispatch job for every row waiting to be sent or retried.
+
+    :return: The created Job or None
+    """
+    reclaim_interrupted_emails()
+    ids = list(EmailOutbox.objects.filter(sensitive=False, status__in=(EmailOutbox.PENDING, EmailOutbox.RETRY))
+               .order_by('id').values_list('id', flat=True))
+    if not ids:
+        return None
+    return enqueue('base.dispatch_emails', ids, batch_size=settings.EMAIL_DISPATCH_BATCH_SIZE)
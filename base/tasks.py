@@ -0,0 +1,7 @@
+from base.jobs import register_task
+from base.outbox import dispatch_emails
+
+
+@register_task('base.dispatch_emails', batch_size=50)
+def dispatch_emails_task(outbox_ids):
+    return dispatch_emails(outbox_ids)
@@ -1,3 +1,266 @@
+import smtplib
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.core import mail
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from authentication.models import User
+from base import mailer
+from base.jobs import TASKS, JobHeartbeat, claim_job, enqueue, item_timer, run_job, sample_timings
+from base.mailmerge import build_message
+from base.models import EmailOutbox, Job, JobCheckpoint
+from base.outbox import dispatch_emails, dispatch_pending_emails, queue_emails, reclaim_interrupted_emails, \
+    send_sensitive_emails
+from base.utils import normalize_phone
+
+
+class NormalizePhoneTests(TestCase):
+    def test_formats_are_normalized_alike(self):
+        for number in ('9876543210', '+91 98765 43210', '+919876543210', '919876543210', ' 98765-43210 '):
+            self.assertEqual(normalize_phone(number), '+919876543210', number)
+
+    def test_incomplete_numbers_are_not_normalized(self):
+        for number in (None, '', '+91', '+91 ', '12345', '+91 98765'):
+            self.assertIsNone(normalize_phone(number), number)
+
+
+class JobTests(TestCase):
+    def run_task(self, task, items, batch_size):
+        with mock.patch.dict(TASKS, {'tests.task': (task, batch_size)}):
+            enqueue('tests.task', items)
+            job = claim_job('worker-1')
+            run_job(job)
+        return Job.objects.get(pk=job.pk)
+
+    def test_progress_is_checkpointed_after_every_batch(self):
+        batches = []
+
+        def task(batch):
+            batches.append(batch)
+            return 1 if 3 in batch else 0
+
+        job = self.run_task(task, [1, 2, 3, 4, 5], batch_size=2)
+        self.assertEqual(batches, [[1, 2], [3, 4], [5]])
+        self.assertEqual((job.status, job.cursor, job.failed_items), (Job.COMPLETED, 5, 1))
+        self.assertEqual([checkpoint.items for checkpoint in job.checkpoints.all()], [2, 2, 1])
+
+    def test_a_job_claimed_by_another_worker_keeps_its_progress(self):
+        def task(batch):
+            # Another worker took the job over while this batch ran
+            Job.objects.update(worker='worker-2')
+
+        job = self.run_task(task, [1, 2, 3], batch_size=2)
+        self.assertEqual((job.status, job.worker, job.cursor), (Job.RUNNING, 'worker-2', 0))
+        self.assertFalse(job.checkpoints.exists())
+
+    def test_a_stale_running_job_is_claimed_again(self):
+        job = enqueue('tests.task', [1])
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, worker='worker-1',
+                                             heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(claim_job('worker-2').pk, job.pk)
+        self.assertIsNone(claim_job('worker-3'))
+
+    def test_heartbeat_notices_a_lost_job(self):
+        enqueue('tests.task', [1])
+        job = claim_job('worker-1')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        heartbeat = JobHeartbeat(job)
+        heartbeat.beat()
+        self.assertGreater(Job.objects.get(pk=job.pk).heartbeat_at, timezone.now() - timedelta(minutes=1))
+        self.assertFalse(heartbeat.lost.is_set())
+
+        Job.objects.filter(pk=job.pk).update(worker='worker-2')
+        heartbeat.beat()
+        self.assertTrue(heartbeat.lost.is_set())
+
+    def test_items_are_timed_by_the_task_or_as_single_item_batches(self):
+        def task(batch):
+            timer = item_timer()
+            for _ in batch:
+                with timer.time():
+                    pass
+
+        job = self.run_task(task, [1, 2, 3], batch_size=2)
+        self.assertEqual([len(checkpoint.item_seconds) for checkpoint in job.checkpoints.all()], [2, 1])
+        job = self.run_task(lambda batch: 0, [1, 2, 3], batch_size=2)
+        self.assertEqual([len(checkpoint.item_seconds) for checkpoint in job.checkpoints.all()], [0, 1])
+
+    def test_latency_percentiles_are_taken_over_item_timings(self):
+        job = enqueue('tests.task', list(range(10)))
+        JobCheckpoint.objects.bulk_create([
+            JobCheckpoint(job=job, items=8, seconds=8, item_seconds=[0.5] * 7 + [4.5]),
+            JobCheckpoint(job=job, items=2, seconds=10, item_seconds=[1, 9]),
+            # Not timed per item, left out
+            JobCheckpoint(job=job, items=5, seconds=100)])
+        self.assertEqual(job.item_latency_percentile(50), 0.5)
+        self.assertEqual(job.item_latency_percentile(90), 4.5)
+        self.assertEqual(job.item_latency_percentile(95), 9)
+
+    def test_sampled_timings_keep_their_quantiles(self):
+        self.assertEqual(sample_timings(range(100, -1, -1), limit=11), list(range(0, 101, 10)))
+        seconds = [i / 100 for i in range(1000, 0, -1)]
+        job = enqueue('tests.task', list(range(1000)))
+        JobCheckpoint.objects.create(job=job, items=1000, seconds=5005, item_seconds=sample_timings(seconds))
+        self.assertAlmostEqual(job.item_latency_percentile(50), 5, delta=0.05)
+        self.assertAlmostEqual(job.item_latency_percentile(95), 9.5, delta=0.05)
+
+
+class FakeSMTP:
+    """
+    Stands in for smtplib.SMTP, the first `disconnects` sends fail as if the server dropped the connection.
+    """
+    connections = []
+    disconnects = 0
+
+    def __init__(self, host, port, timeout=None):
+        self.address = (host, port)
+        self.extensions = {'starttls', 'auth'}
+        self.events = []
+        self.sent = []
+        FakeSMTP.connections.append(self)
+
+    def ehlo(self):
+        self.events.append('ehlo')
+
+    def has_extn(self, name):
+        return name in self.extensions
+
+    def starttls(self, context=None):
+        self.events.append('starttls')
+        self.extensions.discard('starttls')
+
+    def login(self, username, password):
+        self.events.append('login')
+
+    def sendmail(self, from_email, to_emails, message):
+        if FakeSMTP.disconnects:
+            FakeSMTP.disconnects -= 1
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        self.sent.append(to_emails)
+
+    def quit(self):
+        self.events.append('quit')
+
+    def close(self):
+        self.events.append('close')
+
+
+@mock.patch('base.mailer.time.sleep')
+@mock.patch('base.mailer.smtplib.SMTP', FakeSMTP)
+class SMTPMailerTests(TestCase):
+    def setUp(self):
+        FakeSMTP.connections = []
+        FakeSMTP.disconnects = 0
+
+    def test_defaults_use_the_submission_port_with_starttls(self, sleep):
+        sender = mailer.SMTPMailer(host='smtp.example.com', username='user', password='secret', rate_limit=0)
+        sender.send_raw('from@example.com', ['to@example.com'], b'message')
+        connection, = FakeSMTP.connections
+        self.assertEqual(connection.address, ('smtp.example.com', 587))
+        self.assertEqual(connection.events, ['ehlo', 'starttls', 'ehlo', 'login'])
+
+    def test_a_dropped_connection_is_closed_and_replaced(self, sleep):
+        FakeSMTP.disconnects = 1
+        sender = mailer.SMTPMailer(host='smtp.example.com', username='', password='', rate_limit=0)
+        sender.send_raw('from@example.com', ['to@example.com'], b'message')
+        dropped, current = FakeSMTP.connections
+        self.assertIn('close', dropped.events)
+        self.assertEqual((dropped.sent, current.sent), ([], [['to@example.com']]))
+        self.assertIs(sender.connection, current)
+
+    def test_connections_are_reused_and_recycled(self, sleep):
+        sender = mailer.SMTPMailer(host='smtp.example.com', username='', password='', rate_limit=0,
+                                   max_messages_per_connection=2)
+        for i in range(3):
+            sender.send_raw('from@example.com', [f"to{i}@example.com"], b'message')
+        first, second = FakeSMTP.connections
+        self.assertEqual(len(first.sent), 2)
+        self.assertIn('quit', first.events)
+        self.assertEqual(len(second.sent), 1)
+
+
+@mock.patch('base.mailer._mailer', None)
+class BackendMailerTests(TestCase):
+    def test_messages_go_through_the_configured_backend(self):
+        sender = mailer.get_mailer()
+        self.assertIsInstance(sender, mailer.BackendMailer)
+        sender.send_raw('from@example.com', ['to@example.com'],
+                        build_message('from@example.com', 'to@example.com', 'Subject', 'Text', '<p>Html</p>'))
+        message, = mail.outbox
+        self.assertEqual(message.to, ['to@example.com'])
+        self.assertEqual(message.message()['Subject'], 'Subject')
+
+
+def login_email(key, to_email, password='secret-password'):
+    return (key, to_email, 'Dashboard login', 'emails/team_dashboard_login.html',
+            {'full_name': 'Participant', 'email': to_email, 'password': password})
+
+
+def message_text(message):
+    return ''.join(part.get_payload(decode=True).decode() for part in message.message().walk()
+                   if not part.is_multipart())
+
+
+@mock.patch('base.mailer._mailer', None)
+class OutboxTests(TestCase):
+    def test_queued_emails_are_sent_once(self):
+        emails = [login_email('login:1', 'one@example.com'), login_email('login:2', 'two@example.com')]
+        self.assertEqual(queue_emails(emails), 2)
+        self.assertEqual(queue_emails(emails), 0)
+        job = Job.objects.get(name='base.dispatch_emails')
+
+        self.assertEqual(dispatch_emails(job.items), 0)
+        self.assertEqual(dispatch_emails(job.items), 0)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['one@example.com', 'two@example.com'])
+        self.assertEqual(set(EmailOutbox.objects.values_list('status', flat=True)), {EmailOutbox.SENT})
+
+    def test_sensitive_emails_are_sent_without_storing_their_bodies(self):
+        stored = []
+
+        def save():
+            stored.append(EmailOutbox.objects.count())
+
+        self.assertEqual(send_sensitive_emails([login_email('login:1', 'one@example.com')], save=save), 0)
+        self.assertEqual(stored, [0])
+        self.assertIn('secret-password', message_text(mail.outbox[0]))
+        outbox = EmailOutbox.objects.get()
+        self.assertEqual((outbox.status, outbox.sensitive, outbox.html_body, outbox.text_body),
+                         (EmailOutbox.SENT, True, '', ''))
+
+    def test_admin_hides_sensitive_bodies(self):
+        # Rows queued before credential emails were sent from memory may still hold their bodies
+        EmailOutbox.objects.create(key='login:1', to_email='one@example.com', subject='Dashboard login',
+                                   template='emails/team_dashboard_login.html', html_body='',
+                                   text_body='secret-password', sensitive=True)
+        queue_emails([login_email('login:2', 'two@example.com', password='not-a-secret')])
+        admin = User.objects.create_superuser(email='admin@example.com', full_name='Admin', password=None)
+        self.client.force_login(admin)
+        pages = {outbox.key: self.client.get(reverse('admin:base_emailoutbox_change', args=[outbox.pk]))
+                 for outbox in EmailOutbox.objects.all()}
+        self.assertNotContains(pages['login:1'], 'secret-password')
+        self.assertContains(pages['login:2'], 'not-a-secret')
+
+    def test_failed_sensitive_emails_are_not_retried(self):
+        with mock.patch.object(mailer.BackendMailer, 'send_raw', side_effect=ConnectionError('refused')):
+            self.assertEqual(send_sensitive_emails([login_email('login:1', 'one@example.com')]), 1)
+        outbox = EmailOutbox.objects.get()
+        self.assertEqual((outbox.status, outbox.error), (EmailOutbox.FAILED, 'refused'))
+        self.assertIsNone(dispatch_pending_emails())
+
+    def test_interrupted_emails_are_failed(self):
+        queue_emails([login_email('login:1', 'one@example.com'), login_email('login:2', 'two@example.com')])
+        EmailOutbox.objects.filter(key='login:1').update(status=EmailOutbox.SENDING)
+        EmailOutbox.objects.create(key='login:3', to_email='three@example.com', subject='Dashboard login',
+                                   template='emails/team_dashboard_login.html', html_body='', text_body='',
+                                   sensitive=True)
+        self.assertEqual(reclaim_interrupted_emails(), 0)
 
-# Create your tests here.
+        EmailOutbox.objects.update(updated_at=timezone.now() - timedelta(seconds=settings.EMAIL_SENDING_TIMEOUT + 60))
+        job = dispatch_pending_emails()
+        self.assertEqual(dict(EmailOutbox.objects.values_list('key', 'status')), {
+            'login:1': EmailOutbox.FAILED, 'login:2': EmailOutbox.PENDING, 'login:3': EmailOutbox.FAILED})
+        self.assertEqual(job.items, list(EmailOutbox.objects.filter(key='login:2').values_list('id', flat=True)))
@@ -1,5 +1,8 @@
 import re
 
+# Digits of an Indian mobile number after the +91 country code
+NATIONAL_NUMBER_LENGTH = 10
+
 
 def clean_mobile_number(number):
     """
@@ -34,3 +37,38 @@ def clean_mobile_number(number):
 
     # Return the number formatted with the +91 prefix
     return f'+91{number}'
+
+
+def chunks(items, size):
+    """
+    Splits a list into consecutive slices of at most `size` items.
+
+    Args:
+    - items (list): The list to split.
+    - size (int): Maximum number of items per slice.
+
+    Returns:
+    - generator: Yields lists of up to `size` items, preserving order.
+    """
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def normalize_phone(number):
+    """
+    Builds the canonical phone key stored in the indexed `normalized_phone` columns.
+
+    Args:
+    - number (str): The raw or cleaned mobile number, may be empty.
+
+    Returns:
+    - str: The output of `clean_mobile_number`, or None when the number has fewer than 10 national digits
+      (e.g. an empty field or a bare '+91'), so that incomplete numbers never match each other.
+    """
+    if not number:
+        return None
+    normalized = clean_mobile_number(number)
+    if len(normalized) < len('+91') + NATIONAL_NUMBER_LENGTH:
+        return None
+    return normalized
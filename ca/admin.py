@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.models import Group
+from django.db.models import Count, Q
 from import_export import resources
 from import_export.admin import ImportExportModelAdmin
 from import_export.fields import Field
@@ -70,7 +71,8 @@ class CampusAmbassadorResource(resources.ModelResource):
 
     def after_import(self, dataset, result, **kwargs):
         from makeaton.utils import cross_match_referrals
-        cross_match_referrals()
+        coupon_codes = dataset['Coupon ID'] if 'Coupon ID' in dataset.headers else None
+        cross_match_referrals(coupon_codes=coupon_codes)
 
 
 # Define the admin class for filters, search, and import/export
@@ -105,8 +107,19 @@ class CampusAmbassadorAdmin(ImportExportModelAdmin):
         'year'
     )
 
+    list_select_related = ('user',)
+
+    def get_queryset(self, request):
+        # Deleted members are left out like in ambassador.referrals.count()
+        return super().get_queryset(request).annotate(
+            referral_count=Count('referrals', filter=Q(referrals__deleted=False)))
+
     def referral(self, obj):
-        return obj.referrals.count()
+        return obj.referral_count
+
+    referral.admin_order_field = 'referral_count'
 
     def mobile_number(self, obj):
         return obj.user.mobile_number
+
+    mobile_number.admin_order_field = 'user__mobile_number'
@@ -53,6 +53,16 @@ EMAIL_HOST = env.str("EMAIL_HOST", default="smtp.gmail.com")
 EMAIL_HOST_USER = env.str("EMAIL_HOST_USER", default="")
 EMAIL_HOST_PASSWORD = env.str("EMAIL_HOST_PASSWORD", default="")
 EMAIL_PORT = env.int("EMAIL_PORT", default=587)
+EMAIL_USE_SSL = env.bool("EMAIL_USE_SSL", default=False)  # Implicit TLS (port 465), else STARTTLS when offered
+EMAIL_MAX_MESSAGES_PER_CONNECTION = env.int("EMAIL_MAX_MESSAGES_PER_CONNECTION", default=100)
+EMAIL_RATE_LIMIT = env.int("EMAIL_RATE_LIMIT", default=60)  # Messages per minute, 0 for no limit
+EMAIL_MAX_ATTEMPTS = env.int("EMAIL_MAX_ATTEMPTS", default=3)  # Sends tried per outbox row before it is failed
+EMAIL_DISPATCH_BATCH_SIZE = env.int("EMAIL_DISPATCH_BATCH_SIZE", default=50)
+# Seconds an outbox row may stay pending (credential emails) or sending before it is failed as interrupted
+EMAIL_SENDING_TIMEOUT = env.int("EMAIL_SENDING_TIMEOUT", default=3600)
+
+# Processes hashing passwords for bulk credential resets, defaults to the number of CPUs
+PASSWORD_HASH_WORKERS = env.int("PASSWORD_HASH_WORKERS", default=0)
 # EMAIL_USE_TLS = True
 
 # Installed apps
@@ -168,3 +178,26 @@ if USE_REDIS:
 
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 3000
 GITHUB_API_TOKEN = env.str("GITHUB_API_TOKEN", default="")
+GITHUB_API_URL = env.str("GITHUB_API_URL", default="https://api.github.com")
+GITHUB_MAX_WORKERS = env.int("GITHUB_MAX_WORKERS", default=8)  # Concurrent GitHub API requests
+GITHUB_MAX_RETRIES = env.int("GITHUB_MAX_RETRIES", default=3)
+
+# Background jobs
+JOB_STALE_AFTER = env.int("JOB_STALE_AFTER", default=10 * 60)  # Seconds without a heartbeat before a job is resumed
+JOB_MAX_ATTEMPTS = env.int("JOB_MAX_ATTEMPTS", default=3)
+JOB_HEARTBEAT_INTERVAL = env.int("JOB_HEARTBEAT_INTERVAL", default=60)  # Seconds between heartbeats of a running job
+
+# Posters
+# Faces are detected on a copy of the photo scaled down to this longest side, 0 to detect on the full photo
+POSTER_DETECTION_MAX_SIDE = env.int("POSTER_DETECTION_MAX_SIDE", default=1024)
+POSTER_FORMAT = env.str("POSTER_FORMAT", default="png")  # png, or jpeg or webp for smaller lossy posters
+POSTER_QUALITY = env.int("POSTER_QUALITY", default=85)  # JPEG and WebP quality
+POSTER_THUMBNAIL_WIDTH = env.int("POSTER_THUMBNAIL_WIDTH", default=300)  # 0 for no thumbnails
+# Unreferenced poster files modified more recently are kept, they may be about to be referenced
+POSTER_GC_GRACE_SECONDS = env.int("POSTER_GC_GRACE_SECONDS", default=3600)
+
+# User ids, see authentication.ids.IdAllocator
+# 32 ** 8 is about 1.1e12 ids, with 100k users a signup collides with probability below 1e-7 and is retried
+USER_ID_LENGTH = env.int("USER_ID_LENGTH", default=8)
+USER_ID_ALPHABET = env.str("USER_ID_ALPHABET", default="")  # Empty for Crockford's base32
+USER_ID_MAX_ATTEMPTS = env.int("USER_ID_MAX_ATTEMPTS", default=3)  # Inserts per user before a collision is raised
@@ -143,6 +143,8 @@ JAZZMIN_SETTINGS = {
         'makeaton.Participants': 'fas fa-user',
         'makeaton.TeamMember': 'fas fa-users',
         'ca.CampusAmbassador': 'fas fa-star',
+        'base.Job': 'fas fa-tasks',
+        'base.EmailOutbox': 'fas fa-envelope',
 
     },
     # Icons that are used when one is not manually specified
@@ -1,24 +1,45 @@
 import logging
-import threading
 
 from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
 from django.contrib.auth.models import Group
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
 from django.db.models import Count, Q
 from import_export import resources, fields
 from import_export.admin import ImportExportModelAdmin
 
+from authentication.ids import bulk_create_with_ids, get_user_id_allocator
 from authentication.models import User
-from base.utils import clean_mobile_number
+from base.jobs import enqueue
+from base.utils import chunks, normalize_phone
 from ca.models import CampusAmbassador
 from .models import Team, TeamMember, Participants, Leaderboard, MyTeam, TeamLeader, MyTeamMember, Issue, RaiseAnIssue, \
     TeamLlmReview
-from .utils import bulk_started_status_check, send_rsvp_email
+from .utils import bulk_approve_teams, bulk_decline_teams, merge_duplicate_teams, provision_member_users, \
+    queue_rsvp_emails
 
 logger = logging.getLogger('home')
 
 common_exclude = ['is_active', 'deleted', 'deleted_at', 'deleted_by', 'created_at', 'updated_at']
 
+IMPORT_LOOKUP_CHUNK_SIZE = 500  # Max values per IN (...) lookup and rows per bulk write during imports
+TEAM_NAME_COLUMN = 'Team Name( Ensure that other members have registered with same team name)'
+COUPON_CODE_COLUMN = 'Coupon Code (if any)'
+CONDUCTOR_TRACK_COLUMN = 'Do you want to compete in Conductor Track (exclusive prizes)'
+
+
+class AmbassadorListFilter(admin.RelatedFieldListFilter):
+    """
+    Referral filter that loads the ambassadors with their users, CampusAmbassador.__str__ reads the user's name
+    """
+
+    def field_choices(self, field, request, model_admin):
+        queryset = CampusAmbassador.objects.select_related('user')
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return [(ambassador.pk, str(ambassador)) for ambassador in queryset]
+
 
 class TeamMemberResource(resources.ModelResource):
     """
@@ -68,101 +89,176 @@ class TeamMemberResource(resources.ModelResource):
         #                 'gender', 'level_of_study', 'college_name', 'major_field_of_study', 'year_of_study',
         #                 'state', 'first_time_hackathon', 'github_profile', 'linkedin_profile', 't_shirt_size',
         #                 'applied_before', 'source', 'resume', 'coupon_code']
+        # Rows are collected and written with bulk_create; lookups are resolved once in before_import
+        use_bulk = True
+        batch_size = IMPORT_LOOKUP_CHUNK_SIZE
+        use_transactions = True
 
-    def before_save_instance(self, instance, row, **kwargs):
+    def before_import(self, dataset, **kwargs):
+        """
+        Resolves teams, leaders, ambassadors and existing members for the whole dataset up front so that the
+        per-row hooks only read from in-memory maps. Missing teams and leader accounts are created in bulk here;
+        the import runs inside a transaction, so a dry run rolls them back.
+        """
+        rows = [dict(zip(dataset.headers, data_row)) for data_row in dataset]
+        parsed = [self.parse_row(row) for row in rows]
+
+        phones = {p['phone_number'] for p in parsed}
+        self.existing_phones = set()
+        for batch in chunks(phones, IMPORT_LOOKUP_CHUNK_SIZE):
+            self.existing_phones.update(
+                TeamMember.objects.filter(normalized_phone__in=batch).values_list('normalized_phone', flat=True))
+        self.seen_phones = set()
+
+        # Replay the skip rules over the dataset to know which rows will actually be saved
+        seen = set()
+        accepted = []
+        for row, p in zip(rows, parsed):
+            if self.is_valid_row(p, seen):
+                seen.add(p['phone_number'])
+                accepted.append((row, p))
+
+        self.ambassadors = {}
+        coupon_codes = {row.get(COUPON_CODE_COLUMN) for row, _ in accepted if row.get(COUPON_CODE_COLUMN)}
+        for batch in chunks(coupon_codes, IMPORT_LOOKUP_CHUNK_SIZE):
+            for ca in CampusAmbassador.objects.filter(coupon_code__in=batch).order_by('id'):
+                self.ambassadors.setdefault(ca.coupon_code, ca)
+
+        # Keyed on the normalized leader phone, the stored leader_phone may be formatted differently
+        self.teams = {}
+        leader_phones = {p['leader_phone'] for _, p in accepted}
+        for batch in chunks(leader_phones, IMPORT_LOOKUP_CHUNK_SIZE):
+            for team in Team.objects.filter(normalized_phone__in=batch).order_by('id'):
+                self.teams.setdefault((team.name, team.normalized_phone), team)
+
+        # Leader accounts for teams that will be created, matched on the cleaned mobile number
+        new_team_keys = []
+        for row, p in accepted:
+            key = (p['team_name'], p['leader_phone'])
+            if key not in self.teams and key not in new_team_keys:
+                new_team_keys.append(key)
+                self.teams[key] = Team(
+                    name=p['team_name'], leader_phone=p['leader_phone'], normalized_phone=p['leader_phone'],
+                    conductor_track=row.get(CONDUCTOR_TRACK_COLUMN, 'no').lower() == 'yes')
+        users_by_mobile = {}
+        for batch in chunks({phone for _, phone in new_team_keys}, IMPORT_LOOKUP_CHUNK_SIZE):
+            for user in User.objects.filter(normalized_phone__in=batch).order_by('date_joined'):
+                users_by_mobile.setdefault(user.normalized_phone, user)
+        for key in new_team_keys:
+            self.teams[key].leader = users_by_mobile.get(key[1])
+
+        # Team leaders that register with a new email get a dashboard account and become the team leader
+        leader_rows = [(row, p) for row, p in accepted if p['is_team_leader'] and row.get('email')]
+        existing_emails = set()
+        for batch in chunks({row.get('email') for row, _ in leader_rows}, IMPORT_LOOKUP_CHUNK_SIZE):
+            existing_emails.update(User.objects.filter(email__in=batch).values_list('email', flat=True))
+        new_users = {}
+        new_leaders = {}
+        for row, p in leader_rows:
+            email = row.get('email')
+            if email in existing_emails:
+                continue
+            if email not in new_users:
+                new_users[email] = User(email=email, full_name=row.get('name', ''), mobile_number=p['phone_number'],
+                                        normalized_phone=p['phone_number'], is_staff=True, is_active=True)
+            new_leaders[(p['team_name'], p['leader_phone'])] = new_users[email]
+
+        if new_users:
+            bulk_create_with_ids(User, new_users.values(), get_user_id_allocator(), batch_size=IMPORT_LOOKUP_CHUNK_SIZE)
+            grp = Group.objects.get_or_create(name='Team Leader')[0]
+            User.groups.through.objects.bulk_create(
+                [User.groups.through(user_id=user.pk, group_id=grp.pk) for user in new_users.values()],
+                batch_size=IMPORT_LOOKUP_CHUNK_SIZE, ignore_conflicts=True)
+        # Assigned once the users are inserted, a taken user id is redrawn on insert
+        updated_teams = {}
+        for key, user in new_leaders.items():
+            self.teams[key].leader = user
+            if key not in new_team_keys:
+                updated_teams[key] = self.teams[key]
+
+        created_teams = [self.teams[key] for key in new_team_keys]
+        Team.objects.bulk_create(created_teams, batch_size=IMPORT_LOOKUP_CHUNK_SIZE)
+        Team.objects.bulk_update(updated_teams.values(), ['leader'], batch_size=IMPORT_LOOKUP_CHUNK_SIZE)
+        logger.info(f"Bulk import resolved {len(accepted)} rows: {len(created_teams)} new teams, "
+                    f"{len(new_users)} new leaders, {len(updated_teams)} teams with a new leader")
+
+    @staticmethod
+    def parse_row(row):
+        # Normalized like the stored normalized_phone keys, None for an empty or incomplete number
+        phone_number = normalize_phone(row.get('phone_number', '') or '')
+        leader_phone = normalize_phone(row.get("Team Leader's Phone number", '') or '')
+        return {
+            'team_name': row.get(TEAM_NAME_COLUMN),
+            'phone_number': phone_number,
+            'leader_phone': leader_phone,
+            'is_team_leader': row.get('Are you the team leader?', 'no') == 'Yes' or (
+                    phone_number is not None and phone_number == leader_phone),
+        }
+
+    @staticmethod
+    def phone_errors(parsed):
+        """
+        Errors reported for a row whose phone numbers cannot be matched to existing members and teams.
+        """
+        errors = []
+        if parsed['phone_number'] is None:
+            errors.append("The phone number is empty or has fewer than 10 digits")
+        if parsed['leader_phone'] is None:
+            errors.append("The team leader's phone number is empty or has fewer than 10 digits")
+        return errors
 
-        team_name = row.get('Team Name( Ensure that other members have registered with same team name)')
-        leader_phone = clean_mobile_number(row.get("Team Leader's Phone number", ''))
-        phone_number = clean_mobile_number(row.get('phone_number', ''))
-        row['phone_number'] = phone_number
+    def is_valid_row(self, parsed, seen):
+        already_exists = parsed['phone_number'] in self.existing_phones or parsed['phone_number'] in seen
+        return bool(parsed['team_name']) and not self.phone_errors(parsed) and not already_exists
+
+    def before_save_instance(self, instance, row, **kwargs):
+        parsed = self.parse_row(row)
+        row['phone_number'] = parsed['phone_number']
         # Check if the team exists by name and leader's phone number
-        if not team_name or not leader_phone:
+        if not parsed['team_name'] or not parsed['leader_phone']:
             logger.error(f"Invalid row: Team Name or Leader's Phone Number is empty {row}" + "\n-----" * 5)
             return
-        team, created = Team.objects.get_or_create(
-            name=team_name,
-            leader_phone=leader_phone,
-        )
+        instance.team = self.teams[(parsed['team_name'], parsed['leader_phone'])]
+        instance.phone_number = parsed['phone_number']
+        instance.normalized_phone = parsed['phone_number']
 
-        if created:
-            team.conductor_track = row.get('Do you want to compete in Conductor Track (exclusive prizes)',
-                                           'no').lower() == 'yes'
-            leader = User.objects.filter(mobile_number__contains=leader_phone.strip('+'))
-            if leader.exists():
-                team.leader = leader.first()
-                team.save()
-        instance.team = team
-        instance.phone_number = phone_number
-
-        coupon_code = row.get('Coupon Code (if any)', '')
-
-        if coupon_code:
-            ca = CampusAmbassador.objects.filter(coupon_code=coupon_code)
-            if ca.exists():
-                instance.referral = ca.first()
+        coupon_code = row.get(COUPON_CODE_COLUMN, '')
+        if coupon_code and coupon_code in self.ambassadors:
+            instance.referral = self.ambassadors[coupon_code]
         college = row.get('College Name (select other if not present)', row.get('Other College Name', ''))
         if college:
             instance.college_name = college
 
         major = row.get('Major/Field of Study (if not present, select other)', row.get('Other Field of Study', ''))
-        # If the user is a team leader, mark them as the leader
         if major:
             instance.major_field_of_study = major
 
-        state = row.get('State (if not from India, select other)', row.get('Other State', ''))
-        is_team_leader = row.get('Are you the team leader?', 'no') == 'Yes' or phone_number == leader_phone
-        instance.team_leader = "Yes" if is_team_leader else "No"
-        if is_team_leader:
-            team.leader_phone = leader_phone
-            team.save()
-
-            name = row.get('name', '')
-            email = row.get('email', '')
-            if email:
-                user, created = User.objects.get_or_create(
-                    email=email,
-                )
-                if created:
-                    user.full_name = name
-                    user.mobile_number = phone_number
-                    user.is_staff = True
-                    user.is_active = True
-                    grp = Group.objects.get_or_create(name='Team Leader')
-                    user.groups.add(grp[0])
-                    user.save()
-                    team.leader = user
-                    team.save()
+        # If the user is a team leader, mark them as the leader
+        instance.team_leader = "Yes" if parsed['is_team_leader'] else "No"
 
     def after_import(self, dataset, result, **kwargs):
-        from makeaton.utils import cross_match_referrals, update_leader_phone_numbers
-        threading.Thread(target=cross_match_referrals).start()
-        threading.Thread(target=update_leader_phone_numbers, args=(dataset,)).start()
-
-    def after_save_instance(self, instance, row, **kwargs):
-        leader_phone = clean_mobile_number(row.get("Team Leader's Phone number", ''))
-        phone_number = clean_mobile_number(row.get('phone_number', ''))
-
-        is_team_leader = row.get('Are you the team leader?', 'no') == 'Yes' or phone_number == leader_phone
-        instance.team_leader = "Yes" if is_team_leader else "No"
-        instance.save()
+        # Queued in the import transaction, so the jobs only run once the imported rows are committed
+        enqueue('makeaton.cross_match_referrals', sorted(self.seen_phones))
+        enqueue('makeaton.update_leader_phone_numbers',
+                [(data[3], data[21]) for data in dataset if len(data) > 21])
 
     def import_instance(self, instance, row, **kwargs):
-        return super().import_instance(instance, row, **kwargs)
+        super().import_instance(instance, row, **kwargs)
+        errors = self.phone_errors(self.parse_row(row))
+        if errors:
+            raise ValidationError({NON_FIELD_ERRORS: errors})
 
     def skip_row(self, instance, original, row, import_validation_errors=None):
-        # Skip rows where the coupon code is empty
-        team_name, phone_number, leader_phone = row.get(
-            'Team Name( Ensure that other members have registered with same team name)'), clean_mobile_number(
-            row.get("phone_number", '')), clean_mobile_number(row.get("Team Leader's Phone number", ''))
-        phone_number = clean_mobile_number(phone_number)
-        already_exists = TeamMember.objects.filter(phone_number__contains=phone_number.strip('+')).exists()
-
-        valid = bool(team_name) and bool(phone_number) and not already_exists and bool(
-            leader_phone) and leader_phone != '+91'
+        if import_validation_errors:
+            # Not skipped, so validate_instance reports the row as invalid
+            return False
+        # Skip rows without a team and members that are already registered (in the DB or earlier rows)
+        parsed = self.parse_row(row)
+        valid = self.is_valid_row(parsed, self.seen_phones)
         if not valid:
-            logger.error(
-                f"Invalid row: {row}" + "\n-----" * 2 + f"{already_exists = } {valid = } {team_name = } {phone_number = } {leader_phone = }")
+            logger.error(f"Invalid row: {row}" + "\n-----" * 2 + f"{valid = } {parsed = }")
             return True
+        self.seen_phones.add(parsed['phone_number'])
         return super().skip_row(instance, original, row, import_validation_errors)
 
 
@@ -184,13 +280,21 @@ class TeamMemberAdmin(ImportExportModelAdmin):
         'starred_conductor', 'level',)
     search_fields = ('name', 'email', 'phone_number', 'team__name')
     list_filter = (
-        'team', 'team_leader', 'starred_conductor', 'referral', 'level', 'team__approved', 'id_card',)
+        'team', 'team_leader', 'starred_conductor', ('referral', AmbassadorListFilter), 'level', 'team__approved',
+        'id_card',)
+    list_select_related = ('team',)
 
-    actions = ['check_stars', 'add_id_card', 'generate_user']
+    actions = ['check_stars', 'sweep_stars', 'add_id_card', 'generate_user']
 
     def check_stars(self, request, queryset):
-        threading.Thread(target=bulk_started_status_check, args=(queryset,)).start()
-        # bulk_started_status_check(queryset)
+        job = enqueue('makeaton.check_stars', queryset.values_list('id', flat=True))
+        self.message_user(request, f'Star check queued as job #{job.pk} for {job.total_items} members.')
+
+    def sweep_stars(self, request, queryset):
+        job = enqueue('makeaton.sweep_stars', queryset.values_list('id', flat=True))
+        self.message_user(request, f'Stargazer sweep queued as job #{job.pk} for {job.total_items} members.')
+
+    sweep_stars.short_description = 'Check stars (stargazer sweep)'
 
     def add_id_card(self, request, queryset):
         queryset.update(id_card=True)
@@ -199,19 +303,8 @@ class TeamMemberAdmin(ImportExportModelAdmin):
         return obj.team.track
 
     def generate_user(self, request, queryset):
-        for member in queryset:
-            if not User.objects.filter(email=member.email).exists():
-                user = User.objects.create(
-                    full_name=member.name,
-                    email=member.email,
-                    mobile_number=member.phone_number,
-                    is_staff=True,
-                    is_active=True
-                )
-                grp = Group.objects.get_or_create(name="Team Member")
-                grp[0].user_set.add(user)
-                member.user = user
-                member.save()
+        created = provision_member_users(queryset)
+        self.message_user(request, f'Created {created} user accounts, members whose email has an account were skipped.')
 
 
 class TeamMemberInline(admin.StackedInline):
@@ -256,82 +349,37 @@ class TeamAdmin(ImportExportModelAdmin):
     inlines = [TeamMemberInline]
     list_filter = (HasLeaderFilter, 'conductor_track', 'approved', 'rsvp')  # Adding the custom filter here
 
-    actions = ['approve_teams', 'disapprove_teams', 'rsvp_mail', 'send_rsvp_email']
+    actions = ['approve_teams', 'disapprove_teams', 'rsvp_mail', 'send_rsvp_email', 'refresh_leaders']
 
     def member_count(self, obj):
-        return obj.members.count()
+        return obj.member_no
 
     member_count.short_description = 'Member Count'
+    member_count.admin_order_field = 'member_no'
 
     def refresh_leaders(self, request, queryset):
-        count_success = 0
-        count_fail = 0
-        queryset = queryset.order_by('id')
-        for team in queryset:
-            conductor_track = all([member.starred_conductor for member in team.members.all()])
-            if conductor_track:
-                # print(f"Conductor Track: {team.name}",team.conductor_track, conductor_track)
-                team.conductor_track = True
-                team.save()
-            team_leader = User.objects.filter(mobile_number__contains=team.leader_phone.strip('+'))
-            if team_leader.exists():
-                count_success += 1
-                team.leader = team_leader.first()
-                team.save()
-            if team_leader.exists() and Team.objects.filter(
-                    leader_phone__contains=team_leader.first().mobile_number.strip('+')).count() > 1:
-                dup_teams = Team.objects.filter(
-                    leader_phone__contains=team_leader.first().mobile_number.strip('+')).exclude(id=team.id)
-                all_members = TeamMember.objects.filter(team__id__in=dup_teams.values_list('id', flat=True))
-                for member in all_members:
-                    member.team = team
-                    member.save()
-                for issues in Issue.objects.filter(team__id__in=dup_teams.values_list('id', flat=True)):
-                    issues.team = team
-                    issues.save()
-                try:
-                    dup_teams.delete()
-                except Exception as e:
-                    count_fail += 1
-                    logger.error(f"Error in deleting duplicate teams({[t.name for t in dup_teams]}): {e}")
-            # all_members = TeamMember.objects.filter(team__leader_phone__contains=team.leader_phone.strip('+'))
-            # for member in all_members:
-            #     member.team = team
-            #     member.save()
-            #     print(member.name)
-
-        self.message_user(request, f"Successfully updated {count_success} teams. Failed to update {count_fail} teams.")
+        counts = merge_duplicate_teams(queryset)
+        self.message_user(
+            request, f"Linked {counts['leaders']} teams to their leader. Merged {counts['duplicates']} duplicate teams "
+                     f"into {counts['merged_teams']} teams, moving {counts['members']} members and {counts['issues']} "
+                     f"issues. {counts['conductor_track']} teams moved to the Conductor Track.")
 
     def approve_teams(self, request, queryset):
-        approved_grp = Group.objects.get_or_create(name='Approved Team')[0]
-        for team in queryset:
-            team.approved = True
-            team.save()
-            team.leader.groups.add(approved_grp)
-            team.leader.save()
-            for member in team.members.all():
-                member.approval_status = 'approved'
-                member.save()
+        approved = bulk_approve_teams(queryset)
+        self.message_user(request, f'Approved {approved} teams.')
 
     def disapprove_teams(self, request, queryset):
-        approved_grp = Group.objects.get_or_create(name='Approved Team')[0]
-        queryset = queryset.filter(approved=True)
-        for team in queryset:
-            team.approved = False
-            team.save()
-            team.leader.groups.remove(approved_grp)
-            team.leader.save()
-            for member in team.members.all():
-                member.approval_status = 'Declined'
-                member.save()
+        declined = bulk_decline_teams(queryset)
+        self.message_user(request, f'Declined {declined} teams.')
 
     def send_rsvp_email(self, request, queryset):
-        queryset = queryset.filter(approved=True)
-        threading.Thread(target=send_rsvp_email, args=(queryset,)).start()
+        queued = queue_rsvp_emails(queryset.filter(approved=True).select_related('leader'))
+        self.message_user(request, f'RSVP emails queued for {queued} teams, teams already mailed were skipped.')
 
     def get_queryset(self, request):
+        # Deleted members are left out like in team.members.count()
         return super().get_queryset(request).annotate(
-            member_no=Count('members')
+            member_no=Count('members', filter=Q(members__deleted=False))
         ).order_by('-member_no')
 
     def has_delete_permission(self, request, obj=None):
@@ -374,22 +422,15 @@ class LeaderboardAdmin(admin.ModelAdmin):
         return obj.college
 
     def get_queryset(self, request):
-        # Filter Campus Ambassadors who have referrals, and among the referred members, only include those who have starred_conductor=True
-        queryset = super().get_queryset(request).annotate(
-            referral_count=Count('referrals', filter=Q(referrals__starred_conductor=True))
-        ).filter(referral_count__gt=0).order_by('-referral_count')
-        # Save the queryset so it can be used in the rank calculation
-        self.rank_cache = queryset
-        return queryset
+        # Read the precomputed snapshot, only ambassadors with at least one referral who starred the Conductor repo
+        return super().get_queryset(request).select_related('user', 'leaderboard_entry').filter(
+            leaderboard_entry__referral_count__gt=0).order_by('leaderboard_entry__rank')
 
     def rank(self, obj):
-        # Rank is based on the queryset ordering
-        for idx, item in enumerate(self.rank_cache, start=1):
-            if item == obj:
-                return idx
-        return None
+        return obj.leaderboard_entry.rank
 
     rank.short_description = 'Rank'
+    rank.admin_order_field = 'leaderboard_entry__rank'
 
 
 @admin.register(MyTeam)
@@ -453,11 +494,13 @@ class TeamLeaderAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         return Group.objects.get(name='Team Leader').user_set.all().annotate(
-            team_count=Count('team_leader')
+            team_count=Count('team_leader', filter=Q(team_leader__deleted=False))
         ).order_by('-team_count')
 
     def team_count(self, obj):
-        return Team.objects.filter(leader=obj).count()
+        return obj.team_count
+
+    team_count.admin_order_field = 'team_count'
 
     def has_change_permission(self, request, obj=None):
         return False
@@ -474,6 +517,7 @@ class IssueAdmin(admin.ModelAdmin):
     exclude = common_exclude
     list_display = ('title', 'status', 'response', 'team')
     list_filter = ('status', 'team',)
+    list_select_related = ('team',)
     search_fields = (
         'title', 'description', 'raised_by__full_name', 'team__name', 'raised_by__email', 'raised_by__mobile_number')
 
@@ -534,13 +578,15 @@ class TeamLLMResource(resources.ModelResource):
 
     def get_instance(self, instance_loader, row):
         """
-        Overrides the default get_instance method to query using icontains for leader_phone
+        Overrides the default get_instance method to match the team on its normalized leader phone
         """
         # Retrieve the value from the CSV row for 'Team Leader Phone Number'
-        leader_phone = row.get('Team Leader Phone Number')
+        leader_phone = normalize_phone(row.get('Team Leader Phone Number', '') or '')
+        if not leader_phone:
+            return None
 
-        # Use icontains to match team by leader_phone (partial match, case-insensitive)
-        return Team.objects.filter(leader_phone__icontains=leader_phone).first()
+        # Exact match on the indexed normalized phone column
+        return Team.objects.filter(normalized_phone=leader_phone).first()
 
     def before_import_row(self, row, **kwargs):
         """
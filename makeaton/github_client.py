@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('home')
+
+RETRY_STATUS_CODES = (403, 429, 500, 502, 503, 504)  # 403 only when it is a rate limit answer, see is_retryable
+
+
+def is_retryable(response):
+    """
+    Tell whether a response is worth retrying. GitHub also answers 403 for forbidden resources, those are only
+    retried when the rate limit headers show the quota is spent or a Retry-After is given.
+
+    :param response: Response received
+    """
+    if response.status_code not in RETRY_STATUS_CODES:
+        return False
+    if response.status_code == 403:
+        return response.headers.get('X-RateLimit-Remaining') == '0' or 'Retry-After' in response.headers
+    return True
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header, given either as seconds or as an HTTP-date.
+
+    :param value: Header value
+    :return: Seconds to wait, or None when the value can't be parsed
+    """
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0)
+
+
+class RateLimitBucket:
+    """
+    Token bucket mirroring GitHub's rate limit window.
+
+    The bucket holds the requests left in the current window as reported by the
+    X-RateLimit-Remaining header and refills when the X-RateLimit-Reset time passes,
+    so callers run at the real API ceiling and only wait once the quota is spent.
+    """
+
+    def __init__(self, reserve=0):
+        """
+        :param reserve: Number of requests to leave unused in every window
+        """
+        self.reserve = reserve
+        self.tokens = None  # Unknown until the first response arrives
+        self.reset_at = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a request may be sent.
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                if self.tokens is not None and now >= self.reset_at:
+                    # The window has been reset, the next response will tell the new quota
+                    self.tokens = None
+                if self.tokens is None:
+                    return
+                if self.tokens > self.reserve:
+                    self.tokens -= 1
+                    return
+                wait = self.reset_at - now
+            logger.info(f"GitHub rate limit reached, waiting {int(wait)} seconds for the reset")
+            time.sleep(max(wait, 1))
+
+    def update(self, headers):
+        """
+        Sync the bucket with the rate limit headers of a response.
+
+        :param headers: Response headers
+        """
+        remaining, reset_at = headers.get('X-RateLimit-Remaining'), headers.get('X-RateLimit-Reset')
+        if remaining is None or reset_at is None:
+            return
+        remaining, reset_at = int(remaining), int(reset_at)
+        with self.lock:
+            if self.tokens is None or reset_at != self.reset_at:
+                self.tokens = remaining
+            else:
+                self.tokens = min(self.tokens, remaining)
+            self.reset_at = reset_at
+
+
+class GitHubClient:
+    """
+    Shared GitHub REST client with a pooled session, bounded thread-pool concurrency,
+    a header driven rate limit bucket and retries with backoff on rate limit (403/429) and 5xx answers.
+    """
+
+    def __init__(self, token=None, base_url=None, max_workers=None, max_retries=None, backoff=1.0):
+        """
+        :param token: API token, defaults to settings.GITHUB_API_TOKEN
+        :param base_url: API base URL, defaults to settings.GITHUB_API_URL
+        :param max_workers: Number of concurrent requests, defaults to settings.GITHUB_MAX_WORKERS
+        :param max_retries: Retries per request, defaults to settings.GITHUB_MAX_RETRIES
+        :param backoff: Base delay in seconds, doubled after every retry
+        """
+        self.base_url = (base_url or settings.GITHUB_API_URL).rstrip('/')
+        self.max_workers = max_workers or settings.GITHUB_MAX_WORKERS
+        self.max_retries = settings.GITHUB_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = backoff
+        self.bucket = RateLimitBucket()
+        # One pool per client keeps the concurrency bounded even when several jobs check stars at once
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='github')
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({"Accept": "application/vnd.github.v3+json"})
+        token = settings.GITHUB_API_TOKEN if token is None else token
+        if token:
+            self.session.headers.update({"Authorization": f"token {token}"})
+
+    def get(self, path, params=None, headers=None):
+        """
+        Send a GET request, retrying on rate limit and server errors.
+
+        The delay before a retry is the Retry-After header when given, else an exponential backoff.
+
+        :param path: API path (e.g. "/users/octocat/starred") or an absolute URL such as a pagination link
+        :param params: Optional query parameters
+        :param headers: Optional extra request headers
+        :return: The last response received
+        """
+        url = path if path.startswith('http') else f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            response = self.session.get(url, params=params, headers=headers, timeout=30)
+            self.bucket.update(response.headers)
+            if not is_retryable(response) or attempt == self.max_retries:
+                return response
+            # A spent quota also empties the bucket, so acquire() waits for the reset before the retry
+            delay = parse_retry_after(response.headers.get('Retry-After', ''))
+            if delay is None:
+                delay = self.backoff * 2 ** attempt
+            logger.info(f"GitHub returned {response.status_code} for {url}, retrying in {delay} seconds")
+            time.sleep(delay)
+        return response
+
+    def map(self, func, items):
+        """
+        Run `func` over `items` on the client's thread pool.
+
+        :param func: Callable receiving one item, usually issuing requests through this client
+        :param items: Iterable of items
+        :return: List of results in the order of `items`
+        """
+        return list(self.executor.map(func, items))
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_github_client():
+    """
+    Return the process wide GitHub client so connections and the rate limit state are shared.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GitHubClient()
+        return _client
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from base.utils import normalize_phone
+
+
+def backfill_normalized_phone(apps, schema_editor):
+    for model_name, phone_field in (('Team', 'leader_phone'), ('TeamMember', 'phone_number')):
+        model = apps.get_model('makeaton', model_name)
+        rows = []
+        for pk, phone in model.objects.values_list('pk', phone_field).iterator(chunk_size=2000):
+            rows.append(model(pk=pk, normalized_phone=normalize_phone(phone)))
+        model.objects.bulk_update(rows, ['normalized_phone'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('makeaton', '0032_team_normalized_phone_teammember_normalized_phone'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_normalized_phone, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import Rank
+
+
+def populate_leaderboard(apps, schema_editor):
+    CampusAmbassador = apps.get_model('ca', 'CampusAmbassador')
+    LeaderboardEntry = apps.get_model('makeaton', 'LeaderboardEntry')
+    counts = CampusAmbassador.objects.filter(deleted=False).annotate(
+        referral_count=Count('referrals', filter=Q(referrals__starred_conductor=True, referrals__deleted=False))
+    ).values_list('id', 'referral_count')
+    LeaderboardEntry.objects.bulk_create(
+        [LeaderboardEntry(ambassador_id=pk, referral_count=total) for pk, total in counts], batch_size=1000)
+    ranked = LeaderboardEntry.objects.annotate(
+        new_rank=Window(expression=Rank(), order_by=F('referral_count').desc())
+    ).values_list('id', 'new_rank')
+    LeaderboardEntry.objects.bulk_update(
+        [LeaderboardEntry(id=pk, rank=rank) for pk, rank in ranked], ['rank'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('makeaton', '0034_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_leaderboard, migrations.RunPython.noop),
+    ]
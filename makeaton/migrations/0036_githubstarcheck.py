@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-18 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('makeaton', '0035_populate_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GitHubStarCheck',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_active', models.BooleanField(default=False)),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+                ('deleted', models.BooleanField(default=False)),
+                ('username', models.CharField(max_length=255, unique=True)),
+                ('etag', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_modified', models.CharField(blank=True, max_length=255, null=True)),
+                ('starred', models.BooleanField(default=False)),
+                ('checked_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'GitHub Star Check',
+                'verbose_name_plural': 'GitHub Star Checks',
+            },
+        ),
+    ]
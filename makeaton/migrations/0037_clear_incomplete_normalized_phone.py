@@ -0,0 +1,27 @@
+from django.db import migrations
+
+from base.utils import normalize_phone
+
+
+def clear_incomplete_normalized_phone(apps, schema_editor):
+    # The first backfill stored a bare '+91' (or a few digits after it) for incomplete numbers, which matched
+    # unrelated rows to each other
+    for model_name, phone_field in (('Team', 'leader_phone'), ('TeamMember', 'phone_number')):
+        model = apps.get_model('makeaton', model_name)
+        rows = []
+        for pk, phone, normalized in model.objects.filter(normalized_phone__isnull=False).values_list(
+                'pk', phone_field, 'normalized_phone').iterator(chunk_size=2000):
+            if normalize_phone(phone) != normalized:
+                rows.append(model(pk=pk, normalized_phone=normalize_phone(phone)))
+        model.objects.bulk_update(rows, ['normalized_phone'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('makeaton', '0036_githubstarcheck'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_incomplete_normalized_phone, migrations.RunPython.noop),
+    ]
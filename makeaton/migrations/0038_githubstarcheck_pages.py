@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('makeaton', '0037_clear_incomplete_normalized_phone'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='githubstarcheck',
+            name='etag',
+        ),
+        migrations.RemoveField(
+            model_name='githubstarcheck',
+            name='last_modified',
+        ),
+        migrations.AddField(
+            model_name='githubstarcheck',
+            name='pages',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import Rank
+
+
+def recount_leaderboard(apps, schema_editor):
+    # 0035 counted soft deleted referrals, recount and rank like makeaton.utils.refresh_leaderboard
+    CampusAmbassador = apps.get_model('ca', 'CampusAmbassador')
+    LeaderboardEntry = apps.get_model('makeaton', 'LeaderboardEntry')
+    counts = dict(CampusAmbassador.objects.filter(deleted=False).annotate(
+        referral_count=Count('referrals', filter=Q(referrals__starred_conductor=True, referrals__deleted=False))
+    ).values_list('id', 'referral_count'))
+    previous = dict(LeaderboardEntry.objects.values_list('ambassador_id', 'referral_count'))
+    changed = [LeaderboardEntry(ambassador_id=pk, referral_count=total) for pk, total in counts.items()
+               if previous.get(pk) != total]
+    LeaderboardEntry.objects.bulk_create(changed, update_conflicts=True, unique_fields=['ambassador'],
+                                         update_fields=['referral_count', 'updated_at'], batch_size=1000)
+    LeaderboardEntry.objects.exclude(ambassador_id__in=list(counts)).delete()
+    ranked = LeaderboardEntry.objects.annotate(
+        new_rank=Window(expression=Rank(), order_by=F('referral_count').desc())
+    ).values_list('id', 'rank', 'new_rank')
+    LeaderboardEntry.objects.bulk_update(
+        [LeaderboardEntry(id=pk, rank=new_rank) for pk, rank, new_rank in ranked if rank != new_rank], ['rank'],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('makeaton', '0038_githubstarcheck_pages'),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_leaderboard, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,11 @@
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
 
 from authentication.models import User
 from base.models import Model
+from base.utils import normalize_phone
 from ca.models import CampusAmbassador
 
 
@@ -15,6 +18,8 @@ class Team(Model):
     why_should_select_you = models.TextField(
         default="Describe your team, whether you are beginners or pros aiming to win big! Don't use GPT for this")  # Details about projects built or planned
     leader_phone = models.CharField(max_length=15)  # Cleaned phone number of the team leader
+    normalized_phone = models.CharField(max_length=15, blank=True, null=True, editable=False,
+                                        db_index=True)  # Canonical leader phone, used for exact lookups
     leader = models.ForeignKey('authentication.User', on_delete=models.RESTRICT,
                                related_name='team_leader', blank=True, null=True)  # Team leader
     ## Hardware or Software default is Software
@@ -32,6 +37,12 @@ class Team(Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.normalized_phone = normalize_phone(self.leader_phone)
+        if kwargs.get('update_fields') is not None and 'leader_phone' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'normalized_phone'}
+        super().save(*args, **kwargs)
+
     # @property
     # def members(self):
     #     return self.teammember_set.all()
@@ -56,6 +67,8 @@ class TeamMember(Model):
     name = models.CharField(max_length=255)
     email = models.EmailField()
     phone_number = models.CharField(max_length=15)  # Cleaned phone number
+    normalized_phone = models.CharField(max_length=15, blank=True, null=True, editable=False,
+                                        db_index=True)  # Canonical phone number, used for exact lookups
     approval_status = models.CharField(max_length=50)  # Approval status of the application
     age = models.IntegerField(blank=True, null=True)  # Age of the participant
     gender = models.CharField(max_length=50, blank=True, null=True)  # Gender of the participant
@@ -93,6 +106,12 @@ class TeamMember(Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.normalized_phone = normalize_phone(self.phone_number)
+        if kwargs.get('update_fields') is not None and 'phone_number' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'normalized_phone'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Team Member"
         verbose_name_plural = "Team Members"
@@ -113,6 +132,41 @@ class Leaderboard(CampusAmbassador):
         proxy = True
 
 
+class LeaderboardEntry(Model):
+    """
+    Precomputed leaderboard row for a Campus Ambassador, kept in sync by `makeaton.utils.refresh_leaderboard`
+    """
+    ambassador = models.OneToOneField('ca.CampusAmbassador', on_delete=models.CASCADE,
+                                      related_name='leaderboard_entry')
+    referral_count = models.IntegerField(default=0)  # Referred members who starred the Conductor repo
+    rank = models.IntegerField(default=0, db_index=True)  # RANK() over referral_count, highest first
+
+    class Meta:
+        verbose_name = "Leaderboard Entry"
+        verbose_name_plural = "Leaderboard Entries"
+        ordering = ('rank',)
+
+    def __str__(self):
+        return f"{self.rank}. {self.ambassador_id} ({self.referral_count})"
+
+
+class GitHubStarCheck(Model):
+    """
+    Last starred-repos responses seen for a GitHub user, used to send conditional requests on re-checks
+    """
+    username = models.CharField(max_length=255, unique=True)  # Lowercase GitHub login
+    pages = models.JSONField(default=list, blank=True)  # [ETag, Last-Modified] of every starred page read
+    starred = models.BooleanField(default=False)  # Result of the last full check
+    checked_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "GitHub Star Check"
+        verbose_name_plural = "GitHub Star Checks"
+
+    def __str__(self):
+        return self.username
+
+
 class MyTeam(Team):
     class Meta:
         verbose_name = "My Team"
@@ -167,3 +221,36 @@ class TeamRsvp(Team):
         verbose_name = "Team RSVP"
         verbose_name_plural = "Team RSVPs"
         proxy = True
+
+
+# Saves through the admin proxies are sent with the proxy as sender
+@receiver(post_init, sender=TeamMember)
+@receiver(post_init, sender=Participants)
+@receiver(post_init, sender=MyTeamMember)
+def remember_leaderboard_state(sender, instance, **kwargs):
+    # Read from __dict__ so deferred fields of only() querysets are not loaded one query per instance
+    values = instance.__dict__
+    instance._leaderboard_state = (values.get('referral_id'), values.get('starred_conductor'), values.get('deleted'))
+
+
+@receiver(post_save, sender=TeamMember)
+@receiver(post_save, sender=Participants)
+@receiver(post_save, sender=MyTeamMember)
+def refresh_leaderboard_on_save(sender, instance, created, **kwargs):
+    # Model.delete is a soft delete saving deleted=True, which also changes the counts
+    previous = getattr(instance, '_leaderboard_state', (None, False, False))
+    current = (instance.referral_id, instance.starred_conductor, instance.deleted)
+    instance._leaderboard_state = current
+    if created or current != previous:
+        previous_referral = previous[0]
+        from makeaton.utils import refresh_leaderboard
+        refresh_leaderboard({previous_referral, instance.referral_id} - {None})
+
+
+@receiver(post_delete, sender=TeamMember)
+@receiver(post_delete, sender=Participants)
+@receiver(post_delete, sender=MyTeamMember)
+def refresh_leaderboard_on_delete(sender, instance, **kwargs):
+    if instance.referral_id:
+        from makeaton.utils import refresh_leaderboard
+        refresh_leaderboard({instance.referral_id})
@@ -0,0 +1,24 @@
+from base.jobs import register_task
+from makeaton.models import TeamMember
+from makeaton.utils import bulk_started_status_check, cross_match_referrals, sweep_started_status_check, \
+    update_leader_phone_numbers
+
+
+@register_task('makeaton.check_stars', batch_size=200)
+def check_stars_task(member_ids):
+    return bulk_started_status_check(TeamMember.objects.filter(id__in=member_ids))
+
+
+@register_task('makeaton.sweep_stars', batch_size=None)
+def sweep_stars_task(member_ids):
+    return sweep_started_status_check(TeamMember.objects.filter(id__in=member_ids))
+
+
+@register_task('makeaton.cross_match_referrals', batch_size=None)
+def cross_match_referrals_task(phones):
+    cross_match_referrals(phones=phones)
+
+
+@register_task('makeaton.update_leader_phone_numbers', batch_size=500)
+def update_leader_phone_numbers_task(rows):
+    update_leader_phone_numbers(rows)
@@ -1,3 +1,359 @@
+import json
+import time
+from importlib import import_module
+from email.utils import formatdate
+from unittest import mock
+
+import requests
+import tablib
+from django.apps import apps
+from django.contrib.auth.models import Group
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import makeaton.tasks  # noqa: F401, registers the tasks
+from authentication.models import User
+from base.jobs import claim_job, enqueue, run_job
+from base.models import Job
+from ca.models import CampusAmbassador
+from makeaton.admin import TEAM_NAME_COLUMN, TeamMemberResource
+from makeaton.github_client import GitHubClient, parse_retry_after
+from makeaton.models import Issue, Leaderboard, LeaderboardEntry, Participants, Team, TeamLeader, TeamMember
+from makeaton.utils import fetch_starred_status, merge_duplicate_teams, refresh_leaderboard, \
+    sweep_started_status_check
+
+
+def create_ambassador(code):
+    user = User.objects.create(email=f"{code}@example.com", full_name=f"Ambassador {code}")
+    return CampusAmbassador.objects.create(user=user, college='College', course='Course', year=1, coupon_code=code)
+
+
+def create_member(team, index, **kwargs):
+    return TeamMember.objects.create(team=team, name=f"Member {index}", email=f"member{index}@example.com",
+                                     phone_number=f"98765{index:05}", approval_status='pending',
+                                     level_of_study='UG', college_name='College', major_field_of_study='CS', **kwargs)
+
+
+def github_response(status_code=200, body=None, headers=None, next_url=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    if next_url:
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    response._content = json.dumps(body if body is not None else []).encode()
+    return response
+
+
+class StubSession:
+    """
+    Stands in for the requests.Session of a GitHubClient, answering with canned responses in order.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.requests.append((url, params, headers))
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+
+def stub_github_client(*responses):
+    client = GitHubClient(token='', base_url='https://api.github.test', max_workers=1, backoff=0)
+    client.session = StubSession(*responses)
+    return client
+
+
+class MergeDuplicateTeamsTests(TestCase):
+    def test_teams_sharing_a_leader_phone_are_merged(self):
+        kept = Team.objects.create(name='Kept', leader_phone='+91 98765 43210')
+        Team.objects.create(name='Duplicate', leader_phone='9876543210')
+
+        counts = merge_duplicate_teams(Team.objects.all())
+
+        self.assertEqual(counts['duplicates'], 1)
+        self.assertEqual(list(Team.objects.values_list('id', flat=True)), [kept.id])
+
+    def test_teams_with_incomplete_leader_phones_are_not_merged(self):
+        Team.objects.create(name='No phone', leader_phone='+91')
+        Team.objects.create(name='Other short phone', leader_phone='12345')
+        Team.objects.create(name='Short phone', leader_phone='+91 12345')
+
+        counts = merge_duplicate_teams(Team.objects.all())
+
+        self.assertEqual(counts['duplicates'], 0)
+        self.assertEqual(Team.objects.count(), 3)
+
+
+IMPORT_HEADERS = ('name', 'email', 'phone_number', "Team Leader's Phone number", TEAM_NAME_COLUMN,
+                  'Are you the team leader?', 'approval_status', 'Level of Study',
+                  'College Name (select other if not present)', 'Major/Field of Study (if not present, select other)')
+
+
+def import_members(*rows):
+    """
+    Import (name, phone number, leader phone number, team name) rows through the admin resource.
+    """
+    dataset = tablib.Dataset(headers=IMPORT_HEADERS)
+    for name, phone, leader_phone, team_name in rows:
+        dataset.append((name, f"{name.lower()}@example.com", phone, leader_phone, team_name, 'No', 'pending', 'UG',
+                        'College', 'CS'))
+    return TeamMemberResource().import_data(dataset, dry_run=False)
+
+
+class TeamMemberImportTests(TestCase):
+    def test_reimport_matches_members_and_teams_on_normalized_phones(self):
+        team = Team.objects.create(name='Team', leader_phone='98765 00000')
+        rows = [('Leader', '+91 98765 00000', '9876500000', 'Team'), ('Member', '9876500001', '9876500000', 'Team')]
+        self.assertFalse(import_members(*rows).has_errors())
+        self.assertFalse(import_members(*rows).has_errors())
+        self.assertEqual(list(Team.objects.all()), [team])
+        self.assertEqual(sorted(TeamMember.objects.filter(team=team).values_list('normalized_phone', flat=True)),
+                         ['+919876500000', '+919876500001'])
+
+    def test_incomplete_phone_numbers_are_reported(self):
+        result = import_members(('Member', '12345', '9876500000', 'Team'), ('Other', '9876500001', '+91', 'Team'))
+        self.assertTrue(result.has_validation_errors())
+        self.assertEqual(len(result.invalid_rows), 2)
+        self.assertFalse(Team.objects.exists())
+        self.assertFalse(TeamMember.objects.exists())
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        self.first = create_ambassador('FIRST')
+        self.second = create_ambassador('SECOND')
+        self.team = Team.objects.create(name='Team', leader_phone='9876500000')
+
+    def entry(self, ambassador):
+        return LeaderboardEntry.objects.get(ambassador=ambassador)
+
+    def test_member_changes_refresh_counts_and_ranks(self):
+        create_member(self.team, 1, referral=self.second, starred_conductor=True)
+        member = create_member(self.team, 2, referral=self.first)
+        refresh_leaderboard()
+        self.assertEqual((self.entry(self.second).referral_count, self.entry(self.second).rank), (1, 1))
+        self.assertEqual((self.entry(self.first).referral_count, self.entry(self.first).rank), (0, 2))
+
+        member.starred_conductor = True
+        member.save()
+        self.assertEqual((self.entry(self.first).referral_count, self.entry(self.first).rank), (1, 1))
+
+        member.delete()
+        self.assertEqual((self.entry(self.first).referral_count, self.entry(self.first).rank), (0, 2))
+
+    def test_saves_through_a_proxy_refresh_the_leaderboard(self):
+        member = create_member(self.team, 1, referral=self.first)
+        refresh_leaderboard()
+        participant = Participants.objects.get(pk=member.pk)
+        participant.starred_conductor = True
+        participant.save()
+        self.assertEqual(self.entry(self.first).referral_count, 1)
+
+    def test_unchanged_counts_are_not_reranked(self):
+        create_member(self.team, 1, referral=self.first, starred_conductor=True)
+        refresh_leaderboard()
+        # The counts are read and compared, the ranks are left alone
+        with self.assertNumQueries(2):
+            self.assertEqual(refresh_leaderboard([self.first.pk, self.second.pk]), 0)
+
+    def test_unrelated_saves_do_not_refresh_the_leaderboard(self):
+        with self.assertNumQueries(1):
+            self.team.save()
+
+    def test_recount_migration_skips_soft_deleted_referrals(self):
+        create_member(self.team, 1, referral=self.second, starred_conductor=True)
+        create_member(self.team, 2, referral=self.first, starred_conductor=True, deleted=True)
+        # A snapshot seeded with the soft deleted referral counted
+        LeaderboardEntry.objects.all().delete()
+        LeaderboardEntry.objects.bulk_create([LeaderboardEntry(ambassador=self.first, referral_count=1, rank=1),
+                                              LeaderboardEntry(ambassador=self.second, referral_count=1, rank=1)])
+
+        import_module('makeaton.migrations.0039_recount_leaderboardentry').recount_leaderboard(apps, None)
+        self.assertEqual((self.entry(self.first).referral_count, self.entry(self.first).rank), (0, 2))
+        self.assertEqual((self.entry(self.second).referral_count, self.entry(self.second).rank), (1, 1))
+
+
+class SweepStartedStatusTests(TestCase):
+    def test_members_are_matched_against_every_stargazer_page(self):
+        ambassador = create_ambassador('SWEEP')
+        team = Team.objects.create(name='Team', leader_phone='9876500000')
+        first = create_member(team, 1, referral=ambassador, github_profile='https://github.com/First-Star')
+        second = create_member(team, 2, github_profile='https://github.com/second-star')
+        unstarred = create_member(team, 3, starred_conductor=True, github_profile='https://github.com/nobody')
+        create_member(team, 4)
+        client = stub_github_client(
+            github_response(body=[{'login': 'first-star'}],
+                            next_url='https://api.github.test/repos/conductor-oss/conductor/stargazers?page=2'),
+            github_response(body=[{'login': 'Second-Star'}]),
+        )
+
+        with mock.patch('makeaton.utils.get_github_client', return_value=client):
+            self.assertEqual(sweep_started_status_check(TeamMember.objects.all()), 0)
+
+        starred = dict(TeamMember.objects.values_list('id', 'starred_conductor'))
+        self.assertEqual((starred[first.id], starred[second.id], starred[unstarred.id]), (True, True, False))
+        self.assertEqual(LeaderboardEntry.objects.get(ambassador=ambassador).referral_count, 1)
+        self.assertEqual([url for url, _, _ in client.session.requests], [
+            'https://api.github.test/repos/conductor-oss/conductor/stargazers',
+            'https://api.github.test/repos/conductor-oss/conductor/stargazers?page=2',
+        ])
+
+
+class StarTaskTests(TestCase):
+    def setUp(self):
+        team = Team.objects.create(name='Team', leader_phone='9876500000')
+        for index, login in enumerate(('first-star', 'broken', 'nobody')):
+            create_member(team, index, github_profile=f'https://github.com/{login}')
+
+    def run_job(self, name):
+        enqueue(name, TeamMember.objects.values_list('id', flat=True))
+        job = claim_job('worker-1')
+        run_job(job)
+        return Job.objects.get(pk=job.pk)
+
+    def test_failed_lookups_are_counted_by_the_star_check(self):
+        def fetch(user_name, pages=None):
+            if user_name == 'broken':
+                raise ConnectionError('reset')
+            return user_name == 'first-star', []
+
+        with mock.patch('makeaton.utils.fetch_starred_status', side_effect=fetch):
+            job = self.run_job('makeaton.check_stars')
+        self.assertEqual((job.status, job.failed_items), (Job.COMPLETED, 1))
+        self.assertEqual(len(job.checkpoints.get().item_seconds), 3)
+
+    def test_a_failed_sweep_counts_every_participant(self):
+        client = stub_github_client(github_response(404))
+        with mock.patch('makeaton.utils.get_github_client', return_value=client):
+            job = self.run_job('makeaton.sweep_stars')
+        self.assertEqual((job.status, job.failed_items), (Job.COMPLETED, 3))
+        self.assertFalse(TeamMember.objects.filter(last_start_checked__isnull=False).exists())
+
+
+@mock.patch('makeaton.github_client.time.sleep')
+class GitHubClientRetryTests(TestCase):
+    def test_forbidden_answers_are_not_retried(self, sleep):
+        client = stub_github_client(github_response(403, headers={'X-RateLimit-Remaining': '4999'}))
+        self.assertEqual(client.get('/users/octocat/starred').status_code, 403)
+        self.assertEqual(len(client.session.requests), 1)
+        sleep.assert_not_called()
+
+    def test_spent_rate_limit_is_retried(self, sleep):
+        reset = str(int(time.time()) - 1)
+        client = stub_github_client(
+            github_response(403, headers={'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': reset}),
+            github_response(200))
+        self.assertEqual(client.get('/users/octocat/starred').status_code, 200)
+        self.assertEqual(len(client.session.requests), 2)
+
+    def test_retry_after_is_honoured_as_seconds_or_http_date(self, sleep):
+        client = stub_github_client(github_response(429, headers={'Retry-After': '7'}),
+                                    github_response(403, headers={'Retry-After': formatdate(time.time() + 60,
+                                                                                            usegmt=True)}),
+                                    github_response(200))
+        self.assertEqual(client.get('/users/octocat/starred').status_code, 200)
+        (first,), (second,) = [call.args for call in sleep.call_args_list]
+        self.assertEqual(first, 7)
+        self.assertAlmostEqual(second, 60, delta=2)
+
+    def test_unparseable_retry_after(self, sleep):
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertEqual(parse_retry_after(formatdate(time.time() - 60, usegmt=True)), 0)
+
+
+class FetchStarredStatusTests(TestCase):
+    conductor = {'owner': {'login': 'conductor-oss'}, 'name': 'conductor'}
+    other = {'owner': {'login': 'octocat'}, 'name': 'hello-world'}
+
+    def fetch(self, client, pages=None):
+        with mock.patch('makeaton.utils.get_github_client', return_value=client):
+            return fetch_starred_status('octocat', pages)
+
+    def test_pages_are_read_until_the_repo_is_found(self):
+        client = stub_github_client(
+            github_response(body=[self.other], headers={'ETag': '"first"'}, next_url='https://next'),
+            github_response(body=[self.conductor], headers={'ETag': '"second"'}, next_url='https://next'))
+        self.assertEqual(self.fetch(client), (True, [['"first"', None], ['"second"', None]]))
+        self.assertEqual(len(client.session.requests), 2)
+
+    def test_every_page_read_is_revalidated(self):
+        pages = [['"first"', None], ['"second"', None]]
+        client = stub_github_client(github_response(304), github_response(304))
+        self.assertEqual(self.fetch(client, pages), (None, pages))
+        self.assertEqual([headers for _, _, headers in client.session.requests],
+                         [{'If-None-Match': '"first"'}, {'If-None-Match': '"second"'}])
+
+    def test_a_star_removed_past_the_first_page_is_noticed(self):
+        client = stub_github_client(github_response(304),
+                                    github_response(body=[self.other], headers={'ETag': '"changed"'}))
+        self.assertEqual(self.fetch(client, [['"first"', None], ['"second"', None]]),
+                         (False, [['"first"', None], ['"changed"', None]]))
+
+
+class AdminQueryCountTests(TestCase):
+    """
+    The admin changelists must run a fixed number of queries however many rows they show.
+    """
+    changelists = (Team, TeamMember, Participants, TeamLeader, CampusAmbassador, Leaderboard, Issue)
+    members_per_team = 3
+
+    def setUp(self):
+        superuser = User.objects.create_superuser(email='admin@example.com', full_name='Admin', password=None)
+        self.client.force_login(superuser)
+        self.seeded = 0
+
+    def seed(self, rows):
+        """
+        Create `rows` teams with their leader, members, ambassador and issue, without save signals.
+        """
+        leader_group = Group.objects.get_or_create(name='Team Leader')[0]
+        indexes = range(self.seeded, self.seeded + rows)
+        self.seeded += rows
+        leaders = [User(email=f"leader-{i}@example.com", full_name=f"Leader {i}", mobile_number=f"+91{i:010}",
+                        is_staff=True) for i in indexes]
+        ambassador_users = [User(email=f"ca-{i}@example.com", full_name=f"Ambassador {i}", is_staff=True)
+                            for i in indexes]
+        User.objects.bulk_create(leaders + ambassador_users)
+        User.groups.through.objects.bulk_create(
+            [User.groups.through(user_id=leader.pk, group_id=leader_group.pk) for leader in leaders])
+        ambassadors = CampusAmbassador.objects.bulk_create(
+            [CampusAmbassador(user=user, college='College', course='Course', year=1, coupon_code=f"CA{i}")
+             for i, user in zip(indexes, ambassador_users)])
+        teams = Team.objects.bulk_create(
+            [Team(name=f"Team {i}", leader=leader, leader_phone=leader.mobile_number,
+                  normalized_phone=leader.mobile_number) for i, leader in zip(indexes, leaders)])
+        TeamMember.objects.bulk_create(
+            [TeamMember(team=team, referral=ambassador, name=f"Member {j}", email=f"member-{i}-{j}@example.com",
+                        phone_number=f"+92{i:08}{j:02}", approval_status='pending', level_of_study='UG',
+                        college_name='College', major_field_of_study='CS', starred_conductor=True)
+             for i, team, ambassador in zip(indexes, teams, ambassadors) for j in range(self.members_per_team)])
+        Issue.objects.bulk_create([Issue(title=f"Issue {i}", raised_by=team.leader, team=team)
+                                   for i, team in zip(indexes, teams)])
+        refresh_leaderboard()
+
+    def query_counts(self):
+        counts = {}
+        for model in self.changelists:
+            url = reverse(f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist")
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            counts[model] = len(queries)
+        return counts
 
-# Create your tests here.
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.seed(1)
+        # The first requests warm per process caches such as content types
+        self.query_counts()
+        one_row = self.query_counts()
+        self.seed(9)
+        many_rows = self.query_counts()
+        for model in self.changelists:
+            with self.subTest(changelist=model._meta.verbose_name_plural):
+                self.assertEqual(many_rows[model], one_row[model])
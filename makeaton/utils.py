@@ -1,45 +1,117 @@
 import logging
 import re
 import time
+from collections import Counter
 from urllib.parse import urlparse
-import requests
 from django.conf import settings
+from django.db.models import Case, Count, Exists, F, IntegerField, Min, OuterRef, Q, Subquery, Value, When, Window
+from django.db.models.functions import Rank
 from django.utils import timezone
 
-from base.utils import clean_mobile_number
+from base.jobs import item_timer
+from base.utils import clean_mobile_number, chunks
 from ca.models import CampusAmbassador
-from makeaton.models import TeamMember
+from makeaton.github_client import get_github_client
+from makeaton.models import GitHubStarCheck, Issue, LeaderboardEntry, Team, TeamMember
 
 logger = logging.getLogger('home')
 
-RATE_LIMIT_PER_SECOND = 1
-RATE_LIMIT_PER_MINUTE = 80  # Maximum allowable requests per minute
-REQUEST_DELAY = 1 / RATE_LIMIT_PER_SECOND  # Time to wait between requests (approx. 0.75 sec)
+REFERRAL_MATCH_CHUNK_SIZE = 1000  # Members per referral matching UPDATE when matching a subset
+STARGAZERS_PER_PAGE = 100  # Maximum page size allowed by the GitHub API
+STAR_CHECK_CHUNK_SIZE = 200  # Participants checked and saved per batch in bulk_started_status_check
+STAR_CHECK_INTERVAL = 4 * 60 * 60  # Seconds before a participant is checked again
 
 
-def cross_match_referrals():
-    for ca in CampusAmbassador.objects.all():
-        if TeamMember.objects.filter(coupon_code=ca.coupon_code, referral__isnull=True).exists():
-            TeamMember.objects.filter(coupon_code=ca.coupon_code, referral__isnull=True).update(referral=ca)
-            logger.info(
-                f"Matched {ca} to {TeamMember.objects.filter(coupon_code=ca.coupon_code, referral__isnull=True)}")
+def cross_match_referrals(phones=None, coupon_codes=None):
+    """
+    Link team members with an unmatched coupon code to the Campus Ambassador owning that code.
+
+    Every batch is a single UPDATE joined to CampusAmbassador through a correlated subquery, so the cost no
+    longer grows with the number of ambassadors.
+
+    :param phones: Optional normalized phone numbers of the members to consider (e.g. the rows of the latest import)
+    :param coupon_codes: Optional coupon codes to consider (e.g. the ambassadors of the latest CA import)
+    :return: Dictionary of coupon code to the number of members matched to it
+    """
+    ambassadors = CampusAmbassador.objects.filter(coupon_code=OuterRef('coupon_code')).order_by('id')
+    unmatched = TeamMember.objects.filter(referral__isnull=True, coupon_code__isnull=False).filter(
+        Exists(ambassadors))
+    if coupon_codes is not None:
+        unmatched = unmatched.filter(coupon_code__in=list(coupon_codes))
+
+    batches = [unmatched] if phones is None else [unmatched.filter(normalized_phone__in=batch)
+                                                  for batch in chunks(phones, REFERRAL_MATCH_CHUNK_SIZE)]
+    matched = Counter()
+    for batch in batches:
+        counts = dict(batch.order_by().values_list('coupon_code').annotate(total=Count('id')))
+        if counts:
+            batch.update(referral=Subquery(ambassadors.values('id')[:1]))
+            matched.update(counts)
+    for coupon_code, total in matched.items():
+        logger.info(f"Matched {total} team members to coupon code {coupon_code}")
+    if matched:
+        refresh_leaderboard(CampusAmbassador.objects.filter(coupon_code__in=list(matched)).values_list('id', flat=True))
+    return dict(matched)
+
+
+def refresh_leaderboard(ambassador_ids=None):
+    """
+    Refresh the Campus Ambassador leaderboard snapshot.
 
+    Referral counts are recomputed only for the given ambassadors (all of them when None) and only the counts
+    that changed are written. The ranks of the whole snapshot are then recomputed with a RANK() window, only when
+    a count changed, and only the rows whose rank moved are written back.
 
-def update_leader_phone_numbers(dataset):
-    print("Sleeping for 120 seconds")
-    time.sleep(120)
-    print("Waking up")
-    for data in dataset:
+    :param ambassador_ids: Optional iterable of CampusAmbassador ids whose referrals changed
+    :return: Number of ambassadors whose referral count changed
+    """
+    ambassadors = CampusAmbassador.objects.all()
+    entries = LeaderboardEntry.objects.all()
+    if ambassador_ids is not None:
+        ambassador_ids = list(ambassador_ids)
+        if not ambassador_ids:
+            return 0
+        ambassadors = ambassadors.filter(id__in=ambassador_ids)
+        entries = entries.filter(ambassador_id__in=ambassador_ids)
+    counts = dict(ambassadors.annotate(
+        referral_count=Count('referrals', filter=Q(referrals__starred_conductor=True, referrals__deleted=False))
+    ).values_list('id', 'referral_count'))
+    previous = dict(entries.values_list('ambassador_id', 'referral_count'))
+    changed = [LeaderboardEntry(ambassador_id=pk, referral_count=total) for pk, total in counts.items()
+               if previous.get(pk) != total]
+    LeaderboardEntry.objects.bulk_create(changed, update_conflicts=True, unique_fields=['ambassador'],
+                                         update_fields=['referral_count', 'updated_at'])
+    removed = 0
+    if ambassador_ids is None:
+        removed = LeaderboardEntry.objects.exclude(ambassador_id__in=list(counts)).delete()[0]
+    if not changed and not removed:
+        return 0
+
+    ranked = LeaderboardEntry.objects.annotate(
+        new_rank=Window(expression=Rank(), order_by=F('referral_count').desc())
+    ).values_list('id', 'rank', 'new_rank')
+    moved = [LeaderboardEntry(id=pk, rank=new_rank) for pk, rank, new_rank in ranked if rank != new_rank]
+    LeaderboardEntry.objects.bulk_update(moved, ['rank'], batch_size=REFERRAL_MATCH_CHUNK_SIZE)
+    return len(changed)
+
+
+def update_leader_phone_numbers(rows):
+    """
+    Fill the leader phone number of imported members that don't have one yet.
+
+    :param rows: Iterable of (phone_number, leader_phone) pairs from the import file
+    """
+    for phone_number, leader_phone in rows:
         try:
-            phone, leader_phone = clean_mobile_number(data[3]), clean_mobile_number(data[21])
-            team_member = TeamMember.objects.get(phone_number=phone)
+            phone, leader_phone = clean_mobile_number(phone_number), clean_mobile_number(leader_phone)
+            team_member = TeamMember.objects.get(normalized_phone=phone)
             if not team_member.leader_phone_number:
                 team_member.leader_phone_number = leader_phone
                 team_member.save()
             # else:
             #     logger.info(f"Leader phone number already exists for {team_member}")
         except TeamMember.DoesNotExist:
-            logger.error(f"Team member with phone number {data[3]} not found")
+            logger.error(f"Team member with phone number {phone_number} not found")
 
 
 def has_user_starred_repo(username, repo_owner="conductor-oss", repo_name="conductor"):
@@ -51,33 +123,61 @@ def has_user_starred_repo(username, repo_owner="conductor-oss", repo_name="condu
     :param repo_name: Name of the repository
     :return: True if the user has starred the repo, False otherwise
     """
-    # GitHub API URL to get the list of starred repos for the user
-    url = f"https://api.github.com/users/{username}/starred"
+    return fetch_starred_status(username, repo_owner=repo_owner, repo_name=repo_name)[0]
 
-    # Make a GET request to the API
-    response = requests.get(url,
-                            headers={
-                                "Accept": "application/vnd.github.v3+json",
-                                "Authorization": f"token {settings.GITHUB_API_TOKEN}"
-                            })
 
-    if response.status_code == 200:
-        # Parse the JSON response
-        starred_repos = response.json()
+def fetch_starred_status(username, pages=None, repo_owner="conductor-oss", repo_name="conductor"):
+    """
+    Check if a GitHub user has starred a specific repository, revalidating a previous result.
+
+    The user's starred list (most recent stars first) is read page by page until the repo is found. Every page
+    read by the previous check is requested with its own If-None-Match / If-Modified-Since validators, a 304
+    Not Modified answer costs no rate limit quota. A new star changes the first page and a removed star changes
+    the page it was on, so when all these pages are unchanged the previous result still holds. Otherwise the list
+    is read on from the first changed page.
+
+    :param username: GitHub username of the user
+    :param pages: [etag, last_modified] pairs of the pages read by the previous check
+    :param repo_owner: Owner of the repository
+    :param repo_name: Name of the repository
+    :return: Tuple of (starred, pages), starred is None when none of the previously read pages changed
+    """
+    client = get_github_client()
+    url = f"/users/{username}/starred"
+    pages = pages or []
+    validators = []
+    page = 1
+    while True:
+        headers = {}
+        if page <= len(pages):
+            etag, last_modified = pages[page - 1]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        response = client.get(url, params={"per_page": STARGAZERS_PER_PAGE, "page": page}, headers=headers)
+        if response.status_code == 304:
+            validators.append(pages[page - 1])
+            if page == len(pages):
+                return None, validators
+            page += 1
+            continue
+        if response.status_code == 404:
+            return False, []
+        if response.status_code == 403:
+            logger.error(f"Rate limit exceeded for {username}")
+            raise Exception(f"Rate limit exceeded for {username}")
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch starred repos: {response.status_code}")
+        validators.append([response.headers.get('ETag'), response.headers.get('Last-Modified')])
 
         # Loop through the repos to check if the specific repo exists
-        for repo in starred_repos:
+        for repo in response.json():
             if repo['owner']['login'] == repo_owner and repo['name'] == repo_name:
-                return True
-
-        return False  # Repo not found in the starred list
-    if response.status_code == 404:
-        return False
-    if response.status_code == 403:
-        logger.error(f"Rate limit exceeded for {username}")
-        raise Exception(f"Rate limit exceeded for {username}")
-    else:
-        raise Exception(f"Failed to fetch starred repos: {response.status_code}")
+                return True, validators
+        if 'next' not in response.links:
+            return False, validators  # Repo not found in the starred list
+        page += 1
 
 
 # def clean_github(profile):
@@ -117,110 +217,315 @@ def clean_github(profile):
         return None
 
 
+def fetch_stargazers(repo_owner="conductor-oss", repo_name="conductor"):
+    """
+    Fetch every stargazer of a repository by paging through the stargazers endpoint once.
+
+    :param repo_owner: Owner of the repository
+    :param repo_name: Name of the repository
+    :return: Set of lowercase GitHub logins that starred the repo
+    """
+    client = get_github_client()
+    url = f"/repos/{repo_owner}/{repo_name}/stargazers"
+    params = {"per_page": STARGAZERS_PER_PAGE}
+    logins = set()
+    while url:
+        response = client.get(url, params=params)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch stargazers: {response.status_code}")
+        page = response.json()
+        logins.update(user['login'].lower() for user in page)
+        # The next page URL already carries the query string
+        url = response.links.get('next', {}).get('url') if page else None
+        params = None
+    logger.info(f"Fetched {len(logins)} stargazers of {repo_owner}/{repo_name}")
+    return logins
+
+
+def sweep_started_status_check(queryset):
+    """
+    Check the started status of participants in bulk against a single sweep of the repo's stargazers.
+
+    :param queryset: Queryset of TeamMember objects
+    :return: Number of participants that could not be checked, every one with a GitHub profile when the sweep
+        failed
+    """
+    start_time = timezone.now()
+    members = []
+    for team_member in queryset.only('id', 'github_profile', 'referral', 'starred_conductor'):
+        user_name = clean_github(team_member.github_profile) if team_member.github_profile else None
+        if user_name:
+            members.append((team_member, user_name.lower()))
+    try:
+        stargazers = fetch_stargazers()
+    except Exception as e:
+        logger.error(f"Error sweeping the stargazers for {len(members)} participants: {e}")
+        return len(members)
+    checked_at = timezone.now()
+    referrals = set()
+    for team_member, user_name in members:
+        starred = user_name in stargazers
+        if starred != team_member.starred_conductor and team_member.referral_id:
+            referrals.add(team_member.referral_id)
+        team_member.starred_conductor = starred
+        team_member.last_start_checked = checked_at
+    TeamMember.objects.bulk_update([team_member for team_member, _ in members],
+                                   ['starred_conductor', 'last_start_checked'], batch_size=REFERRAL_MATCH_CHUNK_SIZE)
+    refresh_leaderboard(referrals)
+    logger.info(f"Swept {len(members)} participants in {(timezone.now() - start_time).seconds} seconds")
+    return 0
+
+
 def bulk_started_status_check(queryset):
     """
     Check the started status of participants in bulk.
 
+    Users are checked concurrently through the shared GitHub client, which paces requests with the
+    API's rate limit headers. Each user's last page ETags are sent back so unchanged starred lists answer
+    with free 304s, and results are saved with one bulk_update per chunk.
+
     :param queryset: Queryset of TeamMember objects
-    :return: Dictionary of participant IDs and their started status
-    https://api.github.com/repos/conductor-oss/conductor/stargazers?per_page=100&page=3
-    change to this url
+    :return: Number of participants whose starred status could not be fetched
     """
-    count = 0
     start_time = timezone.now()
+    members = []
     for team_member in queryset:
-        user_name = None
-        if team_member.last_start_checked and (timezone.now() - team_member.last_start_checked).seconds < 4 * 60 * 60:
+        if team_member.last_start_checked and (
+                timezone.now() - team_member.last_start_checked).total_seconds() < STAR_CHECK_INTERVAL:
             logger.info(f"Skipping {team_member} as it was checked recently")
             continue
-        try:
-            user_name = clean_github(team_member.github_profile)
-            logger.info(f"Checking started status for {team_member}")
-            if user_name:
-                count += 1
-                time.sleep(REQUEST_DELAY)
-                if count % RATE_LIMIT_PER_MINUTE == 0:
-                    time.sleep(60)
-                team_member.starred_conductor = has_user_starred_repo(user_name)
-                team_member.last_start_checked = timezone.now()
-                team_member.save()
-                logger.info(f"Updated started status for {team_member} to {team_member.starred_conductor}")
-        except Exception as e:
-            logger.error(
-                f"Error updating started status for {team_member}: {e},{user_name}, {team_member.github_profile}")
-    logger.info(f"Checked {count} participants completed in {(timezone.now() - start_time).seconds // 60} minutes")
-
-
-import random
-import smtplib
-import ssl
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from time import sleep
-import certifi
+        user_name = clean_github(team_member.github_profile) if team_member.github_profile else None
+        if user_name:
+            members.append((team_member, user_name.lower()))
+
+    timer = item_timer()
+
+    def check(item):
+        (team_member, user_name), cached = item
+        with timer.time():
+            try:
+                starred, pages = fetch_starred_status(user_name, cached.pages if cached else None)
+                if starred is None:
+                    return cached.starred, pages, True
+                return starred, pages, False
+            except Exception as e:
+                logger.error(
+                    f"Error updating started status for {team_member}: {e},{user_name}, {team_member.github_profile}")
+                return None
+
+    client = get_github_client()
+    count = not_modified = failed = 0
+    for batch in chunks(members, STAR_CHECK_CHUNK_SIZE):
+        cache = {entry.username: entry for entry in
+                 GitHubStarCheck.objects.filter(username__in={user_name for _, user_name in batch})}
+        results = client.map(check, [(member, cache.get(member[1])) for member in batch])
+        updated = []
+        checks = {}
+        referrals = set()
+        for (team_member, user_name), result in zip(batch, results):
+            if result is None:
+                failed += 1
+                continue
+            starred, pages, cached = result
+            not_modified += cached
+            if starred != team_member.starred_conductor and team_member.referral_id:
+                referrals.add(team_member.referral_id)
+            team_member.starred_conductor = starred
+            team_member.last_start_checked = timezone.now()
+            updated.append(team_member)
+            checks[user_name] = GitHubStarCheck(username=user_name, pages=pages, starred=starred,
+                                                checked_at=team_member.last_start_checked)
+        TeamMember.objects.bulk_update(updated, ['starred_conductor', 'last_start_checked'])
+        GitHubStarCheck.objects.bulk_create(checks.values(), update_conflicts=True, unique_fields=['username'],
+                                            update_fields=['pages', 'starred', 'checked_at', 'updated_at'])
+        refresh_leaderboard(referrals)
+        count += len(updated)
+        logger.info(f"Updated started status for {count}/{len(members)} participants ({not_modified} not modified)")
+    logger.info(f"Checked {count} participants completed in {(timezone.now() - start_time).seconds // 60} minutes, "
+                f"{failed} failed")
+    return failed
+
+
 import logging
 
 from django.contrib.auth.models import Group
-from django.template.loader import render_to_string
+from django.db import transaction
 from django.utils.crypto import get_random_string
-from django.utils.html import strip_tags
+
+from authentication.ids import bulk_create_with_ids, get_user_id_allocator
+from authentication.models import User
+from base.outbox import queue_emails
+from base.utils import normalize_phone
 
 logger = logging.getLogger('home')
 from config import settings
 
+RSVP_SUBJECT = "You are shortlisted for Make-A-Ton 7.0 powered by Eduport."
 
-def send_email(receiver_email, user, team_name, conductor):
-    sender_email = settings.EMAIL_HOST_USER
-    password = settings.EMAIL_HOST_PASSWORD
-    # receiver_email = "contact.makeaton@gmail.com"
 
-    message = MIMEMultipart("alternative")
-    message["Subject"] = "You are shortlisted for Make-A-Ton 7.0 powered by Eduport."
-    message["From"] = sender_email
-    message["To"] = receiver_email
-    # message["To"] = "sunithvs2002thvs2002@gmail.com"
+def rsvp_email(team):
+    """
+    Outbox entry of the RSVP email for a team, keyed by the team so a team is mailed once.
+    """
+    return (f"rsvp:{team.pk}", team.leader.email, RSVP_SUBJECT, 'emails/rsvp.html', {
+        'full_name': team.leader.full_name,
+        'conductor': f"for conductor track" if team.conductor_track else "",
+        'team_name': team.name,
+    })
 
-    # Render the email content using the HTML template
-    email_content = render_to_string('emails/rsvp.html', {
-        'full_name': user.full_name,
-        'conductor': f"for conductor track" if conductor else "",
-        'team_name': team_name,
 
-    })
+def queue_rsvp_emails(queryset):
+    """
+    Queue the RSVP email of every team with a leader, teams already mailed are skipped.
 
-    # Strip HTML tags for the plain text alternative
-    plain_message = strip_tags(email_content)
+    :param queryset: Teams, with `select_related('leader')`
+    :return: Number of newly queued emails
+    """
+    return queue_emails(rsvp_email(team) for team in queryset if team.leader)
 
-    part1 = MIMEText(plain_message, "plain")
-    part2 = MIMEText(email_content, "html")
 
-    # Add HTML/plain-text parts to MIMEMultipart message
-    # The email client will try to render the last part first
-    message.attach(part1)
-    message.attach(part2)
+APPROVED_TEAM_GROUP = 'Approved Team'
+APPROVAL_CHUNK_SIZE = 500  # Teams per UPDATE and group rows per INSERT when approving or declining teams
 
-    # Create secure connection with server and send email
-    context = ssl.create_default_context(cafile=certifi.where())
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-        server.login(sender_email, password)
-        server.sendmail(
-            sender_email, receiver_email, message.as_string()
-        )
 
+def bulk_approve_teams(queryset):
+    """
+    Approve the teams, add their leaders to the Approved Team group and mark their members approved.
 
-def send_rsvp_email(queryset):
-    i = 0
-    for team in queryset:
-        # check user exists in a group
-        try:
-            i += 1
-            if i % 50 == 0:
-                sleep(random.randint(200, 210))
+    :param queryset: Teams to approve
+    :return: Number of teams approved
+    """
+    return _set_team_approval(queryset, True, 'approved')
+
+
+def bulk_decline_teams(queryset):
+    """
+    Decline the approved teams among the queryset and mark their members declined. Leaders leave the Approved Team
+    group unless they still lead another approved team.
+
+    :param queryset: Teams to decline, teams that are not approved are left as they are
+    :return: Number of teams declined
+    """
+    return _set_team_approval(queryset.filter(approved=True), False, 'Declined')
+
+
+def _set_team_approval(queryset, approved, approval_status):
+    """
+    Set based approval in one transaction: per batch of teams one UPDATE of the teams, one UPDATE of their members
+    and one INSERT or DELETE of the leaders' group rows, instead of several saves per team and member.
+    """
+    group = Group.objects.get_or_create(name=APPROVED_TEAM_GROUP)[0]
+    through = User.groups.through
+    now = timezone.now()
+    with transaction.atomic():
+        teams = list(queryset.order_by().values_list('id', 'leader_id'))
+        for batch in chunks(teams, APPROVAL_CHUNK_SIZE):
+            team_ids = [team_id for team_id, _ in batch]
+            leader_ids = {leader_id for _, leader_id in batch if leader_id}
+            # updated_at is set explicitly, update() skips auto_now
+            Team.objects.filter(id__in=team_ids).update(approved=approved, updated_at=now)
+            TeamMember.objects.filter(team_id__in=team_ids).update(approval_status=approval_status, updated_at=now)
+            if approved:
+                through.objects.bulk_create([through(user_id=leader_id, group_id=group.pk) for leader_id in leader_ids],
+                                            ignore_conflicts=True)
             else:
-                sleep(random.randint(4, 10))
-            send_email(team.leader.email, team.leader, team.name, team.conductor_track)
-            logger.info(f"Email sent to {team.leader.email}")
-            i += 1
-        except Exception as e:
-            logger.error(f"Error sending email to {team.leader.email}: {e}")
-            continue
+                still_approved = Team.objects.filter(leader_id__in=leader_ids, approved=True).values('leader_id')
+                through.objects.filter(group_id=group.pk, user_id__in=leader_ids).exclude(
+                    user_id__in=still_approved).delete()
+    logger.info(f"{'Approved' if approved else 'Declined'} {len(teams)} teams")
+    return len(teams)
+
+
+MERGE_CHUNK_SIZE = 500  # Duplicate teams per reassignment UPDATE in merge_duplicate_teams
+
+
+def merge_duplicate_teams(queryset):
+    """
+    Link the teams to the account of their leader phone, merge teams sharing a leader phone and move the teams
+    whose members all starred Conductor to the Conductor Track.
+
+    Duplicates are found with one GROUP BY over the normalized leader phone. The oldest team of every phone is kept,
+    the members and issues of the others are moved to it with bulk UPDATEs and the others are soft deleted.
+
+    :param queryset: Teams to refresh, their duplicates outside the queryset are merged as well
+    :return: Dictionary of counts: leaders, merged_teams, duplicates, members, issues, conductor_track
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        team_ids = list(queryset.order_by().values_list('id', flat=True))
+        keep_by_phone = dict(
+            Team.objects.filter(normalized_phone__in=Team.objects.filter(id__in=team_ids).values('normalized_phone'))
+            .order_by().values('normalized_phone').annotate(teams=Count('id'), keep=Min('id')).filter(teams__gt=1)
+            .values_list('normalized_phone', 'keep'))
+        duplicates = {team_id: keep_by_phone[phone] for team_id, phone in Team.objects.filter(
+            normalized_phone__in=list(keep_by_phone)).exclude(id__in=keep_by_phone.values()).values_list(
+            'id', 'normalized_phone')}
+
+        members = issues = 0
+        for batch in chunks(duplicates.items(), MERGE_CHUNK_SIZE):
+            duplicate_ids = [duplicate_id for duplicate_id, _ in batch]
+            keep = Case(*[When(team_id=duplicate_id, then=Value(keep_id)) for duplicate_id, keep_id in batch],
+                        output_field=IntegerField())
+            members += TeamMember.objects.filter(team_id__in=duplicate_ids).update(team_id=keep, updated_at=now)
+            issues += Issue.objects.filter(team_id__in=duplicate_ids).update(team_id=keep, updated_at=now)
+            Team.objects.filter(id__in=duplicate_ids).update(deleted=True, deleted_at=now, updated_at=now)
+
+        # The soft deleted duplicates drop out of the default manager
+        teams = Team.objects.filter(Q(id__in=team_ids) | Q(id__in=list(keep_by_phone.values())))
+        leaders = User.objects.filter(normalized_phone=OuterRef('normalized_phone')).order_by('date_joined')
+        linked = teams.filter(Exists(leaders)).update(leader=Subquery(leaders.values('id')[:1]), updated_at=now)
+        # All members starred, written portably instead of a Postgres-only bool_and aggregate
+        team_members = TeamMember.objects.filter(team=OuterRef('pk'))
+        conductor_track = teams.filter(conductor_track=False).filter(Exists(team_members)).exclude(
+            Exists(team_members.filter(starred_conductor=False))).update(conductor_track=True, updated_at=now)
+
+    counts = {'leaders': linked, 'merged_teams': len(keep_by_phone), 'duplicates': len(duplicates),
+              'members': members, 'issues': issues, 'conductor_track': conductor_track}
+    logger.info(f"Refreshed team leaders: {counts}")
+    return counts
+
+
+TEAM_MEMBER_GROUP = 'Team Member'
+PROVISION_CHUNK_SIZE = 500  # Emails per lookup and rows per INSERT or UPDATE when provisioning member accounts
+
+
+def provision_member_users(queryset):
+    """
+    Create dashboard accounts for the team members whose email has no account yet, add them to the Team Member
+    group and link them to the members. Members sharing an email get one account, linked to the first of them.
+
+    Existing emails are prefetched into a set, the users, their group rows and the member links are written
+    with bulk queries in one transaction.
+
+    :param queryset: Team members
+    :return: Number of users created
+    """
+    members = list(queryset.select_related(None).order_by('id'))
+    existing_emails = set()
+    for batch in chunks({member.email for member in members}, PROVISION_CHUNK_SIZE):
+        existing_emails.update(User.objects.filter(email__in=batch).values_list('email', flat=True))
+
+    new_members = {}
+    for member in members:
+        if member.email not in existing_emails:
+            new_members.setdefault(member.email, member)
+    if not new_members:
+        return 0
+
+    group = Group.objects.get_or_create(name=TEAM_MEMBER_GROUP)[0]
+    through = User.groups.through
+    now = timezone.now()
+    with transaction.atomic():
+        # bulk_create skips User.save, so the normalized phone is set here
+        new_users = bulk_create_with_ids(User, [
+            User(full_name=member.name, email=member.email, mobile_number=member.phone_number,
+                 normalized_phone=normalize_phone(member.phone_number), is_staff=True, is_active=True)
+            for member in new_members.values()], get_user_id_allocator(), batch_size=PROVISION_CHUNK_SIZE)
+        for member, user in zip(new_members.values(), new_users):
+            member.user = user
+            member.updated_at = now
+        through.objects.bulk_create([through(user_id=user.pk, group_id=group.pk) for user in new_users],
+                                    batch_size=PROVISION_CHUNK_SIZE, ignore_conflicts=True)
+        TeamMember.objects.bulk_update(new_members.values(), ['user', 'updated_at'], batch_size=PROVISION_CHUNK_SIZE)
+    logger.info(f"Created {len(new_users)} team member accounts")
+    return len(new_users)
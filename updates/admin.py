@@ -14,7 +14,7 @@ class ImParticipatingAdmin(admin.ModelAdmin):
     list_filter = ('is_generated', 'member')
     search_fields = ('member__name',)
     change_list_template = 'admin/poster_changelist.html'
-    exclude = common_exclude + ['is_generated']
+    exclude = common_exclude + ['is_generated', 'thumbnail']
     readonly_fields = ('poster', 'remarks')
     poster = None
 
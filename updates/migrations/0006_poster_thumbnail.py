@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-18 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('updates', '0005_socialmediaposts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idcard',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='posters/thumbnails'),
+        ),
+        migrations.AddField(
+            model_name='imparticipating',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='posters/thumbnails'),
+        ),
+    ]
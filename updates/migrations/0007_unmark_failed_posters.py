@@ -0,0 +1,21 @@
+from django.db import migrations
+from django.db.models import Q
+
+
+def unmark_failed_posters(apps, schema_editor):
+    # Failed renders used to be marked generated as well, their remarks tell why they failed
+    for model_name in ('ImParticipating', 'IdCard'):
+        model = apps.get_model('updates', model_name)
+        model.objects.filter(is_generated=True).filter(Q(poster='') | Q(poster__isnull=True)).update(
+            is_generated=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('updates', '0006_poster_thumbnail'),
+    ]
+
+    operations = [
+        migrations.RunPython(unmark_failed_posters, migrations.RunPython.noop),
+    ]
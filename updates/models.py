@@ -1,14 +1,20 @@
-import threading
-import uuid
+import hashlib
+import os
+from datetime import timedelta
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
 from django.db import models
+from django.db.models import Q
 from django.db.models.signals import post_save, pre_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
 
+from base.jobs import enqueue
 from base.models import Model
+from base.utils import chunks
 from updates.services.face_with_target_size import FaceNotDetectedError
 from updates.services.poster import PosterTemplate
 
@@ -24,11 +30,99 @@ def validate_profile_photo(value):
     return value
 
 
+FACE_NOT_DETECTED = "Face not detected in the uploaded photo. Please upload a photo with a clear face."
+NO_PROFILE_PHOTO = "Profile photo or poster template not provided. Please upload a profile photo."
+
+
+def render_poster(poster_template, profile_photo_path):
+    """
+    Render a poster without touching the database, so it can run in a worker process.
+
+    :param poster_template: PosterTemplate to place the head on
+    :param profile_photo_path: Path of the profile photo
+    :return: (poster bytes, thumbnail bytes or None, None) or (None, None, remarks) when the poster could not be
+        rendered
+    """
+    try:
+        return poster_template.render(profile_photo_path) + (None,)
+    except FaceNotDetectedError:
+        return None, None, FACE_NOT_DETECTED
+    except Exception as e:
+        return None, None, str(e)
+
+
+def poster_file_name(poster_template, profile_photo_path):
+    """
+    Poster file name, without extension, derived from the photo bytes and the template. Equal inputs share one
+    rendered file.
+    """
+    digest = hashlib.sha256(poster_template.fingerprint.encode())
+    with open(profile_photo_path, 'rb') as photo:
+        for block in iter(lambda: photo.read(1024 * 1024), b''):
+            digest.update(block)
+    return f'poster_{digest.hexdigest()[:32]}'
+
+
+def unused_posters(names):
+    """
+    Return the poster and thumbnail files that no poster row, including soft deleted ones, references.
+
+    :param names: Storage names of poster or thumbnail files
+    """
+    names = {name for name in names if name}
+    for model in (ImParticipating, IdCard):
+        for queryset in (model.objects.all(), model.objects.deleted()):
+            for batch in chunks(names, 500):
+                for poster, thumbnail in queryset.filter(Q(poster__in=batch) | Q(thumbnail__in=batch)).values_list(
+                        'poster', 'thumbnail'):
+                    names -= {poster, thumbnail}
+    return names
+
+
+def delete_unused_posters(names):
+    """
+    Delete the superseded poster files that are not referenced anymore.
+
+    A file modified within POSTER_GC_GRACE_SECONDS is kept even when unreferenced: it may have just been rendered,
+    or reused by cached_poster, for a row that is not saved yet. Its modified time is read after the references,
+    so a reuse that happened before that read keeps the file.
+
+    :param names: Storage names of superseded poster files
+    :return: Names of the deleted files
+    """
+    storage = ImParticipating._meta.get_field('poster').storage
+    cutoff = timezone.now() - timedelta(seconds=settings.POSTER_GC_GRACE_SECONDS)
+    deleted = set()
+    for name in unused_posters(names):
+        try:
+            if storage.get_modified_time(name) > cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        storage.delete(name)
+        deleted.add(name)
+    return deleted
+
+
+def touch_poster(storage, name):
+    """
+    Mark a poster file as in use, see delete_unused_posters.
+
+    :return: False if the file does not exist anymore
+    """
+    try:
+        os.utime(storage.path(name))
+    except FileNotFoundError:
+        return False
+    return True
+
+
 # Create your models here.
 
 class Poster(Model):
     profile_photo = models.ImageField(upload_to='profile_photos', null=True, validators=[validate_profile_photo])
     poster = models.ImageField(upload_to='posters', null=True, blank=True)
+    thumbnail = models.ImageField(upload_to='posters/thumbnails', null=True, blank=True)  # Shown in the admin list
     is_generated = models.BooleanField(default=False)
     member = models.ForeignKey('makeaton.TeamMember', on_delete=models.CASCADE)
     poster_template = None
@@ -42,32 +136,65 @@ class Poster(Model):
     def get_admin_url(self):
         return reverse('admin:%s_%s_change' % (self._meta.app_label, self._meta.model_name), args=[self.pk])
 
+    @classmethod
+    def cached_poster(cls, profile_photo_path):
+        """
+        Return the poster files of a photo, rendering them only if the same photo was not rendered with the same
+        template before.
+
+        :param profile_photo_path: Path of the profile photo
+        :return: (poster name, thumbnail name or None, None) or (None, None, remarks) when the poster could not be
+            rendered
+        """
+        template = cls.poster_template
+        poster_field, thumbnail_field = cls._meta.get_field('poster'), cls._meta.get_field('thumbnail')
+        try:
+            stem = poster_file_name(template, profile_photo_path)
+        except OSError as e:
+            return None, None, str(e)
+        name = poster_field.generate_filename(None, f'{stem}.{template.extension}')
+        thumbnail_name = None
+        if template.thumbnail_width:
+            thumbnail_name = thumbnail_field.generate_filename(
+                None, f'{stem}_{template.thumbnail_width}.{template.extension}')
+        # Touching the files both checks they exist and keeps delete_unused_posters off them until the row
+        # referencing them is saved
+        if touch_poster(poster_field.storage, name) and (
+                not thumbnail_name or touch_poster(thumbnail_field.storage, thumbnail_name)):
+            return name, thumbnail_name, None
+
+        content, thumbnail, remarks = render_poster(template, profile_photo_path)
+        if content is None:
+            return None, None, remarks
+        if not poster_field.storage.exists(name):
+            name = poster_field.storage.save(name, ContentFile(content))
+        if thumbnail is not None and not thumbnail_field.storage.exists(thumbnail_name):
+            thumbnail_name = thumbnail_field.storage.save(thumbnail_name, ContentFile(thumbnail))
+        return name, thumbnail_name, None
+
     def generate_poster(self):
+        """
+        Render the poster from the profile photo, run by the `updates.generate_posters` job.
+
+        `is_generated` is only set when the poster was rendered, otherwise `remarks` tells why it was not and the
+        previous poster, if any, is kept.
+
+        :return: True if the poster was generated
+        """
+        name = thumbnail_name = None
         if self.profile_photo and self.poster_template:
-            # Get the file path of the uploaded profile photo
-            profile_photo_path = self.profile_photo.path
-
-            # Generate the poster using the poster template
-            try:
-                result_image = self.poster_template.place_head(profile_photo_path)
-
-                # Save the result image to a BytesIO object
-                from io import BytesIO
-                from django.core.files.base import ContentFile
-
-                img_io = BytesIO()
-                result_image.save(img_io, format='PNG')
-                img_content = ContentFile(img_io.getvalue(), f'poster_{self.pk}.png')
-                timestamp = timezone.now().strftime('%Y%m%d%H%M%S') + uuid.uuid4().hex[:6]
-                # Save the generated poster to the poster field
-                self.poster.save(f'poster_{timestamp}.png', img_content)
-            except FaceNotDetectedError:
-                self.remarks = "Face not detected in the uploaded photo. Please upload a photo with a clear face."
-            except Exception as e:
-                self.remarks = str(e)
+            name, thumbnail_name, self.remarks = self.cached_poster(self.profile_photo.path)
         else:
-            self.remarks = "Profile photo or poster template not provided. Please upload a profile photo."
-        self.save(update_fields=['poster', 'remarks'])
+            self.remarks = NO_PROFILE_PHOTO
+        previous = [self.poster.name, self.thumbnail.name]
+        if name:
+            self.poster.name = name
+            self.thumbnail.name = thumbnail_name
+        self.is_generated = name is not None
+        self.save(update_fields=['poster', 'thumbnail', 'remarks', 'is_generated', 'updated_at'])
+        if name:
+            delete_unused_posters(set(previous) - {name, thumbnail_name})
+        return name is not None
 
 
 class IdCard(Poster):
@@ -81,6 +208,10 @@ class ImParticipating(Poster):
         base_image_path="updates/static/imparticipating.png",
         circle_diameter=780,
         center_coordinates=(175, 875),  # Top-left corner where the head will be placed
+        detection_max_side=settings.POSTER_DETECTION_MAX_SIDE,
+        output_format=settings.POSTER_FORMAT,
+        quality=settings.POSTER_QUALITY,
+        thumbnail_width=settings.POSTER_THUMBNAIL_WIDTH,
     )
 
     class Meta:
@@ -88,25 +219,21 @@ class ImParticipating(Poster):
         verbose_name_plural = "I'm Participating Posters"
 
 
-thread_locals = threading.local()
-
-
 @receiver(pre_save, sender=ImParticipating)
-def detect_profile_photo_change(sender, instance, **kwargs):
-    if not instance.pk:
+def detect_profile_photo_change(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'profile_photo' not in update_fields:
+        # Partial saves, such as the worker storing the poster, never change the photo
+        instance._generate_poster = False
+        return
+    if instance.pk is None:
         # New instance, so the poster needs to be generated
-        thread_locals.generate_poster = True
+        instance._generate_poster = True
     else:
-        try:
-            previous = ImParticipating.objects.get(pk=instance.pk)
-            if previous.profile_photo != instance.profile_photo:
-                # The profile_photo has changed
-                thread_locals.generate_poster = True
-            else:
-                thread_locals.generate_poster = False
-        except ImParticipating.DoesNotExist:
-            # Instance does not exist, so the poster needs to be generated
-            thread_locals.generate_poster = True
+        previous = ImParticipating.objects.filter(pk=instance.pk).values_list('profile_photo', flat=True).first()
+        instance._generate_poster = previous != instance.profile_photo.name
+    if instance._generate_poster:
+        instance.is_generated = False
+        instance.remarks = None
 
 
 class SocialMediaPosts(Model):
@@ -118,14 +245,6 @@ class SocialMediaPosts(Model):
 
 @receiver(post_save, sender=ImParticipating)
 def generate_poster_post_save(sender, instance, **kwargs):
-    generate_poster = getattr(thread_locals, 'generate_poster', False)
-    if generate_poster and instance.profile_photo:
-        # Generate the poster
-        instance.generate_poster()
-        # Save the poster field without triggering signals
-        from django.db.models.signals import post_save
-        # Temporarily disconnect the signal to avoid recursion
-        post_save.disconnect(generate_poster_post_save, sender=ImParticipating)
-        instance.save(update_fields=['poster'])
-        # Reconnect the signal
-        post_save.connect(generate_poster_post_save, sender=ImParticipating)
+    if getattr(instance, '_generate_poster', False) and instance.profile_photo:
+        # Rendered by the job worker so the upload returns immediately
+        enqueue('updates.generate_posters', [instance.pk])
@@ -1,6 +1,13 @@
+import threading
+from functools import lru_cache
+
 import cv2
 import numpy as np
 
+FACE_CASCADE = 'haarcascade_frontalface_default.xml'
+
+_detectors = threading.local()
+
 
 class FaceNotDetectedError(Exception):
     """Custom exception to raise when no face is detected."""
@@ -10,20 +17,63 @@ class FaceNotDetectedError(Exception):
         super().__init__(self.message)
 
 
-def detect_head_and_crop_circle(image_path, diameter_fraction=1, target_size=None):
+def get_cascade(name=FACE_CASCADE):
     """
-    Detects a head in the image using face detection, crops the image into a circular region
-    around the detected head, and returns the cropped image. The circle's diameter is based on
-    a fraction of the image width. If the circle overflows the top or bottom of the image, adjust
-    it to fit within the image boundaries.
+    Return a cascade classifier for the current thread, loaded from disk only on the thread's first call.
+
+    CascadeClassifier instances are not safe to share between threads, so every worker thread keeps its own.
+
+    Parameters:
+    - name: File name of the cascade in cv2.data.haarcascades
+
+    Returns:
+    - cascade: The loaded cv2.CascadeClassifier
+    """
+    cascades = getattr(_detectors, 'cascades', None)
+    if cascades is None:
+        cascades = _detectors.cascades = {}
+    if name not in cascades:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + name)
+        if cascade.empty():
+            raise ValueError(f"Unable to load the cascade {name}")
+        cascades[name] = cascade
+    return cascades[name]
+
+
+@lru_cache(maxsize=8)
+def circle_alpha(diameter):
+    """
+    Anti-aliased circular alpha of the given diameter, computed once per diameter and shared read-only.
+
+    Parameters:
+    - diameter: Width and height of the mask in pixels
+
+    Returns:
+    - alpha: uint8 array of shape (diameter, diameter), 255 inside the circle and 0 outside,
+      edge pixels weighted by how much of them the circle covers
+    """
+    radius = diameter / 2
+    offsets = np.arange(diameter, dtype=np.float32) + 0.5 - radius
+    distance = np.sqrt(offsets[:, None] ** 2 + offsets[None, :] ** 2)
+    alpha = (np.clip(radius - distance + 0.5, 0, 1) * 255 + 0.5).astype(np.uint8)
+    alpha.flags.writeable = False
+    return alpha
+
+
+def detect_head_and_crop_square(image_path, diameter_fraction=1, target_size=None, detection_max_side=None):
+    """
+    Detects a head in the image like detect_head_and_crop_circle, but returns the square bounding the circle
+    without masking it. Only the square is resized and padded, the rest of the photo is never copied.
 
     Parameters:
     - image_path: Path to the input image
     - diameter_fraction: Fraction of the image width to be used as the diameter of the circle
     - target_size: Desired size to resize the final image (int). If None, the image is not resized.
+    - detection_max_side: Longest side of the downscaled copy faces are detected on (int), None for full resolution
 
     Returns:
-    - final_image: The circular cropped (and possibly resized) image centered on the detected head
+    - square: BGR image of target_size x target_size (or the circle's diameter) centered on the detected head,
+      black where the circle overflowed the photo
 
     Raises:
     - FaceNotDetectedError: If no face is detected in the image
@@ -39,11 +89,19 @@ def detect_head_and_crop_circle(image_path, diameter_fraction=1, target_size=Non
     circle_diameter = int(original_width * diameter_fraction)
     radius = circle_diameter // 2
 
+    # Detect on a downscaled copy of large photos, the face box does not need full resolution
+    scale = 1
+    detection_image = image
+    if detection_max_side and max(original_height, original_width) > detection_max_side:
+        scale = detection_max_side / max(original_height, original_width)
+        size = (max(int(original_width * scale), 1), max(int(original_height * scale), 1))
+        detection_image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
     # Convert the image to grayscale (Haar cascades work better on grayscale images)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(detection_image, cv2.COLOR_BGR2GRAY)
 
-    # Load the Haar Cascade classifier for face detection
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    # Haar Cascade classifier for face detection, loaded once per thread
+    face_cascade = get_cascade()
 
     # Detect faces (heads) in the image
     faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
@@ -54,9 +112,9 @@ def detect_head_and_crop_circle(image_path, diameter_fraction=1, target_size=Non
     # Assume we only care about the first detected face
     (x, y, w, h) = faces[0]
 
-    # Calculate the center of the face/head
-    center_x = x + w // 2
-    center_y = y + h // 2
+    # Calculate the center of the face/head, in full resolution coordinates
+    center_x = int((x + w // 2) / scale)
+    center_y = int((y + h // 2) / scale)
 
     # Check for top or bottom overflow and adjust the center_y
     if center_y - radius < 0:  # If the circle overflows the top
@@ -69,38 +127,59 @@ def detect_head_and_crop_circle(image_path, diameter_fraction=1, target_size=Non
     elif center_x + radius > original_width:  # If the circle overflows the right
         center_x = original_width - radius  # Adjust to touch the right
 
-    # Create a mask with the same dimensions as the original image
-    mask = np.zeros((original_height, original_width), dtype=np.uint8)
-
-    # Draw a white-filled circle on the mask based on the adjusted diameter and center
-    cv2.circle(mask, (center_x, center_y), radius, (255, 255, 255), -1)
-
-    # Create a circular cropped version of the original image
-    circular_crop = cv2.bitwise_and(image, image, mask=mask)
-
     # Crop the square that bounds the circle
     left = max(center_x - radius, 0)
     right = min(center_x + radius, original_width)
     top = max(center_y - radius, 0)
     bottom = min(center_y + radius, original_height)
-    cropped_image = circular_crop[top:bottom, left:right]
-
-    # Resize the image to ensure the head is centered (optional)
-    desired_size = max(cropped_image.shape[:2])
-    final_image = cv2.copyMakeBorder(
-        cropped_image,
-        top=(desired_size - cropped_image.shape[0]) // 2,
-        bottom=(desired_size - cropped_image.shape[0] + 1) // 2,
-        left=(desired_size - cropped_image.shape[1]) // 2,
-        right=(desired_size - cropped_image.shape[1] + 1) // 2,
+    region = image[top:bottom, left:right]
+
+    # Resize only the bounding square, then pad it to a square at the target scale
+    desired_size = max(region.shape[:2])
+    if target_size is not None and target_size != desired_size:
+        scale = target_size / desired_size
+        size = (max(round(region.shape[1] * scale), 1), max(round(region.shape[0] * scale), 1))
+        region = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+        desired_size = target_size
+    if region.shape[0] == region.shape[1] == desired_size:
+        return region
+    return cv2.copyMakeBorder(
+        region,
+        top=(desired_size - region.shape[0]) // 2,
+        bottom=(desired_size - region.shape[0] + 1) // 2,
+        left=(desired_size - region.shape[1]) // 2,
+        right=(desired_size - region.shape[1] + 1) // 2,
         borderType=cv2.BORDER_CONSTANT,
         value=(0, 0, 0)  # Black padding
     )
 
-    # Optionally resize the image to the target size
-    if target_size is not None:
-        final_image = cv2.resize(final_image, (target_size, target_size), interpolation=cv2.INTER_AREA)
 
+def detect_head_and_crop_circle(image_path, diameter_fraction=1, target_size=None, detection_max_side=None):
+    """
+    Detects a head in the image using face detection, crops the image into a circular region
+    around the detected head, and returns the cropped image. The circle's diameter is based on
+    a fraction of the image width. If the circle overflows the top or bottom of the image, adjust
+    it to fit within the image boundaries.
+
+    Parameters:
+    - image_path: Path to the input image
+    - diameter_fraction: Fraction of the image width to be used as the diameter of the circle
+    - target_size: Desired size to resize the final image (int). If None, the image is not resized.
+    - detection_max_side: Longest side of the downscaled copy faces are detected on (int). The face box is
+      mapped back to the full resolution image. If None, faces are detected on the full resolution image.
+
+    Returns:
+    - final_image: The circular cropped (and possibly resized) image centered on the detected head
+
+    Raises:
+    - FaceNotDetectedError: If no face is detected in the image
+    """
+    final_image = detect_head_and_crop_square(image_path, diameter_fraction, target_size, detection_max_side)
+    if final_image.base is not None:
+        # An unresized, unpadded square is a view of the photo
+        final_image = final_image.copy()
+    # Black out the corners outside the circle
+    final_image[circle_alpha(final_image.shape[0]) < 128] = 0
     return final_image
 
 
@@ -1,8 +1,59 @@
-import cv2
+import hashlib
+import threading
+from functools import cached_property
+from io import BytesIO
+
 import numpy as np
-from PIL import Image, ImageDraw
+from PIL import Image
+
+from updates.services import face_with_target_size
+from updates.services.face_with_target_size import circle_alpha, detect_head_and_crop_square
+
+# Bump when the output changes without a change to RENDER_SOURCES, e.g. an OpenCV upgrade that detects faces
+# differently, so posters cached under the old output are rendered again
+RENDER_VERSION = 2
+
+# Source files of the face crop and the compositing, part of the template fingerprint so that any change to them
+# renders new posters
+RENDER_SOURCES = (face_with_target_size.__file__, __file__)
+
+# Posters are stored at half the resolution of the template
+OUTPUT_SCALE = 0.5
+
+# Output format: (PIL format, file extension)
+ENCODINGS = {
+    'png': ('PNG', 'png'),
+    'jpeg': ('JPEG', 'jpg'),
+    'webp': ('WEBP', 'webp'),
+}
+
+
+def encode_image(image, output_format='png', quality=85):
+    """
+    Encode an image for storage.
 
-from updates.services.face_with_target_size import detect_head_and_crop_circle
+    Parameters:
+    - image: PIL image, RGB or RGBA
+    - output_format: One of ENCODINGS
+    - quality: JPEG and WebP quality (1-100), ignored for PNG
+
+    Returns:
+    - content: The encoded bytes
+    """
+    pil_format, _ = ENCODINGS[output_format]
+    options = {}
+    if output_format == 'jpeg':
+        if image.mode == 'RGBA':
+            # JPEG has no alpha, transparent areas are flattened onto white
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        options = {'quality': quality, 'optimize': True, 'progressive': True}
+    elif output_format == 'webp':
+        options = {'quality': quality, 'method': 4}
+    img_io = BytesIO()
+    image.save(img_io, format=pil_format, **options)
+    return img_io.getvalue()
 
 
 class PosterTemplate:
@@ -10,7 +61,8 @@ class PosterTemplate:
     Represents the poster template with a circular space for a headshot.
     """
 
-    def __init__(self, base_image_path, circle_diameter, center_coordinates):
+    def __init__(self, base_image_path, circle_diameter, center_coordinates, detection_max_side=None,
+                 output_format='png', quality=85, thumbnail_width=None):
         """
         Initialize the Poster with the base image, circle diameter, and center coordinates.
 
@@ -18,52 +70,138 @@ class PosterTemplate:
         - base_image_path: Path to the base poster image
         - circle_diameter: Diameter of the circle where the head will be placed
         - center_coordinates: (x, y) coordinates for the top-left corner where the head will be placed
+        - detection_max_side: Longest side of the downscaled copy used for face detection, None for full resolution
+        - output_format: Encoding of the rendered poster, one of ENCODINGS
+        - quality: JPEG and WebP quality (1-100)
+        - thumbnail_width: Width of the thumbnail rendered with every poster, None for no thumbnail
         """
-        # Load the base poster image
-        self.base_image = Image.open(base_image_path).convert("RGBA")
+        self.base_image_path = base_image_path
         self.circle_diameter = circle_diameter
         self.center_coordinates = center_coordinates
+        self.detection_max_side = detection_max_side
+        if output_format not in ENCODINGS:
+            raise ValueError(f"Unknown poster format {output_format}, expected one of {', '.join(ENCODINGS)}")
+        self.output_format = output_format
+        self.quality = quality
+        self.thumbnail_width = thumbnail_width
+        self._buffers = threading.local()
+
+    @cached_property
+    def scaled_base(self):
+        """
+        The decoded RGBA base poster at output resolution, loaded on first use and copied by every following poster.
+        The full resolution template is not kept.
+        """
+        with Image.open(self.base_image_path) as base_image:
+            base_image = base_image.convert("RGBA")
+        width, height = base_image.size
+        scaled_base = np.asarray(base_image.resize((int(width * OUTPUT_SCALE), int(height * OUTPUT_SCALE))))
+        scaled_base.flags.writeable = False
+        return scaled_base
 
-    def place_head(self, head_image_path):
+    @cached_property
+    def head_box(self):
+        """
+        (left, top, diameter) of the head circle at output resolution.
+        """
+        left, top = self.center_coordinates
+        return round(left * OUTPUT_SCALE), round(top * OUTPUT_SCALE), round(self.circle_diameter * OUTPUT_SCALE)
+
+    @cached_property
+    def head_alpha(self):
+        """
+        Anti-aliased circular alpha of the head area as uint16 weights, the same for every poster.
         """
-        Places a person's head onto the self in the designated circular area.
+        return circle_alpha(self.head_box[2]).astype(np.uint16)[..., None]
+
+    @cached_property
+    def fingerprint(self):
+        """
+        Hash of the base image, the render code and every parameter that affects the rendered poster.
+        """
+        digest = hashlib.sha256(f"{RENDER_VERSION}:{self.circle_diameter}:{self.center_coordinates}:"
+                                f"{self.detection_max_side}:{self.output_format}:{self.quality}:"
+                                f"{self.thumbnail_width}".encode())
+        for path in (self.base_image_path,) + RENDER_SOURCES:
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+        return digest.hexdigest()
+
+    @property
+    def extension(self):
+        return ENCODINGS[self.output_format][1]
+
+    def render(self, head_image_path):
+        """
+        Place the head and encode the poster and its thumbnail.
 
         Parameters:
-        - poster: A Poster object representing the base poster
         - head_image_path: Path to the image containing the person's head
 
         Returns:
-        - result_image: The final image with the head placed on the poster
+        - (poster, thumbnail): Encoded bytes, thumbnail is None without a thumbnail width
+
+        The poster is composed in an output buffer reused by every poster rendered on this thread. The image
+        composed in it shares the buffer's memory, so it never leaves this method: only encoded bytes are
+        returned, and those stay valid when the next poster overwrites the buffer.
         """
-        # Use the previous function to crop the head to a circle
-        # We will assume detect_head_and_crop_circle exists and is working
-        cropped_head_resized = detect_head_and_crop_circle(
-            head_image_path, diameter_fraction=1, target_size=self.circle_diameter
-        )
+        buffer = getattr(self._buffers, 'output', None)
+        if buffer is None:
+            buffer = self._buffers.output = np.empty_like(self.scaled_base)
+        result_image = self.place_head(head_image_path, out=buffer)
+        try:
+            poster = encode_image(result_image, self.output_format, self.quality)
+            thumbnail = None
+            if self.thumbnail_width:
+                height = round(result_image.height * self.thumbnail_width / result_image.width)
+                thumbnail_image = result_image.resize((self.thumbnail_width, height), Image.BILINEAR,
+                                                      reducing_gap=2.0)
+                thumbnail = encode_image(thumbnail_image, self.output_format, self.quality)
+        finally:
+            result_image.close()
+        return poster, thumbnail
 
-        # Convert OpenCV image (BGR) to PIL image (RGBA)
-        cropped_head_resized_rgb = cv2.cvtColor(cropped_head_resized, cv2.COLOR_BGR2RGB)
-        cropped_head_pil = Image.fromarray(cropped_head_resized_rgb).convert("RGBA")
+    def warm(self):
+        """
+        Load the cached images ahead of the first poster, called when a worker starts.
+        """
+        return self.scaled_base, self.head_alpha
 
-        # Create an alpha mask (circle)
-        width, height = cropped_head_pil.size
-        alpha_mask = Image.new("L", (width, height), 0)
-        draw = ImageDraw.Draw(alpha_mask)
-        draw.ellipse((0, 0, width, height), fill=255)
+    def place_head(self, head_image_path, out=None):
+        """
+        Places a person's head onto the poster in the designated circular area.
 
-        # Add alpha channel to the image using the mask
-        cropped_head_pil.putalpha(alpha_mask)
+        Only the square bounding the circle is cropped, resized and blended, straight from the BGR photo into
+        the RGBA output at output resolution.
 
-        # Prepare the result image by copying the base poster
-        result_image = self.base_image.copy()
+        Parameters:
+        - head_image_path: Path to the image containing the person's head
+        - out: Optional preallocated array shaped like scaled_base to compose the poster in
 
-        # Paste the head onto the poster using the alpha channel as mask
-        result_image.paste(
-            cropped_head_pil, self.center_coordinates, mask=cropped_head_pil
+        Returns:
+        - result_image: The final image with the head placed on the poster. It shares memory with `out`, so it
+          changes when `out` is written again
+        """
+        left, top, diameter = self.head_box
+        head = detect_head_and_crop_square(
+            head_image_path, diameter_fraction=1, target_size=diameter,
+            detection_max_side=self.detection_max_side
         )
-        # resize the image to its 1/4
-        result_image = result_image.resize((result_image.width // 2, result_image.height // 2))
-        return result_image
+
+        if out is None:
+            out = np.empty_like(self.scaled_base)
+        np.copyto(out, self.scaled_base)
+
+        # Blend inside the bounding square only, clipped to the poster
+        region = out[top:top + diameter, left:left + diameter]
+        height, width = region.shape[:2]
+        alpha = self.head_alpha[:height, :width]
+        inverse = 255 - alpha
+        # The head is opaque, reversing the channels reads BGR as RGB without converting the crop
+        rgb = region[..., :3]
+        rgb[...] = (head[:height, :width, ::-1] * alpha + rgb * inverse + 127) // 255
+        region[..., 3:] = (255 * alpha + region[..., 3:] * inverse + 127) // 255
+        return Image.fromarray(out)
 
 # if __name__ == "__main__":
 #     # Example usage
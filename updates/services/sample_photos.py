@@ -0,0 +1,55 @@
+import os
+
+import cv2
+import numpy as np
+
+# (width, height, face centre x, face centre y, face scale) of the sample photos, covering small, landscape,
+# portrait and camera sized photos
+SAMPLE_PHOTOS = (
+    (800, 1000, 400, 450, 2.5),
+    (1200, 900, 500, 400, 3),
+    (4000, 3000, 1800, 1400, 10),
+    (3000, 4000, 1500, 1800, 12),
+    (640, 480, 320, 240, 1.5),
+)
+
+
+def draw_face(width, height, center_x, center_y, scale, seed=0):
+    """
+    Draw a synthetic frontal face the Haar cascade detects, on a noisy background. The same arguments always give
+    the same image.
+
+    :return: BGR image
+    """
+    rng = np.random.default_rng(seed)
+    image = (np.full((height, width, 3), (90, 120, 160), np.uint8) + rng.integers(0, 30, (height, width, 3))).astype(
+        np.uint8)
+
+    def size(value):
+        return max(int(value * scale), 1)
+
+    cv2.ellipse(image, (center_x, center_y), (size(70), size(95)), 0, 0, 360, (150, 180, 220), -1)
+    for dx in (-30, 30):
+        # Eyes and eyebrows
+        cv2.ellipse(image, (center_x + int(dx * scale), center_y - size(20)), (size(16), size(9)), 0, 0, 360,
+                    (40, 40, 40), -1)
+        cv2.line(image, (center_x + int((dx - 18) * scale), center_y - size(42)),
+                 (center_x + int((dx + 18) * scale), center_y - size(42)), (30, 30, 30), size(6))
+    cv2.line(image, (center_x, center_y - size(10)), (center_x, center_y + size(20)), (110, 130, 170), size(4))
+    cv2.ellipse(image, (center_x, center_y + size(45)), (size(28), size(10)), 0, 0, 360, (60, 60, 130), -1)
+    return cv2.GaussianBlur(image, (0, 0), max(scale, 1))
+
+
+def write_sample_photos(directory):
+    """
+    Write the sample photos as JPEG files, e.g. for benchmarks that must be reproducible without real photos.
+
+    :param directory: Existing directory
+    :return: Paths of the written photos
+    """
+    paths = []
+    for seed, (width, height, center_x, center_y, scale) in enumerate(SAMPLE_PHOTOS):
+        path = os.path.join(directory, f'sample_{seed}_{width}x{height}.jpg')
+        cv2.imwrite(path, draw_face(width, height, center_x, center_y, scale, seed), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(path)
+    return paths
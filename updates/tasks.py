@@ -0,0 +1,18 @@
+from base.jobs import on_worker_start, register_task
+from updates.models import ImParticipating
+from updates.services.face_with_target_size import get_cascade
+
+
+@register_task('updates.generate_posters')
+def generate_posters_task(poster_ids):
+    failed = 0
+    for poster in ImParticipating.objects.filter(id__in=poster_ids).select_related('member'):
+        if not poster.generate_poster():
+            failed += 1
+    return failed
+
+
+@on_worker_start
+def warm_poster_renderer():
+    get_cascade()
+    ImParticipating.poster_template.warm()
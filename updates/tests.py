@@ -1,3 +1,163 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+import numpy as np
+from PIL import Image
+
+from authentication.models import User
+from makeaton.models import Team, TeamMember
+from updates.models import FACE_NOT_DETECTED, NO_PROFILE_PHOTO, ImParticipating, delete_unused_posters
+from updates.services.face_with_target_size import detect_head_and_crop_circle
+from updates.services.poster import PosterTemplate
+from updates.services.sample_photos import write_sample_photos
+
+
+def blank_photo(name='photo.png', color=(200, 200, 200)):
+    content = io.BytesIO()
+    Image.new('RGB', (400, 400), color).save(content, 'PNG')
+    return SimpleUploadedFile(name, content.getvalue(), content_type='image/png')
+
+
+class GeneratePosterTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        team = Team.objects.create(name='Team', leader_phone='9876500000')
+        self.member = TeamMember.objects.create(team=team, name='Member', email='member@example.com',
+                                                phone_number='9876500001', approval_status='pending',
+                                                level_of_study='UG', college_name='College',
+                                                major_field_of_study='CS')
+
+    def test_missing_photo_is_recorded(self):
+        poster = ImParticipating.objects.create(member=self.member)
+        self.assertFalse(poster.generate_poster())
+        poster.refresh_from_db()
+        self.assertEqual((poster.is_generated, poster.remarks), (False, NO_PROFILE_PHOTO))
+
+    def test_failed_render_is_recorded(self):
+        poster = ImParticipating.objects.create(member=self.member, profile_photo=blank_photo())
+        self.assertFalse(poster.generate_poster())
+        poster.refresh_from_db()
+        self.assertEqual((poster.is_generated, poster.remarks, poster.poster.name), (False, FACE_NOT_DETECTED, ''))
+
+    @mock.patch('updates.models.render_poster', return_value=(b'poster', b'thumbnail', None))
+    def test_rendered_poster_is_marked_generated(self, render_poster):
+        poster = ImParticipating.objects.create(member=self.member, profile_photo=blank_photo())
+        self.assertTrue(poster.generate_poster())
+        poster.refresh_from_db()
+        self.assertEqual((poster.is_generated, poster.remarks), (True, None))
+        self.assertTrue(poster.poster.storage.exists(poster.poster.name))
+
+        # A new photo that fails keeps the previous poster but is no longer marked generated
+        poster.profile_photo = blank_photo('other.png', color=(100, 100, 100))
+        poster.save()
+        render_poster.return_value = (None, None, FACE_NOT_DETECTED)
+        self.assertFalse(poster.generate_poster())
+        poster.refresh_from_db()
+        self.assertEqual((poster.is_generated, poster.remarks), (False, FACE_NOT_DETECTED))
+        self.assertTrue(poster.poster.name)
+
+    def test_changelist_shows_why_a_poster_failed(self):
+        failed = ImParticipating.objects.create(member=self.member, profile_photo=blank_photo())
+        failed.generate_poster()
+        other = TeamMember.objects.create(team=self.member.team, name='Other', email='other@example.com',
+                                          phone_number='9876500002', approval_status='pending', level_of_study='UG',
+                                          college_name='College', major_field_of_study='CS')
+        ImParticipating.objects.create(member=other, profile_photo=blank_photo('other.png', color=(100, 100, 100)))
+        admin = User.objects.create_superuser(email='admin@example.com', full_name='Admin', password=None)
+        self.client.force_login(admin)
+
+        response = self.client.get(reverse('admin:updates_imparticipating_changelist'))
+        self.assertContains(response, FACE_NOT_DETECTED)
+        # Only the poster that was not rendered yet is in progress
+        self.assertContains(response, 'Your poster is being generated', count=1)
+
+    def age(self, name, seconds):
+        path = ImParticipating._meta.get_field('poster').storage.path(name)
+        os.utime(path, (time.time() - seconds,) * 2)
+
+    @mock.patch('updates.models.render_poster', return_value=(b'poster', b'thumbnail', None))
+    def test_unused_posters_are_deleted_after_the_grace_period(self, render_poster):
+        poster = ImParticipating.objects.create(member=self.member, profile_photo=blank_photo())
+        poster.generate_poster()
+        previous = {poster.poster.name, poster.thumbnail.name}
+        poster.profile_photo = blank_photo('other.png', color=(100, 100, 100))
+        poster.save()
+        poster.generate_poster()
+        storage = poster.poster.storage
+
+        # Just rendered, so possibly about to be referenced by a row that is not saved yet
+        self.assertEqual(delete_unused_posters(previous), set())
+        self.assertTrue(all(storage.exists(name) for name in previous))
+        for name in previous:
+            self.age(name, settings.POSTER_GC_GRACE_SECONDS + 60)
+        self.assertEqual(delete_unused_posters(previous | {poster.poster.name}), previous)
+        self.assertFalse(any(storage.exists(name) for name in previous))
+        self.assertTrue(storage.exists(poster.poster.name))
+
+    @mock.patch('updates.models.render_poster', return_value=(b'poster', b'thumbnail', None))
+    def test_reused_poster_is_not_collected(self, render_poster):
+        poster = ImParticipating.objects.create(member=self.member, profile_photo=blank_photo())
+        poster.generate_poster()
+        name, thumbnail_name = poster.poster.name, poster.thumbnail.name
+        for stale in (name, thumbnail_name):
+            self.age(stale, settings.POSTER_GC_GRACE_SECONDS + 60)
+        ImParticipating.objects.filter(pk=poster.pk).delete()
+        ImParticipating.objects.deleted().filter(pk=poster.pk).update(poster=None, thumbnail=None)
+
+        # Another member reuses the files, which must survive a collection that runs before its row is saved
+        self.assertEqual(ImParticipating.cached_poster(poster.profile_photo.path), (name, thumbnail_name, None))
+        render_poster.assert_called_once()
+        self.assertEqual(delete_unused_posters({name, thumbnail_name}), set())
+        self.assertTrue(poster.poster.storage.exists(name))
+
+
+class PosterTemplateTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.photos = write_sample_photos(self.directory)
+
+    def test_sample_faces_are_detected(self):
+        # benchmark_posters relies on every sample photo having a detectable face
+        for path in self.photos:
+            with self.subTest(path=path):
+                self.assertEqual(detect_head_and_crop_circle(path, target_size=100, detection_max_side=1024).shape[:2],
+                                 (100, 100))
+
+    def test_renders_do_not_share_the_output_buffer(self):
+        base_image_path = os.path.join(self.directory, 'template.png')
+        Image.new('RGBA', (600, 800), (20, 60, 120, 255)).save(base_image_path)
+        template = PosterTemplate(base_image_path, circle_diameter=400, center_coordinates=(100, 200),
+                                  detection_max_side=1024, thumbnail_width=100)
+        first, second = self.photos[0], self.photos[4]
+
+        poster, thumbnail = template.render(first)
+        self.assertNotEqual(template.render(second)[0], poster)
+        # The second render reused the buffer of the first, whose bytes must be unaffected
+        self.assertEqual(template.render(first), (poster, thumbnail))
+        with Image.open(io.BytesIO(poster)) as image:
+            self.assertTrue(np.array_equal(np.asarray(image), np.asarray(template.place_head(first))))
+
+    def test_changing_the_render_code_changes_the_fingerprint(self):
+        source = os.path.join(self.directory, 'crop.py')
+
+        def fingerprint(code):
+            with open(source, 'w') as file:
+                file.write(code)
+            with mock.patch('updates.services.poster.RENDER_SOURCES', (source,)):
+                return PosterTemplate('updates/static/imparticipating.png', 780, (175, 875)).fingerprint
+
+        self.assertEqual(fingerprint('margin = 0.2'), fingerprint('margin = 0.2'))
+        self.assertNotEqual(fingerprint('margin = 0.2'), fingerprint('margin = 0.3'))